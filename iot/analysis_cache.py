@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+知覚ハッシュによるAI分析結果のキャッシュ
+
+同じポーズを数秒間続けると、連続したフレームはほぼ同じ画像になる。
+それでも毎回 Gemini の往復を待ち、同じ場面のアメコミ変換・LINE送信まで繰り返していた。
+
+ここではフレームの dHash（9×8 に縮小したグレースケール画像の隣接ピクセルの大小、64ビット）を
+キーに分析結果を保持し、ハミング距離が max_distance 以下の直近のエントリーがあれば
+Gemini を呼ばずにその結果（{'face_detected': bool, 'is_pose': bool}）を返す。
+
+- エントリーは ttl 秒で期限切れ（同じ場面でも時間が経てば分析・送信し直す）
+- max_entries を超えたら最も長く使われていないものから捨てる（LRU）
+- mark_sent() で「この場面は送信済み（送信中）」と記録し、is_sent() で同じ場面の再送信を抑止できる
+
+使用例:
+    cache = AnalysisCache(ttl=30.0, max_distance=6)
+    key = dhash(frame.data)
+    entry = cache.lookup(key, camera=frame.camera)
+    if entry is None:
+        entry = cache.store(key, analyze_person_and_pose(frame.data), camera=frame.camera)
+    if not cache.is_sent(entry):
+        cache.mark_sent(entry.key, camera=frame.camera)
+        send(frame)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from analysis_result import AnalysisResult
+from motion_filter import decode_thumbnail
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+HASH_SIZE = 8  # dHash の1辺（HASH_SIZE * HASH_SIZE ビット）
+DEFAULT_MAX_DISTANCE = 6  # 64ビット中この数以下の違いなら同じ場面とみなす
+DEFAULT_TTL = 30.0
+DEFAULT_MAX_ENTRIES = 128
+
+
+def dhash(image_data, hash_size: int = HASH_SIZE) -> int:
+    """
+    画像の dHash（差分ハッシュ）を返す
+
+    (hash_size + 1) × hash_size に縮小したグレースケール画像で、各行の隣り合うピクセルの
+    左 > 右 を1ビットとする。明るさ・JPEGノイズの小さな違いではビットがほとんど変わらない。
+
+    Args:
+        image_data: JPEGデータ（bytes / bytearray / memoryview）
+        hash_size: ハッシュの1辺
+    """
+    pixels = decode_thumbnail(image_data, (hash_size + 1, hash_size))
+    bits = (pixels[:, :-1] > pixels[:, 1:]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class CacheEntry:
+    """1場面分の分析結果"""
+
+    def __init__(self, key: int, result: AnalysisResult, camera: str, created_at: float):
+        self.key = key
+        self.result = result
+        self.camera = camera
+        self.created_at = created_at
+        self.hits = 0
+        self.sent = False  # この場面のアメコミ画像を送信済みか
+
+
+class AnalysisCache:
+    """
+    知覚ハッシュをキーにした、TTL付きLRUの分析結果キャッシュ
+
+    複数のワーカースレッドから同時に使ってよい。検索はエントリー数に対して線形だが、
+    max_entries は数百程度を想定しており、1回あたりマイクロ秒単位で終わる。
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_distance: int = DEFAULT_MAX_DISTANCE,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            ttl: エントリーの有効期間（秒）
+            max_distance: 同じ場面とみなすハミング距離の上限
+            max_entries: 保持するエントリー数の上限
+        """
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.suppressed = 0
+        self._entries: "OrderedDict[Tuple[str, int], CacheEntry]" = OrderedDict()  # 古い順
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: int, camera: str = "default") -> Optional[CacheEntry]:
+        """
+        同じカメラの近い場面のエントリーを返す（無ければNone）
+
+        ヒットしたエントリーは最近使ったものとして末尾に移す。
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            best: Optional[CacheEntry] = None
+            best_distance = self.max_distance + 1
+            for entry in self._entries.values():
+                if entry.camera != camera:
+                    continue
+                distance = hamming_distance(entry.key, key)
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((best.camera, best.key))
+            best.hits += 1
+            self.hits += 1
+            return best
+
+    def store(self, key: int, result: AnalysisResult, camera: str = "default") -> CacheEntry:
+        """分析結果を登録する（上限を超えたら最も長く使われていないものを捨てる）"""
+        entry = CacheEntry(key, result, camera, time.time())
+        with self._lock:
+            self._entries.pop((camera, key), None)
+            self._entries[(camera, key)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def mark_sent(self, key: int, camera: str = "default", sent: bool = True) -> None:
+        """
+        この場面を送信済み（送信中）にする
+
+        変換・送信を始める時点で印を付けると、処理中に届いた同じ場面のフレームも抑止できる。
+        送信に失敗した場合は sent=False で印を外す。
+
+        Args:
+            key: lookup() / store() が返したエントリーの key（フレーム自身のハッシュではない）
+            camera: カメラ
+            sent: 付ける印
+        """
+        with self._lock:
+            entry = self._entries.get((camera, key))
+            if entry is not None:
+                entry.sent = sent
+
+    def is_sent(self, entry: CacheEntry) -> bool:
+        """この場面が送信済みか（送信済みなら再送信の抑止件数に数える）"""
+        with self._lock:
+            if entry.sent:
+                self.suppressed += 1
+            return entry.sent
+
+    def _expire(self, now: float) -> None:
+        """期限切れのエントリーを捨てる（作成時刻順ではないので全体を見る）"""
+        expired = [k for k, entry in self._entries.items() if now - entry.created_at >= self.ttl]
+        for k in expired:
+            del self._entries[k]
+
+    def print_stats(self) -> None:
+        lookups = self.hits + self.misses
+        if not lookups:
+            return
+        print(f"📊 分析キャッシュ: ヒット {self.hits}回 / ミス {self.misses}回 "
+              f"(ヒット率 {self.hits / lookups * 100:.0f}%), 再送信の抑止 {self.suppressed}回, "
+              f"保持 {len(self)}件")
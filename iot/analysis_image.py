@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+AI分析用の縮小画像
+
+人の顔・ポーズの有無（Yes/No が2つ）を聞くだけなのに、受信したJPEGをそのまま
+Gemini に送っていた。高解像度（2608×1960 など）では1リクエスト数MBになる。
+ここでは長辺 max_edge・JPEG品質 quality に縮小・再エンコードしたものだけを分析に送り、
+元の解像度のフレームはアメコミ変換・アップロード用にそのまま残す。
+
+デコードは Pillow の draft() で JPEG の DCT スケーリング（1/2〜1/8）を使うため、
+フル解像度を展開してから縮小するより速い。既に長辺が max_edge 以下の画像は
+再エンコードせずにそのまま送る（QVGA など）。
+
+使用例:
+    downscaler = AnalysisDownscaler(max_edge=768, quality=85)
+    prepared = downscaler.prepare(frame.data)
+    model.generate_content([prompt, {"mime_type": "image/jpeg", "data": prepared.data}])
+"""
+
+import threading
+import time
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from spresense_io import as_bytes
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+DEFAULT_MAX_EDGE = 768  # Gemini は画像を 768px 単位のタイルで扱うため、これより大きくしても判定材料は増えにくい
+DEFAULT_QUALITY = 85
+
+
+class PreparedImage:
+    """分析に送る画像と縮小の記録"""
+
+    def __init__(self, data: bytes, original_bytes: int, original_size: Tuple[int, int],
+                 size: Tuple[int, int], seconds: float):
+        """
+        Args:
+            data: 分析に送るJPEGデータ
+            original_bytes: 元のJPEGのバイト数
+            original_size: 元の画像サイズ（幅, 高さ）
+            size: 送る画像のサイズ（幅, 高さ）
+            seconds: 縮小・再エンコードにかかった秒数
+        """
+        self.data = data
+        self.original_bytes = original_bytes
+        self.original_size = original_size
+        self.size = size
+        self.seconds = seconds
+
+    @property
+    def resized(self) -> bool:
+        return self.size != self.original_size
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    def describe(self) -> str:
+        """1行の説明（ログ表示用）"""
+        if not self.resized:
+            return f"{self.size[0]}x{self.size[1]} {len(self.data):,} bytes（縮小不要）"
+        ratio = self.saved_bytes / self.original_bytes * 100 if self.original_bytes else 0.0
+        return (f"{self.original_size[0]}x{self.original_size[1]} → {self.size[0]}x{self.size[1]}, "
+                f"{self.original_bytes:,} → {len(self.data):,} bytes（-{ratio:.0f}%、"
+                f"縮小 {self.seconds * 1000:.1f}ms）")
+
+
+class AnalysisDownscaler:
+    """
+    分析用にJPEGを縮小し、削減したバイト数とリクエスト時間を集計する
+
+    複数のワーカースレッドから同時に使ってよい。
+    """
+
+    def __init__(self, max_edge: Optional[int] = DEFAULT_MAX_EDGE, quality: int = DEFAULT_QUALITY):
+        """
+        Args:
+            max_edge: 長辺の上限（ピクセル、None なら縮小しない）
+            quality: 再エンコードのJPEG品質（1〜95）
+        """
+        self.max_edge = max_edge
+        self.quality = quality
+        self.requests = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.resize_seconds = 0.0
+        self.request_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def prepare(self, image_data) -> PreparedImage:
+        """
+        分析に送る画像を作る
+
+        デコードできない・縮小不要の場合は元のデータをそのまま返す（分析側でエラーにする）。
+        """
+        start = time.perf_counter()
+        original_bytes = len(image_data)
+        try:
+            with Image.open(BytesIO(image_data)) as image:
+                original_size = image.size
+                if not self.max_edge or max(original_size) <= self.max_edge:
+                    return PreparedImage(as_bytes(image_data), original_bytes, original_size,
+                                         original_size, time.perf_counter() - start)
+                scale = self.max_edge / max(original_size)
+                target = (max(1, round(original_size[0] * scale)), max(1, round(original_size[1] * scale)))
+                image.draft("RGB", target)  # 1/2〜1/8 に縮小しながらデコード
+                resized = image.convert("RGB").resize(target, Image.BILINEAR)
+            output = BytesIO()
+            resized.save(output, format="JPEG", quality=self.quality)
+            data = output.getvalue()
+        except Exception:
+            return PreparedImage(as_bytes(image_data), original_bytes, (0, 0), (0, 0),
+                                 time.perf_counter() - start)
+        if len(data) >= original_bytes:
+            # 縮小しても小さくならない（元が高圧縮）なら元のまま送る
+            return PreparedImage(as_bytes(image_data), original_bytes, original_size,
+                                 original_size, time.perf_counter() - start)
+        return PreparedImage(data, original_bytes, original_size, target, time.perf_counter() - start)
+
+    def record(self, prepared: PreparedImage, request_seconds: float) -> None:
+        """1リクエスト分の送信バイト数・時間を集計に加える"""
+        with self._lock:
+            self.requests += 1
+            self.original_bytes += prepared.original_bytes
+            self.sent_bytes += len(prepared.data)
+            self.resize_seconds += prepared.seconds
+            self.request_seconds += request_seconds
+
+    def print_stats(self) -> None:
+        with self._lock:
+            if not self.requests:
+                return
+            saved = self.original_bytes - self.sent_bytes
+            ratio = saved / self.original_bytes * 100 if self.original_bytes else 0.0
+            print(f"📊 分析用画像: {self.requests}リクエスト, 送信 {self.sent_bytes / 1024:.0f} KB "
+                  f"（元 {self.original_bytes / 1024:.0f} KB、-{ratio:.0f}%）, "
+                  f"縮小平均 {self.resize_seconds / self.requests * 1000:.1f}ms, "
+                  f"リクエスト平均 {self.request_seconds / self.requests:.2f}秒")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+AI分析結果のレスポンススキーマと厳密なパーサー
+
+プロンプトの文章で「JSONで答えて」と頼むだけだと、Markdownのコードブロックや
+シングルクォートの辞書が返ることがあり、行単位の除去・置換や、
+'yes' が応答のどこかに含まれるかどうかで判定する不正確なフォールバックが必要だった
+（顔だけ映ったフレームもポーズありと判定されうる）。
+
+ここでは Gemini に型付きのレスポンススキーマ（真偽値）を渡して構造化出力を強制し、
+応答は json.loads 1回と型の確認だけで読む。スキーマどおりでない応答は推測せず
+AnalysisParseError にする。どの分析器もこのモジュールのスキーマとパーサーを使う。
+
+使用例:
+    response = model.generate_content([prompt, image_part], generation_config=generation_config())
+    result = parse_analysis(response.text)  # {'face_detected': True, 'is_pose': False}
+"""
+
+import json
+from typing import Dict, Iterable, Optional, Sequence
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+ANALYSIS_FIELDS = ("face_detected", "is_pose")
+FRAME_ID_FIELD = "frame_id"
+
+AnalysisResult = Dict[str, bool]
+
+
+class AnalysisParseError(ValueError):
+    """応答がレスポンススキーマどおりでない"""
+
+
+# =============================================================================
+# レスポンススキーマ
+# =============================================================================
+
+def analysis_schema(fields: Sequence[str] = ANALYSIS_FIELDS) -> dict:
+    """1枚分の結果 {field: bool, ...} のスキーマ"""
+    return {
+        "type": "OBJECT",
+        "properties": {field: {"type": "BOOLEAN"} for field in fields},
+        "required": list(fields),
+    }
+
+
+def batch_schema(fields: Sequence[str] = ANALYSIS_FIELDS) -> dict:
+    """複数枚分の結果 [{frame_id: str, field: bool, ...}, ...] のスキーマ"""
+    item = analysis_schema(fields)
+    item["properties"] = {FRAME_ID_FIELD: {"type": "STRING"}, **item["properties"]}
+    item["required"] = [FRAME_ID_FIELD, *fields]
+    return {"type": "ARRAY", "items": item}
+
+
+def generation_config(schema: Optional[dict] = None) -> dict:
+    """
+    構造化出力を指定する generation_config / config
+
+    google.generativeai は渡した辞書の response_schema を書き換えるため、呼び出し毎に新しく作る。
+    """
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": schema if schema is not None else analysis_schema(),
+    }
+
+
+# =============================================================================
+# パーサー
+# =============================================================================
+
+def _load(text: str):
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError) as e:
+        raise AnalysisParseError(f"JSONではありません: {e}") from e
+
+
+def _read_fields(item: dict, fields: Iterable[str]) -> AnalysisResult:
+    result = {}
+    for field in fields:
+        value = item.get(field)
+        if not isinstance(value, bool):
+            raise AnalysisParseError(f"'{field}' が真偽値ではありません: {value!r}")
+        result[field] = value
+    return result
+
+
+def parse_analysis(text: str, fields: Sequence[str] = ANALYSIS_FIELDS) -> AnalysisResult:
+    """
+    1枚分の応答を読む
+
+    Raises:
+        AnalysisParseError: JSONでない・オブジェクトでない・項目が真偽値でない
+    """
+    item = _load(text)
+    if not isinstance(item, dict):
+        raise AnalysisParseError(f"JSONオブジェクトではありません: {type(item).__name__}")
+    return _read_fields(item, fields)
+
+
+def parse_batch(text: str, frame_ids: Iterable[str],
+                fields: Sequence[str] = ANALYSIS_FIELDS) -> Dict[str, AnalysisResult]:
+    """
+    複数枚分の応答を frame_id 毎に読む
+
+    要素単位で読めないもの・知らない frame_id は結果に含めない
+    （含まれなかったフレームは呼び出し元で1枚ずつ分析し直す）。
+
+    Raises:
+        AnalysisParseError: JSONでない・配列でない
+    """
+    items = _load(text)
+    if not isinstance(items, list):
+        raise AnalysisParseError(f"JSON配列ではありません: {type(items).__name__}")
+    wanted = set(frame_ids)
+    results: Dict[str, AnalysisResult] = {}
+    for item in items:
+        frame_id = item.get(FRAME_ID_FIELD) if isinstance(item, dict) else None
+        if not isinstance(frame_id, str) or frame_id not in wanted:
+            continue
+        try:
+            results[frame_id] = _read_fields(item, fields)
+        except AnalysisParseError:
+            continue
+    return results
+
+
+def format_flag(value: bool) -> str:
+    """ログ表示用の Yes / No"""
+    return "Yes" if value else "No"
+
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+人・ポーズ判定の分析バックエンド
+
+analyze_person_and_pose は google.generativeai に直結していたため、通信なしで
+パイプラインの負荷試験をしたり、バックエンド同士を比べたりできなかった。
+ここでは共通の Analyzer インターフェースと、次の実装を用意する。
+
+- GeminiAnalyzer: Gemini（レスポンススキーマ付き、共有リクエストプール経由）
+- RuleBasedAnalyzer: 通信なしの簡易判定（肌色ピクセルの割合。精度ではなく基準値・負荷試験用）
+- HttpAnalyzer: JPEGを POST して同じスキーマのJSONを受け取る（mock_analysis_server.py など）
+
+どの実装も analyze() の所要時間を記録し、print_stats() で p50 / p95 / p99 を表示する。
+
+使用例:
+    analyzer = create_analyzer("http", url="http://127.0.0.1:8765/analyze")
+    result = analyzer.analyze(frame.data)  # {'face_detected': bool, 'is_pose': bool} または None
+"""
+
+import threading
+import time
+from io import BytesIO
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from analysis_image import AnalysisDownscaler
+from analysis_result import AnalysisResult, format_flag, generation_config, parse_analysis
+from frame_telemetry import RollingHistogram
+from gemini_clients import get_generative_model
+from gemini_pool import get_request_pool
+from spresense_io import as_bytes
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+ANALYZER_BACKENDS = ("gemini", "rule", "http")
+DEFAULT_GEMINI_MODEL = 'gemini-2.5-flash'
+DEFAULT_MOCK_URL = "http://127.0.0.1:8765/analyze"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+LATENCY_WINDOW = 1024
+
+# 人・ポーズ判定プロンプト（要件に基づく。出力形式はレスポンススキーマで指定）
+ANALYSIS_PROMPT = (
+    "この画像について分析してください。\n"
+    "1. face_detected: 人の顔は映っていますか？\n"
+    "2. is_pose: 映っている場合、その人はカメラに向かって何かポーズ（ピースサイン、グッドサイン、ガッツポーズ）をしていますか？"
+)
+
+
+class AnalyzerHTTPError(Exception):
+    """分析サーバーがエラーのステータスを返した（code で再試行の可否を判定する）"""
+
+    def __init__(self, code: int, message: str = ""):
+        super().__init__(f"HTTP {code} {message}".strip())
+        self.code = code
+
+
+class Analyzer:
+    """
+    分析バックエンドの共通インターフェース
+
+    実装は _analyze() を定義する（例外はここで表示して None にする）。
+    analyze() は複数のワーカースレッドから同時に呼んでよい。
+    """
+
+    name = "analyzer"
+
+    def __init__(self):
+        self.latency = RollingHistogram(LATENCY_BUCKETS, window=LATENCY_WINDOW)
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def analyze(self, image_data) -> Optional[AnalysisResult]:
+        """
+        画像を分析する
+
+        Returns:
+            {"face_detected": bool, "is_pose": bool} または None（失敗時）
+        """
+        start = time.perf_counter()
+        try:
+            result = self._analyze(image_data)
+        except Exception as e:
+            print(f"❌ 分析エラー（{self.name}）: {e}")
+            result = None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latency.observe(elapsed)
+            if result is None:
+                self.failures += 1
+        return result
+
+    def _analyze(self, image_data) -> Optional[AnalysisResult]:
+        raise NotImplementedError
+
+    def print_stats(self) -> None:
+        with self._lock:
+            count = self.latency.count
+            if not count:
+                return
+            p50, p95, p99 = (self.latency.quantile(q) for q in (0.5, 0.95, 0.99))
+            mean = self.latency.sum / count
+            failures = self.failures
+        print(f"📊 分析バックエンド（{self.name}）: {count}回（失敗 {failures}回）, "
+              f"平均 {mean * 1000:.0f}ms / p50 {p50 * 1000:.0f}ms / p95 {p95 * 1000:.0f}ms / "
+              f"p99 {p99 * 1000:.0f}ms（直近{LATENCY_WINDOW}回）")
+
+
+# =============================================================================
+# 実装
+# =============================================================================
+
+class GeminiAnalyzer(Analyzer):
+    """Gemini で判定する（分析用に縮小した画像を共有リクエストプール経由で送る）"""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str = DEFAULT_GEMINI_MODEL, api_key: Optional[str] = None,
+                 downscaler: Optional[AnalysisDownscaler] = None):
+        """
+        Args:
+            model_name: 分析に使うモデル
+            api_key: APIキー（省略時は環境変数）
+            downscaler: 分析用の縮小（省略時は縮小しない）
+        """
+        super().__init__()
+        self.model_name = model_name
+        self.api_key = api_key
+        self.downscaler = downscaler or AnalysisDownscaler(max_edge=None)
+
+    def _analyze(self, image_data) -> Optional[AnalysisResult]:
+        # モデルはプロセスで1つを共有（フレーム毎の初期化・TLSハンドシェイクを避ける）
+        model = get_generative_model(self.model_name, self.api_key)
+
+        # 分析用に縮小（長辺 --analysis-max-edge、品質 --analysis-quality）
+        prepared = self.downscaler.prepare(image_data)
+        print(f"📐 分析用画像: {prepared.describe()}")
+
+        print("🔍 Gemini AIで人・ポーズ判定中...")
+        start_time = time.time()
+
+        # 共有プールで実行（同時実行数・レート制限、429/5xx の再試行、期限）
+        response = get_request_pool().call(self.model_name, lambda timeout: model.generate_content(
+            [ANALYSIS_PROMPT, {"mime_type": "image/jpeg", "data": prepared.data}],
+            generation_config=generation_config(),
+            request_options={"timeout": timeout},
+        ))
+
+        end_time = time.time()
+        self.downscaler.record(prepared, end_time - start_time)
+        print(f"⏱️ AI分析完了 (処理時間: {end_time - start_time:.2f}秒, 送信 {len(prepared.data):,} bytes)")
+
+        result = parse_analysis(response.text)
+        print(f"👁️  人の顔: {format_flag(result['face_detected'])}")
+        print(f"🤲 ポーズ: {format_flag(result['is_pose'])}")
+        return result
+
+
+class RuleBasedAnalyzer(Analyzer):
+    """
+    肌色ピクセルの割合による通信なしの簡易判定
+
+    縮小デコードした画像の YCbCr で肌色（Cb 77〜127, Cr 133〜173）の割合を数え、
+    face_ratio 以上なら顔あり、pose_ratio 以上（顔に加えて手・腕が大きく写っている）ならポーズありとする。
+    ポーズの種類は見分けられないので、精度の比較対象・オフラインの負荷試験用に使う。
+    """
+
+    name = "rule"
+
+    def __init__(self, face_ratio: float = 0.03, pose_ratio: float = 0.12,
+                 size: Tuple[int, int] = (64, 48)):
+        """
+        Args:
+            face_ratio: 顔ありとする肌色ピクセルの割合
+            pose_ratio: ポーズありとする肌色ピクセルの割合
+            size: 判定用の縮小サイズ（幅, 高さ）
+        """
+        super().__init__()
+        self.face_ratio = face_ratio
+        self.pose_ratio = pose_ratio
+        self.size = size
+
+    def skin_ratio(self, image_data) -> float:
+        with Image.open(BytesIO(image_data)) as image:
+            image.draft("YCbCr", self.size)
+            pixels = np.asarray(image.convert("YCbCr").resize(self.size, Image.BILINEAR))
+        cb, cr = pixels[:, :, 1], pixels[:, :, 2]
+        skin = (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173)
+        return float(skin.mean())
+
+    def _analyze(self, image_data) -> Optional[AnalysisResult]:
+        ratio = self.skin_ratio(image_data)
+        return {"face_detected": ratio >= self.face_ratio, "is_pose": ratio >= self.pose_ratio}
+
+
+class HttpAnalyzer(Analyzer):
+    """
+    JPEGを POST して {"face_detected": bool, "is_pose": bool} を受け取る
+
+    429 / 5xx・接続エラー・タイムアウトは共有リクエストプールが再試行する（レート制限は URL 毎）。
+    """
+
+    name = "http"
+
+    def __init__(self, url: str = DEFAULT_MOCK_URL):
+        """
+        Args:
+            url: 分析エンドポイント（mock_analysis_server.py の /analyze など）
+        """
+        super().__init__()
+        import requests
+        self.url = url
+        self._session = requests.Session()  # 接続を使い回す
+
+    def _analyze(self, image_data) -> Optional[AnalysisResult]:
+        body = as_bytes(image_data)
+
+        def request(timeout):
+            response = self._session.post(self.url, data=body, timeout=timeout,
+                                          headers={"Content-Type": "image/jpeg"})
+            if response.status_code >= 400:
+                raise AnalyzerHTTPError(response.status_code, response.reason or "")
+            return response.text
+
+        return parse_analysis(get_request_pool().call(self.url, request))
+
+
+def create_analyzer(backend: str = "gemini", model_name: str = DEFAULT_GEMINI_MODEL,
+                    api_key: Optional[str] = None, downscaler: Optional[AnalysisDownscaler] = None,
+                    url: str = DEFAULT_MOCK_URL) -> Analyzer:
+    """
+    バックエンド名から Analyzer を作る
+
+    Args:
+        backend: gemini / rule / http
+        model_name: gemini のモデル名
+        api_key: gemini のAPIキー
+        downscaler: gemini の分析用縮小
+        url: http の分析エンドポイント
+    """
+    if backend == "gemini":
+        return GeminiAnalyzer(model_name, api_key, downscaler)
+    if backend == "rule":
+        return RuleBasedAnalyzer()
+    if backend == "http":
+        return HttpAnalyzer(url)
+    raise ValueError(f"不明な分析バックエンド: {backend}（{' / '.join(ANALYZER_BACKENDS)}）")
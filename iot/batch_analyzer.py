@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+複数フレームをまとめて1リクエストで分析するバッチ分析器
+
+パイプライン・マルチカメラ運用では、1フレーム1回の generate_content の往復より
+速くフレームが溜まる。ここでは分析待ちのフレームを最大 max_batch 枚、または
+最初のフレームから max_wait 秒まで集め、1回のリクエストで
+
+    [{"frame_id": "...", "face_detected": true/false, "is_pose": true/false}, ...]
+
+の JSON 配列（analysis_result.batch_schema）として答えさせ、各フレームの Future に結果を返す。
+キューが浅い時（1枚しか集まらない時）は待たずに従来どおり1枚で分析する。
+応答から結果を取り出せなかったフレームだけ、1枚ずつの分析にフォールバックする。
+
+フレームを集めるのは専用スレッド1本だが、集めたバッチ（と1枚ずつの分析）は
+リクエストプールの同時実行数（max_concurrency）まで並行して送る。
+全ての枠が使用中の間は次のバッチを集め始めないので、その間に溜まったフレームは
+次のバッチにまとめられる。
+
+使用例:
+    batcher = BatchAnalyzer(analyze_single=analyze_person_and_pose, max_batch=4, max_wait=0.2)
+    result = batcher.analyze(frame.data)  # 複数スレッドから同時に呼ぶとまとめて送られる
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from analysis_result import AnalysisParseError, AnalysisResult, batch_schema, generation_config, parse_batch
+from gemini_clients import get_generative_model
+from gemini_pool import get_request_pool
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+DEFAULT_MAX_BATCH = 4
+DEFAULT_MAX_WAIT = 0.2  # 秒
+DEFAULT_MODEL = 'gemini-2.5-flash'
+
+BATCH_PROMPT = (
+    "これから {count} 枚の画像を送ります。各画像の直前に frame_id を示します。\n"
+    "それぞれの画像について分析してください。\n"
+    "1. face_detected: 人の顔は映っていますか？\n"
+    "2. is_pose: 映っている場合、その人はカメラに向かって何かポーズ（ピースサイン、グッドサイン、ガッツポーズ）をしていますか？\n"
+    "結果は全ての画像について、frame_id 毎に1要素の配列で出力してください。"
+)
+
+
+class _Request:
+    def __init__(self, image_data, frame_id: str):
+        self.image_data = image_data
+        self.frame_id = frame_id
+        self.future: Future = Future()
+
+
+class BatchAnalyzer:
+    """
+    分析待ちのフレームを集めて1リクエストで分析する
+
+    analyze() / submit() は複数のワーカースレッドから同時に呼んでよい。
+    フレームは専用スレッド1本が集め、リクエストは max_concurrency 本まで並行して送る。
+    """
+
+    def __init__(self, analyze_single: Callable[[bytes], Optional[AnalysisResult]],
+                 max_batch: int = DEFAULT_MAX_BATCH, max_wait: float = DEFAULT_MAX_WAIT,
+                 model_name: str = DEFAULT_MODEL, api_key: Optional[str] = None,
+                 prepare: Optional[Callable[[bytes], bytes]] = None,
+                 max_concurrency: Optional[int] = None):
+        """
+        Args:
+            analyze_single: 1枚を分析する関数（1枚しか集まらない時・フォールバック用）
+            max_batch: 1リクエストにまとめる最大枚数
+            max_wait: 最初のフレームから追加のフレームを待つ最大秒数
+            model_name: バッチリクエストに使うモデル
+            api_key: APIキー（省略時は環境変数）
+            prepare: バッチリクエストに載せる前に画像を変換する関数（分析用の縮小など）
+            max_concurrency: 並行して送るリクエスト数（省略時は最初の submit() 時点の
+                共有リクエストプールの同時実行数）
+        """
+        self.analyze_single = analyze_single
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.model_name = model_name
+        self.api_key = api_key
+        self.prepare = prepare
+        self.max_concurrency = max_concurrency
+        self.stats = {'requests': 0, 'batched_frames': 0, 'single_frames': 0, 'fallback_frames': 0}
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[threading.Semaphore] = None
+
+    def submit(self, image_data) -> Future:
+        """分析を予約して Future を返す（結果は分析結果の辞書、失敗時はNone）"""
+        with self._lock:
+            self._sequence += 1
+            request = _Request(image_data, f"f{self._sequence}")
+            if self._thread is None:
+                if self.max_concurrency is None:
+                    self.max_concurrency = get_request_pool().max_concurrency
+                self.max_concurrency = max(1, self.max_concurrency)
+                self._slots = threading.Semaphore(self.max_concurrency)
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix="batch-request")
+                self._thread = threading.Thread(target=self._run, name="batch-analyzer", daemon=True)
+                self._thread.start()
+        self._queue.put(request)
+        return request.future
+
+    def analyze(self, image_data) -> Optional[AnalysisResult]:
+        """分析結果が出るまで待って返す"""
+        return self.submit(image_data).result()
+
+    # -------------------------------------------------------------------------
+    # バッチ処理
+    # -------------------------------------------------------------------------
+
+    def _collect(self) -> List[_Request]:
+        """最初の1件を待ち、max_batch 件か max_wait 秒まで追加分を集める"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            # 送信枠が空くまで次のバッチを集め始めない（待つ間に溜まった分をまとめる）
+            self._slots.acquire()
+            batch = self._collect()
+            task = self._executor.submit(self._process, batch)
+            task.add_done_callback(lambda task, batch=batch: self._finish(task, batch))
+
+    def _process(self, batch: List[_Request]) -> None:
+        if len(batch) == 1:
+            self._analyze_one(batch[0])
+            with self._lock:
+                self.stats['single_frames'] += 1
+        else:
+            self._analyze_batch(batch)
+
+    def _finish(self, task: Future, batch: List[_Request]) -> None:
+        """送信が終わったら枠を返し、例外で終わったバッチのフレームを失敗（None）にする"""
+        self._slots.release()
+        error = task.exception()
+        if error is None:
+            return
+        print(f"❌ バッチ分析エラー: {error}")
+        for request in batch:
+            if not request.future.done():
+                request.future.set_result(None)
+
+    def _analyze_one(self, request: _Request) -> None:
+        try:
+            request.future.set_result(self.analyze_single(request.image_data))
+        except Exception as e:
+            print(f"❌ AI分析エラー: {e}")
+            request.future.set_result(None)
+
+    def _analyze_batch(self, batch: List[_Request]) -> None:
+        frame_ids = [request.frame_id for request in batch]
+        contents: List = [BATCH_PROMPT.format(count=len(batch))]
+        for request in batch:
+            data = self.prepare(request.image_data) if self.prepare else bytes(request.image_data)
+            contents.append(f"frame_id: {request.frame_id}")
+            contents.append({"mime_type": "image/jpeg", "data": data})
+
+        print(f"🔍 Gemini AIで {len(batch)}枚をまとめて人・ポーズ判定中...")
+        start_time = time.time()
+        try:
+            model = get_generative_model(self.model_name, self.api_key)
+            response = get_request_pool().call(self.model_name, lambda timeout: model.generate_content(
+                contents, generation_config=generation_config(batch_schema()),
+                request_options={"timeout": timeout},
+            ))
+            results = parse_batch(response.text, frame_ids)
+        except AnalysisParseError as e:
+            print(f"⚠️ バッチ応答を解析できません（1枚ずつ分析します）: {e}")
+            results = {}
+        except Exception as e:
+            print(f"⚠️ バッチ分析に失敗（1枚ずつ分析します）: {e}")
+            results = {}
+        elapsed = time.time() - start_time
+
+        missing = [request for request in batch if request.frame_id not in results]
+        print(f"⏱️ バッチ分析完了: {len(batch)}枚 / {elapsed:.2f}秒（1枚あたり {elapsed / len(batch):.2f}秒）"
+              + (f", {len(missing)}枚は1枚ずつ再分析" if missing else ""))
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['batched_frames'] += len(batch) - len(missing)
+            self.stats['fallback_frames'] += len(missing)
+
+        for request in batch:
+            if request.frame_id in results:
+                request.future.set_result(results[request.frame_id])
+        # フォールバックも並行して送る（結果は各フレームの Future に直接返る）
+        for request in missing:
+            self._executor.submit(self._analyze_one, request)
+
+    def print_stats(self) -> None:
+        with self._lock:
+            stats = dict(self.stats)
+        if not stats['requests'] and not stats['single_frames']:
+            return
+        sent = stats['batched_frames'] + stats['fallback_frames']
+        average = sent / stats['requests'] if stats['requests'] else 0.0
+        print(f"📊 バッチ分析: バッチ {stats['requests']}回（平均 {average:.1f}枚）, "
+              f"1枚ずつ {stats['single_frames']}回, フォールバック {stats['fallback_frames']}枚")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+JPEGフレーム受信バッファのマイクロベンチマーク
+
+従来の bytes 連結（jpeg_data += chunk）と FrameBuffer を、
+フレームサイズを倍々に変えながら比較する。
+FrameBuffer は「1MBあたりの時間」がサイズに依らずほぼ一定（線形）になり、
+bytes 連結はサイズに比例して増えていく（二乗）ことを確認できる。
+
+使用例:
+python bench_frame_buffer.py
+python bench_frame_buffer.py --max-mb 16 --repeat 5
+"""
+
+import argparse
+import io
+import os
+import time
+from typing import Callable, List
+
+from spresense_io import FrameBuffer, RECEIVE_CHUNK_SIZE
+
+
+class _ChunkedSource(io.RawIOBase):
+    """シリアルポートの代わりに固定チャンクでデータを返す読み取り元"""
+
+    def __init__(self, data: bytes, chunk_size: int):
+        self._data = memoryview(data)
+        self._pos = 0
+        self._chunk_size = chunk_size
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        n = min(size, self._chunk_size, len(self._data) - self._pos)
+        chunk = bytes(self._data[self._pos:self._pos + n])
+        self._pos += n
+        return chunk
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self._chunk_size, len(self._data) - self._pos)
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+def receive_with_bytes_concat(source: _ChunkedSource) -> bytes:
+    """従来方式: 不変 bytes への連結"""
+    jpeg_data = b''
+    while True:
+        chunk = source.read(RECEIVE_CHUNK_SIZE)
+        if not chunk:
+            break
+        jpeg_data += chunk
+    return jpeg_data
+
+
+def receive_with_frame_buffer(source: _ChunkedSource) -> bytearray:
+    """新方式: FrameBuffer への直接読み込み"""
+    frame = FrameBuffer()
+    while frame.read_from(source, RECEIVE_CHUNK_SIZE):
+        pass
+    return frame.detach()
+
+
+def _measure(receiver: Callable, payload: bytes, repeat: int) -> float:
+    """repeat 回実行した中での最短時間（秒）を返す"""
+    best = float('inf')
+    for _ in range(repeat):
+        source = _ChunkedSource(payload, RECEIVE_CHUNK_SIZE)
+        start = time.perf_counter()
+        result = receiver(source)
+        best = min(best, time.perf_counter() - start)
+        assert len(result) == len(payload)
+    return best
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description="JPEGフレーム受信バッファのベンチマーク")
+    parser.add_argument('--max-mb', type=float, default=8.0, help='最大フレームサイズ (MB)')
+    parser.add_argument('--repeat', type=int, default=3, help='各サイズの試行回数')
+    args = parser.parse_args()
+
+    sizes: List[int] = []
+    size = 256 * 1024
+    while size <= args.max_mb * 1024 * 1024:
+        sizes.append(size)
+        size *= 2
+
+    print("📊 JPEGフレーム受信バッファ ベンチマーク")
+    print(f"   チャンクサイズ: {RECEIVE_CHUNK_SIZE} bytes / 試行回数: {args.repeat}")
+    print("=" * 72)
+    print(f"{'サイズ':>10} | {'bytes連結':>12} | {'FrameBuffer':>12} | {'ms/MB(連結)':>12} | {'ms/MB(FB)':>10}")
+    print("-" * 72)
+
+    for size in sizes:
+        payload = os.urandom(size)
+        mb = size / (1024 * 1024)
+        concat_time = _measure(receive_with_bytes_concat, payload, args.repeat)
+        buffer_time = _measure(receive_with_frame_buffer, payload, args.repeat)
+        print(
+            f"{size // 1024:>8}KB | {concat_time * 1000:>10.1f}ms | {buffer_time * 1000:>10.1f}ms | "
+            f"{concat_time * 1000 / mb:>12.1f} | {buffer_time * 1000 / mb:>10.1f}"
+        )
+
+    print("=" * 72)
+    print("💡 ms/MB が一定なら線形、サイズと共に増えるなら二乗の振る舞いです")
+
+
+if __name__ == "__main__":
+    main()
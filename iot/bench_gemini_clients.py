@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Geminiクライアント生成コストのベンチマーク
+
+従来の「呼び出し毎に作り直す」方式と、gemini_clients のレジストリで共有する方式の
+1回あたりのオーバーヘッドを比較する。
+
+- オフライン（既定）: クライアント・モデルの生成だけを計測する（通信しない）
+- --live: GEMINI_API_KEY を使い、モデル情報の取得（生成はしない軽いリクエスト）の
+  往復時間を計測する。作り直す方式では毎回新しい接続（TLSハンドシェイク）になる
+
+使用例:
+python bench_gemini_clients.py
+python bench_gemini_clients.py --repeat 200
+python bench_gemini_clients.py --live --repeat 10
+"""
+
+import argparse
+import os
+import statistics
+import time
+from typing import Callable, List
+
+import gemini_clients
+from gemini_clients import get_genai_client, get_generative_model
+
+MODEL_NAME = 'gemini-2.5-flash'
+DUMMY_API_KEY = "bench-dummy-key"  # オフライン計測では通信しないので任意の文字列でよい
+
+
+def measure(label: str, fn: Callable[[], None], repeat: int) -> List[float]:
+    """fn を repeat 回実行して1回あたりの時間（ミリ秒）を表示する"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:<44} 平均 {statistics.mean(samples):9.3f} ms  "
+          f"中央値 {statistics.median(samples):9.3f} ms  p95 {p95:9.3f} ms")
+    return samples
+
+
+def bench_offline(api_key: str, repeat: int) -> None:
+    import google.generativeai as legacy_genai
+    from google import genai
+
+    def legacy_per_call():
+        legacy_genai.configure(api_key=api_key)
+        legacy_genai.GenerativeModel(MODEL_NAME)
+
+    def client_per_call():
+        genai.Client(api_key=api_key)
+
+    print("📊 生成オーバーヘッド（通信なし）")
+    before = measure("作り直し: configure + GenerativeModel", legacy_per_call, repeat)
+    gemini_clients.clear()
+    get_generative_model(MODEL_NAME, api_key)  # 初回の生成は計測から除く（2回目以降のコストを見る）
+    after = measure("共有: get_generative_model", lambda: get_generative_model(MODEL_NAME, api_key), repeat)
+    print(f"   → {statistics.mean(before) / max(statistics.mean(after), 1e-9):.0f}倍")
+    before = measure("作り直し: genai.Client", client_per_call, repeat)
+    get_genai_client(api_key)
+    after = measure("共有: get_genai_client", lambda: get_genai_client(api_key), repeat)
+    print(f"   → {statistics.mean(before) / max(statistics.mean(after), 1e-9):.0f}倍")
+
+
+def bench_live(api_key: str, repeat: int) -> None:
+    from google import genai
+
+    def fresh_client():
+        genai.Client(api_key=api_key).models.get(model=MODEL_NAME)
+
+    def shared_client():
+        get_genai_client(api_key).models.get(model=MODEL_NAME)
+
+    print("📊 往復時間（models.get、生成はしない）")
+    gemini_clients.clear()
+    shared_client()  # 接続を確立しておく
+    measure("作り直し: 毎回新しいClient（新規接続）", fresh_client, repeat)
+    measure("共有: get_genai_client（接続を再利用）", shared_client, repeat)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Geminiクライアント生成コストのベンチマーク")
+    parser.add_argument("--repeat", type=int, default=50, help="計測回数（既定: 50）")
+    parser.add_argument("--live", action="store_true",
+                        help="GEMINI_API_KEY で実際に通信して往復時間を計測する")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    api_key = os.getenv(gemini_clients.API_KEY_ENV)
+    if args.live:
+        if not api_key:
+            print(f"❌ --live には環境変数 {gemini_clients.API_KEY_ENV} が必要です")
+            return
+        bench_live(api_key, args.repeat)
+    else:
+        bench_offline(api_key or DUMMY_API_KEY, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""
+追記専用のセグメント型キャプチャアーカイブ
+
+長時間の撮影で全フレームを残す場合、captured_images に小さなJPEGファイルを
+何千個も並べると一覧・削除・バックアップが遅くなる。アーカイブモードでは
+
+    segment_<先頭の通し番号10桁>.seg  … フレーム本体を追記するセグメントファイル
+    segment_<先頭の通し番号10桁>.idx  … 1フレーム16バイトの固定長オフセット索引
+
+の組にフレームを追記していき、セグメントが segment_bytes を超えたら次のセグメントに切り替える。
+アーカイブ全体が max_bytes を超えた場合は古いセグメントから丸ごと削除する。
+
+読み出しは mmap 経由で、ArchiveRecord.data はセグメントの該当範囲を指す
+読み取り専用の memoryview（コピーなし）になる。iter_range() で時刻範囲・カメラを
+指定して取り出せる（索引はメモリ上に載せ、セグメント単位の時刻範囲で読み飛ばす）。
+
+セグメント内の1レコードは
+
+    ヘッダー '<4sIdIH'（マジック, ペイロード長, 受信時刻, CRC32, カメラ名の長さ）
+    + カメラ名（UTF-8）+ JPEGデータ
+
+で、索引はセグメント本体を書いた後に追記する。異常終了で索引が欠けた場合は
+起動時に最後のセグメントを走査してCRCの合うレコードまで索引を復元し、
+途中で切れたレコードは切り詰める。
+
+復元（切り詰め・索引の書き直し）は追記するプロセスだけが行う。追記用に開くと
+ディレクトリのロックファイルを排他ロックし、別のプロセスが追記中なら開けない。
+一覧・書き出し・再分析など読むだけの場合は read_only=True で開く。ファイルには
+一切書き込まず、索引に載っていない末尾（追記中のレコード）は無視する。
+
+コマンドライン:
+    python capture_archive.py info capture_archive
+    python capture_archive.py export capture_archive exported --start 2025-10-18T12:00 --end 2025-10-18T13:00
+"""
+
+import argparse
+import io
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from spresense_io import Frame, FrameSink
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+ARCHIVE_DIR = "capture_archive"
+DEFAULT_SEGMENT_BYTES = 256 * 1024 * 1024  # セグメントを切り替えるサイズ
+RECORD_MAGIC = b"SPAR"
+RECORD_HEADER = struct.Struct("<4sIdIH")  # マジック, ペイロード長, 受信時刻, CRC32, カメラ名の長さ
+INDEX_ENTRY = struct.Struct("<dQ")  # 受信時刻, セグメント内のレコード開始位置
+SEGMENT_PATTERN = re.compile(r"^segment_(\d{10})\.seg$")
+LOCK_FILE = "archive.lock"  # 追記するプロセスが排他ロックする
+
+
+def segment_name(first_sequence: int) -> str:
+    """セグメントファイル名（拡張子なし）"""
+    return f"segment_{first_sequence:010d}"
+
+
+class ArchiveLockedError(RuntimeError):
+    """別のプロセスが追記中のアーカイブを追記用に開こうとした"""
+
+
+class ArchiveRecord:
+    """アーカイブから読み出した1フレーム（data はセグメントを指す memoryview）"""
+
+    def __init__(self, sequence: int, timestamp: float, camera: str, data: memoryview,
+                 segment: str, offset: int):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.camera = camera
+        self.data = data
+        self.segment = segment
+        self.offset = offset
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    @property
+    def name(self) -> str:
+        """書き出し時のファイル名"""
+        prefix = "capture" if self.camera == "default" else f"capture_{self.camera}"
+        return f"{prefix}_{self.sequence:08d}.jpg"
+
+
+# =============================================================================
+# セグメント
+# =============================================================================
+
+class _Segment:
+    """1組のセグメントファイルと索引（索引はメモリ上にも保持する）"""
+
+    def __init__(self, directory: str, first_sequence: int):
+        self.first_sequence = first_sequence
+        base = os.path.join(directory, segment_name(first_sequence))
+        self.path = base + ".seg"
+        self.index_path = base + ".idx"
+        self.timestamps: List[float] = []
+        self.offsets: List[int] = []
+        self.size = 0  # 索引に載っているレコードの末尾
+        self.min_ts = float("inf")
+        self.max_ts = float("-inf")
+        self._map: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    def _add_entry(self, timestamp: float, offset: int, end: int) -> None:
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+        self.size = end
+        self.min_ts = min(self.min_ts, timestamp)
+        self.max_ts = max(self.max_ts, timestamp)
+
+    # -------------------------------------------------------------------------
+    # 読み込み・復元
+    # -------------------------------------------------------------------------
+
+    def load(self, recover: bool = False) -> None:
+        """
+        索引を読み込む
+
+        Args:
+            recover: True なら索引より後ろのレコードを走査して索引を復元し、
+                途中で切れたレコードを切り詰める（追記を再開する最後のセグメント用）
+        """
+        file_size = os.path.getsize(self.path)
+        try:
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            raw = b""
+        usable = len(raw) - len(raw) % INDEX_ENTRY.size
+        with open(self.path, "rb") as f:
+            for timestamp, offset in INDEX_ENTRY.iter_unpack(raw[:usable]):
+                f.seek(offset)
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                _, size, _, _, camera_len = RECORD_HEADER.unpack(header)
+                end = offset + RECORD_HEADER.size + camera_len + size
+                if end > file_size:
+                    break  # 本体が書き込まれる前に止まった索引
+                self._add_entry(timestamp, offset, end)
+        if not recover:
+            return
+
+        recovered = self._scan_tail(file_size)
+        if recovered or usable != len(raw) or len(self) * INDEX_ENTRY.size != usable:
+            self._rewrite_index()
+        if self.size < file_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(self.size)
+            print(f"⚠️ {self.name}: 書き込み途中のレコードを切り詰めました（{file_size - self.size:,} bytes）")
+        if recovered:
+            print(f"🩹 {self.name}: 索引に無い {recovered}件のレコードを復元しました")
+
+    def _scan_tail(self, file_size: int) -> int:
+        """索引の末尾より後ろにあるレコードをCRCで検証しながら索引に加える"""
+        recovered = 0
+        with open(self.path, "rb") as f:
+            offset = self.size
+            while offset + RECORD_HEADER.size <= file_size:
+                f.seek(offset)
+                magic, size, timestamp, crc, camera_len = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                end = offset + RECORD_HEADER.size + camera_len + size
+                if magic != RECORD_MAGIC or end > file_size:
+                    break
+                f.seek(camera_len, os.SEEK_CUR)
+                if zlib.crc32(f.read(size)) != crc:
+                    break
+                self._add_entry(timestamp, offset, end)
+                recovered += 1
+                offset = end
+        return recovered
+
+    def _rewrite_index(self) -> None:
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for timestamp, offset in zip(self.timestamps, self.offsets):
+                f.write(INDEX_ENTRY.pack(timestamp, offset))
+        os.replace(tmp_path, self.index_path)
+
+    # -------------------------------------------------------------------------
+    # mmap 読み出し
+    # -------------------------------------------------------------------------
+
+    def view(self) -> memoryview:
+        """
+        索引に載っている範囲全体の読み取り専用ビュー
+
+        追記中のセグメントは前回の割り当てより大きくなっていれば割り当て直す
+        （古い割り当ては、返したビューが全て解放された時点でGCされる）。
+        """
+        if self._map is None or self._mapped_size < self.size:
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = len(self._map)
+        return memoryview(self._map)
+
+    def record(self, position: int, view: memoryview) -> ArchiveRecord:
+        """position 番目のレコードを view から取り出す（ペイロードはコピーしない）"""
+        offset = self.offsets[position]
+        _, size, timestamp, _, camera_len = RECORD_HEADER.unpack_from(view, offset)
+        camera_start = offset + RECORD_HEADER.size
+        payload_start = camera_start + camera_len
+        camera = bytes(view[camera_start:payload_start]).decode("utf-8", "replace")
+        return ArchiveRecord(
+            self.first_sequence + position, timestamp, camera,
+            view[payload_start:payload_start + size], self.name, offset
+        )
+
+    def release(self) -> None:
+        """mmap を手放す（削除前・終了時）"""
+        self._map = None
+        self._mapped_size = 0
+
+
+# =============================================================================
+# アーカイブ
+# =============================================================================
+
+class CaptureArchive(FrameSink):
+    """
+    フレームをセグメントファイルに追記するアーカイブ
+
+    追記は複数のカメラスレッドから行ってよい（ロックで直列化する）。
+    読み出し（iter_range / get）は追記と並行して行える。
+    別のプロセスが追記中のアーカイブを読む場合は read_only=True で開く。
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR,
+                 segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+                 max_bytes: Optional[int] = None,
+                 fsync: bool = False,
+                 read_only: bool = False):
+        """
+        Args:
+            directory: アーカイブディレクトリ
+            segment_bytes: セグメントを切り替えるサイズ（バイト）
+            max_bytes: アーカイブ全体の上限（超えたら古いセグメントから削除、None で無制限）
+            fsync: True ならフレーム毎に fsync する（電源断に備える場合）
+            read_only: True なら読み出し専用で開く（復元・追記をせず、ファイルに書き込まない）
+
+        Raises:
+            ArchiveLockedError: 追記用に開こうとしたが、別のプロセスが追記中
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.read_only = read_only
+        self.appended = 0
+        self._segments: List[_Segment] = []
+        self._data_file = None
+        self._index_file = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        if not read_only:
+            os.makedirs(self.directory, exist_ok=True)
+            self._acquire_writer_lock()
+        self._load()
+
+    def _acquire_writer_lock(self) -> None:
+        """追記するプロセスを1つに限る（fcntl の無い環境ではロックしない）"""
+        if fcntl is None:
+            return
+        lock_file = open(os.path.join(self.directory, LOCK_FILE), "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise ArchiveLockedError(
+                f"別のプロセスが追記中です: {self.directory}（読むだけなら read_only で開いてください）"
+            ) from None
+        self._lock_file = lock_file
+
+    def _load(self) -> None:
+        """
+        既存のセグメントを読み込む
+
+        追記用に開いた場合は、最後のセグメントを復元して追記を再開する。
+        読み出し専用の場合は索引に載っているレコードだけを使う。
+        """
+        firsts = sorted(
+            int(m.group(1)) for m in map(SEGMENT_PATTERN.match, os.listdir(self.directory)) if m
+        )
+        for i, first in enumerate(firsts):
+            segment = _Segment(self.directory, first)
+            segment.load(recover=not self.read_only and i == len(firsts) - 1)
+            self._segments.append(segment)
+
+    # -------------------------------------------------------------------------
+    # 追記
+    # -------------------------------------------------------------------------
+
+    @property
+    def next_sequence(self) -> int:
+        """次に追記するフレームの通し番号"""
+        if not self._segments:
+            return 1
+        last = self._segments[-1]
+        return last.first_sequence + len(last)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(segment.size for segment in self._segments)
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self._segments)
+
+    def handle(self, frame: Frame) -> None:
+        self.append(frame)
+
+    def append(self, frame: Frame) -> int:
+        """
+        フレームを追記して通し番号を返す（frame.sequence にも設定する）
+
+        frame.path は設定しない（個別のファイルは作らないため。表示名は frame.name を使う）。
+
+        Raises:
+            io.UnsupportedOperation: 読み出し専用で開いたアーカイブ
+        """
+        if self.read_only:
+            raise io.UnsupportedOperation(f"読み出し専用で開いたアーカイブには追記できません: {self.directory}")
+        camera = frame.camera.encode("utf-8")[:0xFFFF]
+        header = RECORD_HEADER.pack(
+            RECORD_MAGIC, frame.size, frame.received_at, zlib.crc32(frame.data), len(camera)
+        )
+        with self._lock:
+            segment = self._writable_segment(len(header) + len(camera) + frame.size)
+            offset = segment.size
+            self._data_file.write(header)
+            self._data_file.write(camera)
+            self._data_file.write(frame.data)
+            self._data_file.flush()
+            self._index_file.write(INDEX_ENTRY.pack(frame.received_at, offset))
+            self._index_file.flush()
+            if self.fsync:
+                os.fsync(self._data_file.fileno())
+                os.fsync(self._index_file.fileno())
+            segment._add_entry(frame.received_at, offset, self._data_file.tell())
+            sequence = segment.first_sequence + len(segment) - 1
+            self.appended += 1
+        frame.sequence = sequence
+        return sequence
+
+    def _writable_segment(self, record_size: int) -> _Segment:
+        """追記先のセグメント（サイズ上限を超えるなら新しいセグメントに切り替える）"""
+        segment = self._segments[-1] if self._segments else None
+        if segment is not None and len(segment) and segment.size + record_size > self.segment_bytes:
+            self._close_files()
+            segment = None
+        if segment is None:
+            segment = _Segment(self.directory, self.next_sequence)
+            self._segments.append(segment)
+            print(f"🗄️ 新しいセグメントを開始: {segment.name}")
+            self._enforce_limit()
+        if self._data_file is None:
+            self._data_file = open(segment.path, "ab")
+            self._index_file = open(segment.index_path, "ab")
+        return segment
+
+    def _enforce_limit(self) -> None:
+        """max_bytes を超えた分を古いセグメントから削除する（追記中のセグメントは残す）"""
+        if self.max_bytes is None:
+            return
+        while len(self._segments) > 1 and self.total_bytes > self.max_bytes:
+            segment = self._segments.pop(0)
+            segment.release()
+            for path in (segment.path, segment.index_path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"⚠️ セグメント削除失敗: {path} ({e})")
+            print(f"🗑️ 古いセグメントを削除: {segment.name}（{len(segment)}フレーム）")
+
+    def _close_files(self) -> None:
+        for f in (self._data_file, self._index_file):
+            if f is not None:
+                f.close()
+        self._data_file = None
+        self._index_file = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_files()
+            for segment in self._segments:
+                segment.release()
+            if self._lock_file is not None:
+                self._lock_file.close()  # ロックも解放される
+                self._lock_file = None
+
+    # -------------------------------------------------------------------------
+    # 読み出し
+    # -------------------------------------------------------------------------
+
+    def _snapshot(self) -> List[Tuple[_Segment, int]]:
+        """(セグメント, その時点のレコード数) の一覧（読み出し中の追記は対象外）"""
+        with self._lock:
+            return [(segment, len(segment)) for segment in self._segments]
+
+    def iter_range(self, start: Optional[float] = None, end: Optional[float] = None,
+                   camera: Optional[str] = None) -> Iterator[ArchiveRecord]:
+        """
+        受信時刻が [start, end) のフレームを古い順に返す
+
+        Args:
+            start: 開始時刻（UNIX秒、None なら先頭から）
+            end: 終了時刻（UNIX秒、None なら末尾まで）
+            camera: 指定時はそのカメラのフレームだけ
+        """
+        low = float("-inf") if start is None else start
+        high = float("inf") if end is None else end
+        for segment, count in self._snapshot():
+            if not count or segment.max_ts < low or segment.min_ts >= high:
+                continue
+            view = segment.view()
+            for position in range(count):
+                if not low <= segment.timestamps[position] < high:
+                    continue
+                record = segment.record(position, view)
+                if camera is None or record.camera == camera:
+                    yield record
+
+    def get(self, sequence: int) -> Optional[ArchiveRecord]:
+        """通し番号でフレームを取り出す（削除済みならNone）"""
+        for segment, count in self._snapshot():
+            position = sequence - segment.first_sequence
+            if 0 <= position < count:
+                return segment.record(position, segment.view())
+        return None
+
+    def segments(self) -> List[Tuple[str, int, int, float, float]]:
+        """(ファイル名, フレーム数, バイト数, 最初の時刻, 最後の時刻) の一覧"""
+        return [
+            (segment.name, count, segment.size, segment.min_ts, segment.max_ts)
+            for segment, count in self._snapshot()
+        ]
+
+
+# =============================================================================
+# 書き出しツール
+# =============================================================================
+
+def export_range(archive: CaptureArchive, output_dir: str,
+                 start: Optional[float] = None, end: Optional[float] = None,
+                 camera: Optional[str] = None) -> int:
+    """
+    時刻範囲のフレームを個別のJPEGファイルに書き出す
+
+    ファイルの更新日時は受信時刻に合わせる。
+
+    Returns:
+        書き出したファイル数
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    count = 0
+    for record in archive.iter_range(start, end, camera):
+        path = os.path.join(output_dir, record.name)
+        with open(path, "wb") as f:
+            f.write(record.data)
+        os.utime(path, (record.timestamp, record.timestamp))
+        count += 1
+    return count
+
+
+def parse_time(value: str) -> float:
+    """UNIX秒または ISO 8601 形式（2025-10-18T12:00 など、ローカル時刻）を UNIX秒にする"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="キャプチャアーカイブの一覧・JPEG書き出し")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info = subparsers.add_parser("info", help="セグメントの一覧を表示")
+    info.add_argument("archive", nargs="?", default=ARCHIVE_DIR, help="アーカイブディレクトリ")
+
+    export = subparsers.add_parser("export", help="時刻範囲のフレームをJPEGファイルに書き出す")
+    export.add_argument("archive", help="アーカイブディレクトリ")
+    export.add_argument("output", help="書き出し先ディレクトリ")
+    export.add_argument("--start", type=parse_time, help="開始時刻（UNIX秒 / ISO 8601）")
+    export.add_argument("--end", type=parse_time, help="終了時刻（この時刻を含まない）")
+    export.add_argument("--camera", help="カメラ（ポート名）で絞り込む")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if not os.path.isdir(args.archive):
+        print(f"❌ アーカイブが見つかりません: {args.archive}")
+        return 1
+    # 撮影中のプロセスが追記しているアーカイブでも安全に読めるよう、復元・切り詰めはしない
+    archive = CaptureArchive(args.archive, read_only=True)
+    try:
+        if args.command == "info":
+            segments = archive.segments()
+            for name, count, size, first, last in segments:
+                span = f"{format_time(first)} 〜 {format_time(last)}" if count else "（空）"
+                print(f"🗄️ {name}: {count:>6}フレーム {size / 1024 / 1024:8.1f} MB  {span}")
+            print(f"📊 合計 {len(archive)}フレーム / {archive.total_bytes / 1024 / 1024:.1f} MB "
+                  f"/ {len(segments)}セグメント")
+        else:
+            start_time = time.time()
+            count = export_range(archive, args.output, args.start, args.end, args.camera)
+            print(f"✅ {count}フレームを {args.output} に書き出しました（{time.time() - start_time:.2f}秒）")
+    finally:
+        archive.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,10 +2,10 @@ import serial
 import time
 import os
 
-SERIAL_PORT = '/dev/cu.SLAB_USBtoUART'
+from spresense_io import DiskSink, FrameError, capture_frame, resync_baud_rate
+
+SERIAL_PORT = os.getenv("SPRESENSE_PORT", '/dev/cu.SLAB_USBtoUART')  # シミュレーター使用時は上書き
 BAUD_RATE = 115200
-START_MARKER = b'START_JPEG'
-END_MARKER = b'END_JPEG'
 OUTPUT_DIR = "captured_images"
 
 def test_command_and_save():
@@ -16,56 +16,28 @@ def test_command_and_save():
         ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=10)  # タイムアウトを延長
         print(f"✅ シリアル接続: {SERIAL_PORT}")
         
-        # 既存のデータをクリア
+        # 接続直後の出力が落ち着くまで待つ（残りは capture_frame が破棄する）
         time.sleep(1)
-        ser.reset_input_buffer()
+        # 別のスクリプトがネゴシエーションしたレートのままならそれに合わせる
+        resync_baud_rate(ser)
         
         print("📤 TAKE_PHOTOコマンドを送信...")
-        ser.write(b'TAKE_PHOTO\n')
-        
         print("📥 開始マーカー待機中...")
-        # バイト形式のマーカーで待機（START_MARKERは既にbytes）
-        start_marker_bytes = START_MARKER + b'\r\n'
-        line = ser.read_until(start_marker_bytes)
-        
-        if line.endswith(start_marker_bytes):
-            print("✅ 画像データ送信開始を確認！")
-            print("📥 バイナリJPEGデータ受信中...")
-            
-            # バイナリデータを直接受信
-            jpeg_data = b''
-            start_time = time.time()
-            
-            while True:
-                chunk = ser.read(1024)
-                if chunk:
-                    # END_MARKERが含まれているかチェック（END_MARKERは既にbytes）
-                    end_marker_bytes = b'\r\n' + END_MARKER
-                    if end_marker_bytes in chunk:
-                        # マーカー前のデータを取得
-                        end_pos = chunk.find(end_marker_bytes)
-                        jpeg_data += chunk[:end_pos]
-                        break
-                    else:
-                        jpeg_data += chunk
-                
-                if time.time() - start_time > 30:
-                    print("❌ 受信タイムアウト")
-                    break
-
-            if jpeg_data:
-                # ファイル保存（jpeg_saver.pyと同じ方式）
-                os.makedirs(OUTPUT_DIR, exist_ok=True)
-                file_name = os.path.join(OUTPUT_DIR, f"test_capture_{int(time.time())}.jpg")
-                with open(file_name, "wb") as f:
-                    f.write(jpeg_data)
-                
-                print(f"✅ 撮影完了！サイズ: {len(jpeg_data)} bytes")
-                print(f"📁 保存先: {file_name}")
-            else:
-                print("❌ 画像データを受信できませんでした")
+        # マーカー方式 / バイナリフレーム方式を自動判別
+        try:
+            frame = capture_frame(ser, start_timeout=10, payload_timeout=30)
+        except FrameError as e:
+            print(f"❌ {e}")
+            frame = None
         else:
-            print("❌ 開始マーカーを受信できませんでした")
+            if frame is None:
+                print("❌ 開始マーカーを受信できませんでした")
+        
+        if frame:
+            # ファイル保存（jpeg_saver.pyと同じ方式）
+            file_name = DiskSink(OUTPUT_DIR, prefix="test_capture").save(frame)
+            print(f"✅ 撮影完了！サイズ: {frame.size} bytes（{frame.mode}）")
+            print(f"📁 保存先: {file_name}")
         
         ser.close()
         
@@ -73,4 +45,4 @@ def test_command_and_save():
         print(f"❌ エラー: {e}")
 
 if __name__ == "__main__":
-    test_command_and_save()
\ No newline at end of file
+    test_command_and_save()
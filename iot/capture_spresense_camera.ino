@@ -6,6 +6,50 @@
 const char* START_MARKER = "START_JPEG";
 const char* END_MARKER = "END_JPEG";
 
+// --- ボーレートネゴシエーション（ホスト側: spresense_io.negotiate_baud_rate） ---
+const long SUPPORTED_BAUD_RATES[] = {921600, 1000000, 2000000};
+const unsigned long BAUD_CONFIRM_TIMEOUT_MS = 2000; // 確認が来なければ BAUD_RATE に戻す
+const int BAUD_TEST_PATTERN_SIZE = 1024;
+
+bool isSupportedBaudRate(long rate) {
+  for (unsigned int i = 0; i < sizeof(SUPPORTED_BAUD_RATES) / sizeof(SUPPORTED_BAUD_RATES[0]); i++) {
+    if (SUPPORTED_BAUD_RATES[i] == rate) {
+      return true;
+    }
+  }
+  return false;
+}
+
+void switchBaudRate(long rate) {
+  Serial.flush();
+  Serial.end();
+  Serial.begin(rate);
+  while (!Serial);
+}
+
+// 新しいレートでテストパターンを送り、ホストの BAUD_CONFIRM を待つ
+void waitBaudConfirm() {
+  unsigned long deadline = millis() + BAUD_CONFIRM_TIMEOUT_MS;
+  while (millis() < deadline) {
+    if (Serial.available() > 0) {
+      String command = Serial.readStringUntil('\n');
+      command.trim();
+      if (command == "BAUD_TEST") {
+        Serial.print("BAUD_TEST:");
+        for (int i = 0; i < BAUD_TEST_PATTERN_SIZE; i++) {
+          Serial.write((uint8_t)(i & 0xFF));
+        }
+        Serial.println();
+      } else if (command == "BAUD_CONFIRM") {
+        Serial.println("BAUD_OK");
+        return;
+      }
+    }
+  }
+  // 確認が来なかったので元のレートに戻す
+  switchBaudRate(BAUD_RATE);
+}
+
 void setup() {
   Serial.begin(BAUD_RATE);
   while (!Serial); 
@@ -62,6 +106,17 @@ void loop() {
       } else {
         Serial.println("Spresense: Failed to take picture or image not available.");
       }
+    } else if (command.startsWith("SET_BAUD ")) {
+      long rate = command.substring(9).toInt();
+      if (isSupportedBaudRate(rate)) {
+        Serial.print("BAUD_ACK ");
+        Serial.println(rate);
+        switchBaudRate(rate);
+        waitBaudConfirm();
+      } else {
+        Serial.print("BAUD_NAK ");
+        Serial.println(rate);
+      }
     } else {
       Serial.println("Spresense: Unknown command.");
     }
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+内容アドレス方式の撮影画像ストア
+
+capture_{UNIX秒}.jpg という名前では同じ秒に届いたフレーム同士が上書きされる
+（高速なサイクル・マルチカメラ・パイプライン時に頻発する）。ここでは
+
+    <prefix>_<通し番号8桁>_<内容ハッシュ16桁>.jpg
+
+という名前で保存し、通し番号は再起動後も続きから単調増加させる。
+バイト単位で同一のフレームは1回だけ保存し、2回目以降は既存ファイルを参照する
+（frame.duplicate が True になるので、後段の分析・変換・送信を省略できる）。
+
+保存の度に manifest.jsonl へ1行（通し番号・カメラ・時刻・ハッシュ・パス）を追記する。
+マニフェストは起動時と肥大化した時に、まだ存在するファイルの行だけに詰め直す。
+
+writer に WriteBehindWriter を渡すと、ファイル名・通し番号・重複判定だけをその場で決め、
+書き込みは専用スレッドに任せる（frame.data は後段でそのままメモリ上で使う）。
+
+使用例:
+    store = CaptureStore("captured_images", retention=get_retention_manager("captured_images"))
+    path = store.save(frame)
+    if frame.duplicate:
+        print("同一フレームのため処理をスキップ")
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from spresense_io import Frame, FrameSink, RetentionManager, WriteBehindWriter
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+MANIFEST_FILE = "manifest.jsonl"
+HASH_DIGEST_SIZE = 16  # blake2b のダイジェスト長（バイト）。ファイル名には先頭16桁を使う
+FILENAME_HASH_LENGTH = 16
+SEQUENCE_PATTERN = re.compile(r"_(\d{8,})_[0-9a-f]{%d}\.\w+$" % FILENAME_HASH_LENGTH)
+COMPACT_SLACK = 256  # 前回詰め直した時の行数の2倍 + これを超えたら詰め直す（償却 O(1)）
+
+
+def content_hash(data) -> str:
+    """画像データの内容ハッシュ（blake2b、bytes / bytearray / memoryview を受け付ける）"""
+    return hashlib.blake2b(data, digest_size=HASH_DIGEST_SIZE).hexdigest()
+
+
+class CaptureStore(FrameSink):
+    """
+    内容ハッシュと通し番号で名前を付けて保存するフレームストア
+
+    複数のカメラスレッドから同時に save() してよい（通し番号の採番・重複判定・
+    マニフェスト追記はロックで直列化する）。
+    """
+
+    def __init__(self, directory: str, prefix: str = "capture",
+                 retention: Optional[RetentionManager] = None,
+                 manifest_name: str = MANIFEST_FILE,
+                 writer: Optional[WriteBehindWriter] = None):
+        """
+        Args:
+            directory: 保存ディレクトリ
+            prefix: ファイル名の接頭辞（カメラ毎に変える場合は save() で指定）
+            retention: 保存したファイルを登録する RetentionManager
+            manifest_name: マニフェストのファイル名（directory 内）
+            writer: 指定時は画像の書き込みをこのライトビハインド書き込み器に任せる
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.retention = retention
+        self.writer = writer
+        self.manifest_path = os.path.join(directory, manifest_name)
+        self.sequence = 0
+        self.saved = 0
+        self.duplicates = 0
+        self._by_hash: Dict[str, str] = {}  # 内容ハッシュ -> 保存済みパス
+        self._entries: List[Dict] = []  # マニフェストの行（古い順）
+        self._compacted_size = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    # -------------------------------------------------------------------------
+    # 保存
+    # -------------------------------------------------------------------------
+
+    def handle(self, frame: Frame) -> None:
+        self.save(frame)
+
+    def save(self, frame: Frame, prefix: Optional[str] = None) -> str:
+        """
+        フレームを保存してパスを返す
+
+        frame.path / frame.content_hash / frame.sequence / frame.duplicate を設定する。
+        同一内容のファイルが残っていれば書き込まずにそのパスを返す。
+        writer 指定時はパスを返した時点ではまだ書き込まれていない場合がある。
+
+        Args:
+            frame: 保存するフレーム
+            prefix: ファイル名の接頭辞（省略時はストアの prefix）
+        """
+        digest = content_hash(frame.data)
+        with self._lock:
+            self._ensure_loaded()
+            self.sequence += 1
+            sequence = self.sequence
+            existing = self._by_hash.get(digest)
+            duplicate = existing is not None and self._is_stored(existing)
+            if duplicate:
+                path = existing
+                self.duplicates += 1
+            else:
+                name = f"{prefix or self.prefix}_{sequence:08d}_{digest[:FILENAME_HASH_LENGTH]}.jpg"
+                path = os.path.join(self.directory, name)
+                if not self.writer:
+                    # 書き込み途中のファイルを読まれないよう一時ファイルから置き換える
+                    tmp_path = path + ".tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(frame.data)
+                    os.replace(tmp_path, path)
+                self._by_hash[digest] = path
+                self.saved += 1
+            self._append_entry({
+                "seq": sequence,
+                "camera": frame.camera,
+                "ts": round(frame.received_at, 3),
+                "hash": digest,
+                "path": path,
+                "size": frame.size,
+                "duplicate": duplicate,
+            })
+
+        frame.path = path
+        frame.content_hash = digest
+        frame.sequence = sequence
+        frame.duplicate = duplicate
+        if self.writer and not duplicate:
+            # 保持ポリシーへの登録は書き込み完了後（まだ無いファイルを削除対象にしない）
+            self.writer.submit(path, frame.data, on_done=lambda p: self._register(p, frame.size))
+        else:
+            # 同一フレームの場合も最新として登録し直し、参照中のファイルが先に消えないようにする
+            self._register(path, frame.size)
+        return path
+
+    def _register(self, path: str, size: int) -> None:
+        if self.retention:
+            self.retention.add(path, size=size)
+
+    def _is_stored(self, path: str) -> bool:
+        """保存済み（または書き込み待ち）か"""
+        return os.path.exists(path) or bool(self.writer and self.writer.is_pending(path))
+
+    def lookup(self, digest: str) -> Optional[str]:
+        """内容ハッシュから保存済みのパスを返す（削除済みならNone）"""
+        with self._lock:
+            self._ensure_loaded()
+            path = self._by_hash.get(digest)
+        return path if path and self._is_stored(path) else None
+
+    # -------------------------------------------------------------------------
+    # マニフェスト
+    # -------------------------------------------------------------------------
+
+    def _ensure_loaded(self) -> None:
+        """マニフェストから通し番号と重複判定用の索引を復元する（初回のみ）"""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue  # 書き込み途中で止まった行
+        except OSError:
+            pass
+
+        self.sequence = max([entry.get("seq", 0) for entry in entries] + [self._max_sequence_on_disk()])
+        self._entries = [entry for entry in entries if os.path.exists(entry.get("path", ""))]
+        for entry in self._entries:
+            self._by_hash[entry["hash"]] = entry["path"]
+        if len(self._entries) != len(entries):
+            self._compact()
+        else:
+            self._compacted_size = len(self._entries)
+
+    def _max_sequence_on_disk(self) -> int:
+        """マニフェストが無い場合に備えてファイル名から通し番号の最大値を求める"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        numbers = [int(m.group(1)) for m in map(SEQUENCE_PATTERN.search, names) if m]
+        return max(numbers, default=0)
+
+    def _append_entry(self, entry: Dict) -> None:
+        self._entries.append(entry)
+        try:
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ マニフェスト書き込み失敗: {e}")
+        if len(self._entries) > self._compacted_size * 2 + COMPACT_SLACK:
+            # 保持期間切れで削除されたファイルの行と索引を取り除く
+            self._entries = [e for e in self._entries if self._is_stored(e["path"])]
+            self._by_hash = {e["hash"]: e["path"] for e in self._entries}
+            self._compact()
+
+    def _compact(self) -> None:
+        """存在するファイルの行だけでマニフェストを書き直す"""
+        self._compacted_size = len(self._entries)
+        tmp_path = self.manifest_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in self._entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            print(f"⚠️ マニフェスト整理失敗: {e}")
+
+    def entries(self) -> List[Dict]:
+        """マニフェストの行のコピー（古い順）"""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._entries)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+フレーム受信テレメトリ
+
+受信したフレーム毎の数値（START_JPEG までの待ち時間・転送時間・バイト数・
+転送速度）とタイムアウト・フレームエラーの件数をカメラ（ポート）別に集計する。
+標準出力のログは流れて消えてしまうため、ここで集計して
+
+- ローカルHTTPの /metrics（Prometheus テキスト形式）
+- JSON Lines ファイル（1イベント1行、任意）
+
+として取り出せるようにする。
+
+ヒストグラムは Prometheus と同じ累積バケット（起動からの合計）に加えて、
+直近 window 件の分位点（p50 / p95）を *_recent として出すので、
+スループットの劣化をスクレイプ間隔より短い粒度でも追える。
+
+使用例:
+    telemetry = FrameTelemetry(jsonl_path="frame_telemetry.jsonl")
+    start_metrics_server(telemetry, port=9464)
+    frame = receive_frame(ser, 10, 30, telemetry=telemetry, expect_reply=True)
+    # curl http://127.0.0.1:9464/metrics
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+METRIC_PREFIX = "spresense_frame"
+DEFAULT_WINDOW = 256  # 分位点を計算する直近サンプル数
+RECENT_QUANTILES = (0.5, 0.95)
+
+# バケット境界（QVGA〜VGAのJPEG、115200〜2000000 bps を想定）
+WAIT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+TRANSFER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (4096, 8192, 16384, 32768, 65536, 131072, 262144, 1048576)
+THROUGHPUT_BUCKETS = (5.0, 10.0, 25.0, 50.0, 90.0, 100.0, 150.0, 200.0)
+
+# =============================================================================
+# ヒストグラム
+# =============================================================================
+
+class RollingHistogram:
+    """累積バケットと直近サンプルの分位点を持つヒストグラム"""
+
+    def __init__(self, buckets: Sequence[float], window: int = DEFAULT_WINDOW):
+        """
+        Args:
+            buckets: バケットの上限値（昇順）
+            window: 分位点を計算する直近サンプル数
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)  # 各バケットに入った件数（非累積）
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Prometheus 形式の (le, 累積件数) のリスト（+Inf を含む）"""
+        result = []
+        running = 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            result.append((_format_value(bound), running))
+        result.append(("+Inf", self.count))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """直近サンプルの分位点（最近傍法）、サンプルが無ければNone"""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+# =============================================================================
+# テレメトリ本体
+# =============================================================================
+
+# (メトリクス名, 説明, バケット, Frame から値を取り出す属性)
+HISTOGRAMS = (
+    ("wait_seconds", "コマンド送信（待機開始）からフレーム開始までの秒数", WAIT_BUCKETS, "wait_time"),
+    ("transfer_seconds", "フレーム開始から受信完了までの秒数", TRANSFER_BUCKETS, "receive_time"),
+    ("size_bytes", "受信したフレームのバイト数", SIZE_BUCKETS, "size"),
+    ("throughput_kbps", "ペイロードの転送速度 (KB/s)", THROUGHPUT_BUCKETS, "kbps"),
+)
+
+
+class FrameTelemetry:
+    """
+    カメラ別のフレーム受信統計
+
+    複数のカメラスレッドと /metrics のリクエストスレッドから同時に使われるので、
+    更新と出力はロックで保護する。
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None, window: int = DEFAULT_WINDOW):
+        """
+        Args:
+            jsonl_path: 指定時はイベント毎に1行のJSONを追記する
+            window: 分位点を計算する直近サンプル数
+        """
+        self.jsonl_path = jsonl_path
+        self.window = window
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[str, RollingHistogram]] = {}  # camera -> name -> histogram
+        self._frames: Dict[str, int] = {}
+        self._timeouts: Dict[str, int] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}  # (camera, kind) -> 件数
+        self._last_frame_at: Dict[str, float] = {}
+
+    # -------------------------------------------------------------------------
+    # 記録
+    # -------------------------------------------------------------------------
+
+    def record_frame(self, camera: str, frame) -> None:
+        """受信に成功したフレームを記録する"""
+        with self._lock:
+            histograms = self._histograms.get(camera)
+            if histograms is None:
+                histograms = {
+                    name: RollingHistogram(buckets, self.window)
+                    for name, _, buckets, _ in HISTOGRAMS
+                }
+                self._histograms[camera] = histograms
+            for name, _, _, attr in HISTOGRAMS:
+                histograms[name].observe(float(getattr(frame, attr)))
+            self._frames[camera] = self._frames.get(camera, 0) + 1
+            self._last_frame_at[camera] = frame.received_at
+        self._write_event({
+            "event": "frame",
+            "camera": camera,
+            "mode": frame.mode,
+            "bytes": frame.size,
+            "wait_seconds": round(frame.wait_time, 4),
+            "transfer_seconds": round(frame.receive_time, 4),
+            "throughput_kbps": round(frame.kbps, 2),
+            "reads": frame.reads,
+            "baud_rate": frame.baud_rate,
+        })
+
+    def record_timeout(self, camera: str) -> None:
+        """撮影コマンドに対してフレーム開始が届かなかったことを記録する"""
+        with self._lock:
+            self._timeouts[camera] = self._timeouts.get(camera, 0) + 1
+        self._write_event({"event": "timeout", "camera": camera})
+
+    def record_error(self, camera: str, error) -> None:
+        """フレームエラー（受信途中のタイムアウト・CRC不一致など）を記録する"""
+        kind = getattr(error, "kind", "invalid")
+        with self._lock:
+            self._errors[(camera, kind)] = self._errors.get((camera, kind), 0) + 1
+        self._write_event({"event": "error", "camera": camera, "kind": kind, "message": str(error)})
+
+    def _write_event(self, event: Dict) -> None:
+        if not self.jsonl_path:
+            return
+        event = {"ts": round(time.time(), 3), **event}
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        try:
+            with self._lock:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            print(f"⚠️ テレメトリ書き込み失敗: {e}")
+
+    # -------------------------------------------------------------------------
+    # 出力
+    # -------------------------------------------------------------------------
+
+    def render_prometheus(self) -> str:
+        """Prometheus テキスト形式（version 0.0.4）で全メトリクスを返す"""
+        lines: List[str] = []
+        with self._lock:
+            cameras = sorted(set(self._frames) | set(self._timeouts) | {c for c, _ in self._errors})
+
+            _header(lines, "frames_total", "counter", "受信に成功したフレーム数")
+            for camera in cameras:
+                lines.append(f"{_name('frames_total')}{_labels(camera=camera)} {self._frames.get(camera, 0)}")
+
+            _header(lines, "timeouts_total", "counter", "撮影コマンドに対してフレーム開始が届かなかった回数")
+            for camera in cameras:
+                lines.append(f"{_name('timeouts_total')}{_labels(camera=camera)} {self._timeouts.get(camera, 0)}")
+
+            _header(lines, "errors_total", "counter", "受信途中のタイムアウト・長さ超過・CRC不一致などの回数")
+            for (camera, kind), n in sorted(self._errors.items()):
+                lines.append(f"{_name('errors_total')}{_labels(camera=camera, kind=kind)} {n}")
+
+            _header(lines, "last_received_timestamp_seconds", "gauge", "最後にフレームを受信したUNIX時刻")
+            for camera, ts in sorted(self._last_frame_at.items()):
+                lines.append(f"{_name('last_received_timestamp_seconds')}{_labels(camera=camera)} {ts:.3f}")
+
+            for name, help_text, _, _ in HISTOGRAMS:
+                _header(lines, name, "histogram", help_text)
+                for camera in sorted(self._histograms):
+                    histogram = self._histograms[camera][name]
+                    for le, n in histogram.cumulative():
+                        lines.append(f"{_name(name)}_bucket{_labels(camera=camera, le=le)} {n}")
+                    lines.append(f"{_name(name)}_sum{_labels(camera=camera)} {_format_value(histogram.sum)}")
+                    lines.append(f"{_name(name)}_count{_labels(camera=camera)} {histogram.count}")
+
+                recent = f"{name}_recent"
+                _header(lines, recent, "gauge", f"{help_text}（直近{self.window}フレームの分位点）")
+                for camera in sorted(self._histograms):
+                    histogram = self._histograms[camera][name]
+                    for q in RECENT_QUANTILES:
+                        value = histogram.quantile(q)
+                        if value is not None:
+                            lines.append(f"{_name(recent)}{_labels(camera=camera, quantile=str(q))} "
+                                         f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """カメラ別の簡易サマリー（終了時の表示用）"""
+        result = {}
+        with self._lock:
+            cameras = set(self._frames) | set(self._timeouts) | {c for c, _ in self._errors}
+            for camera in cameras:
+                histograms = self._histograms.get(camera)
+                transfer = histograms["transfer_seconds"] if histograms else None
+                throughput = histograms["throughput_kbps"] if histograms else None
+                result[camera] = {
+                    "frames": self._frames.get(camera, 0),
+                    "timeouts": self._timeouts.get(camera, 0),
+                    "errors": sum(n for (c, _), n in self._errors.items() if c == camera),
+                    "transfer_p50": (transfer and transfer.quantile(0.5)) or 0.0,
+                    "transfer_p95": (transfer and transfer.quantile(0.95)) or 0.0,
+                    "throughput_p50": (throughput and throughput.quantile(0.5)) or 0.0,
+                }
+        return result
+
+
+def _name(name: str) -> str:
+    return f"{METRIC_PREFIX}_{name}"
+
+
+def _header(lines: List[str], name: str, metric_type: str, help_text: str) -> None:
+    lines.append(f"# HELP {_name(name)} {help_text}")
+    lines.append(f"# TYPE {_name(name)} {metric_type}")
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value) -> str:
+    """ラベル値のエスケープ（バックスラッシュ・ダブルクォート・改行）"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
+
+# =============================================================================
+# /metrics エンドポイント
+# =============================================================================
+
+def start_metrics_server(telemetry: FrameTelemetry, port: int,
+                         host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    /metrics を返すHTTPサーバーをデーモンスレッドで起動する
+
+    Args:
+        telemetry: 出力するテレメトリ
+        port: 待ち受けポート（0 なら空いているポート）
+        host: 待ち受けアドレス（既定はローカルのみ）
+
+    Returns:
+        起動したサーバー（server_address で実際のポート、shutdown() で停止）
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # スクレイプ毎のアクセスログは出さない
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server
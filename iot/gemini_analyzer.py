@@ -1,10 +1,12 @@
 import os
 import time
-import json
 from dotenv import load_dotenv
-from google import genai
 from google.genai.types import Part
 
+from analysis_result import AnalysisParseError, analysis_schema, format_flag, generation_config, parse_analysis
+from gemini_clients import get_genai_client
+from gemini_pool import get_request_pool
+
 # 1. 環境変数のロード
 load_dotenv()
 
@@ -12,6 +14,7 @@ load_dotenv()
 # ⚠️ .envからAPIキーを読み込み
 API_KEY = os.getenv("GEMINI_API_KEY") 
 MODEL_NAME = 'gemini-2.5-flash'
+RESULT_FIELDS = ('face_detected', 'is_peacesign')
 
 # -------------------------------------------------------------------
 # 【修正箇所】: ローカルファイルからJPEGバイトデータを読み込む関数
@@ -39,7 +42,7 @@ def analyze_image_with_gemini(jpeg_data: bytes):
         return None
 
     try:
-        client = genai.Client(api_key=API_KEY)
+        client = get_genai_client(API_KEY)
         
         # 1. 画像データをPartオブジェクトに変換
         image_part = Part.from_bytes(
@@ -50,31 +53,29 @@ def analyze_image_with_gemini(jpeg_data: bytes):
         # 2. ポーズ判定を含むプロンプトを作成
         prompt = (
             "この画像について分析してください。\n"
-            "1. 人の顔は映っていますか？ (Yes/No)\n"
-            "2. 映っている場合、その人はカメラに向かってピースサインをしていますか？ (Yes/No)\n"
-            "結果を以下のJSON形式でのみ出力してください: "
-            "{'face_detected': 'Yes/No', 'is_peacesign': 'Yes/No'}"
+            "1. face_detected: 人の顔は映っていますか？\n"
+            "2. is_peacesign: 映っている場合、その人はカメラに向かってピースサインをしていますか？"
         )
 
         print("🔍 Gemini APIに画像とプロンプトを送信中...")
         start_time = time.time()
         
-        # 3. Gemini APIにリクエストを送信
-        response = client.models.generate_content(
+        # 3. Gemini APIにリクエストを送信（共有プールで実行し、429/5xx は再試行する）
+        config = generation_config(analysis_schema(RESULT_FIELDS))
+        response = get_request_pool().call(MODEL_NAME, lambda timeout: client.models.generate_content(
             model=MODEL_NAME,
             contents=[prompt, image_part],
-            config={"response_mime_type": "application/json"}
-        )
+            config={**config, "http_options": {"timeout": int(timeout * 1000)}}
+        ))
         
         end_time = time.time()
         print(f"⏱️ 応答受信完了 (処理時間: {end_time - start_time:.2f}秒)")
 
         # 4. 応答を解析して結果を返す
         try:
-            analysis_result = json.loads(response.text)
-            return analysis_result
-        except json.JSONDecodeError:
-            print("❌ エラー: APIの応答が有効なJSON形式ではありませんでした。")
+            return parse_analysis(response.text, RESULT_FIELDS)
+        except AnalysisParseError as e:
+            print(f"❌ エラー: APIの応答がレスポンススキーマどおりではありませんでした: {e}")
             return None
 
     except Exception as e:
@@ -102,10 +103,10 @@ if __name__ == "__main__":
             print("\n==============================")
             print("  AIポーズ判定結果")
             print("==============================")
-            print(f"👤 顔の検出: {result.get('face_detected')}")
-            print(f"✌️ ピースサイン: {result.get('is_peacesign')}")
+            print(f"👤 顔の検出: {format_flag(result['face_detected'])}")
+            print(f"✌️ ピースサイン: {format_flag(result['is_peacesign'])}")
             
-            if result.get('face_detected') == 'Yes' and result.get('is_peacesign') == 'Yes':
+            if result['face_detected'] and result['is_peacesign']:
                 print("\n🎉 判定成功！ (ピースサインが検出されました)")
             else:
                 print("\n😟 判定失敗。")
@@ -1,9 +1,13 @@
 import os
 import time
-import json
 import serial
 from dotenv import load_dotenv
-import google.generativeai as genai
+from analysis_result import AnalysisParseError, format_flag, generation_config, parse_analysis
+from gemini_clients import get_generative_model
+from gemini_pool import get_request_pool
+
+from capture_store import CaptureStore
+from spresense_io import as_bytes, iter_frames, resync_baud_rate
 
 # 1. 環境変数のロード
 load_dotenv()
@@ -14,61 +18,19 @@ API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = 'gemini-2.5-flash'
 
 # シリアル通信設定
-SERIAL_PORT = '/dev/cu.SLAB_USBtoUART' 
+SERIAL_PORT = os.getenv("SPRESENSE_PORT", '/dev/cu.SLAB_USBtoUART')  # シミュレーター使用時は上書き
 BAUD_RATE = 115200
-START_MARKER = b'START_JPEG'
-END_MARKER = b'END_JPEG' 
 OUTPUT_DIR = "captured_images"
+capture_store = CaptureStore(OUTPUT_DIR)
 
 # -------------------------------------------------------------------
-# シリアル通信でSpresenseから画像を受信する関数
+# 受信したフレームの保存（受信は spresense_io.iter_frames）
 # -------------------------------------------------------------------
-def receive_image_from_spresense(ser) -> tuple[bytes | None, str | None]:
-    """
-    シリアル通信でSpresenseからJPEGデータを受信し、バイトデータとファイル名を返す。
-    """
-    # 1. 開始マーカーを待機
-    # read_until()でSTART_MARKERが検出されるまでデータを読み捨てる
-    line = ser.read_until(START_MARKER)
-    
-    if line.endswith(START_MARKER):
-        print("\n📥 画像データ受信開始...")
-        
-        jpeg_data = b''
-        start_time = time.time()
-        
-        # 2. JPEGデータ本体と終了マーカーを受信する
-        while True:
-            # データを読み取り（タイムアウトあり）
-            chunk = ser.read(1024)  # 1KBずつ読み取り
-            
-            if chunk:
-                # 終了マーカーが含まれているかチェック
-                if END_MARKER in chunk:
-                    # マーカーまでのデータ本体を取得
-                    jpeg_data += chunk.split(END_MARKER)[0]
-                    break
-                else:
-                    jpeg_data += chunk
-            
-            # タイムアウト対策（5MP RAWファイル用に延長）
-            if time.time() - start_time > 120:  # 120秒（5MP RAW用）
-                print("❌ 受信タイムアウト。データが途切れた可能性があります。")
-                break
-
-        if jpeg_data:
-            # 3. 受信完了とファイル保存
-            os.makedirs(OUTPUT_DIR, exist_ok=True)
-            file_name = os.path.join(OUTPUT_DIR, f"capture_{int(time.time())}.jpg")
-            with open(file_name, "wb") as f:
-                f.write(jpeg_data)
-            
-            print(f"💾 受信完了。サイズ: {len(jpeg_data)} bytes. 保存先: {file_name}")
-            return jpeg_data, file_name
-        else:
-            print("⚠️ データを受信できませんでした。")
-    
-    return None, None
+def save_frame(frame) -> str:
+    """受信したフレームを OUTPUT_DIR に保存してパスを返す"""
+    file_name = capture_store.save(frame)
+    print(f"💾 受信完了（{frame.mode}）。サイズ: {frame.size} bytes. 保存先: {file_name}")
+    return file_name
 
 # -------------------------------------------------------------------
 # ローカルファイルからJPEGバイトデータを読み込む関数（既存ファイル用）
@@ -96,35 +58,34 @@ def analyze_image_with_gemini(jpeg_data: bytes):
         return None
 
     try:
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel(MODEL_NAME)
+        model = get_generative_model(MODEL_NAME, API_KEY)  # 2回目以降は生成済みのモデルを使い回す
 
         # 2. ポーズ判定を含むプロンプトを作成
         prompt = (
             "この画像について分析してください。\n"
-            "1. 人の顔は映っていますか？ (Yes/No)\n"
-            "2. 映っている場合、その人はカメラに向かって何かポーズ（ピースサイン、グッドサイン、ガッツポーズ）をしていますか？ (Yes/No)\n"
-            "結果を以下のJSON形式でのみ出力してください: "
-            "{'face_detected': 'Yes/No', 'is_pose': 'Yes/No'}"
+            "1. face_detected: 人の顔は映っていますか？\n"
+            "2. is_pose: 映っている場合、その人はカメラに向かって何かポーズ（ピースサイン、グッドサイン、ガッツポーズ）をしていますか？"
         )
 
         print("🔍 Gemini APIに画像とプロンプトを送信中...")
         start_time = time.time()
         
         # 3. Gemini APIにリクエストを送信
-        response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": jpeg_data}])
+        response = get_request_pool().call(MODEL_NAME, lambda timeout: model.generate_content(
+            [prompt, {"mime_type": "image/jpeg", "data": as_bytes(jpeg_data)}],
+            generation_config=generation_config(),
+            request_options={"timeout": timeout},
+        ))
         
         end_time = time.time()
         print(f"⏱️ 応答受信完了 (処理時間: {end_time - start_time:.2f}秒)")
 
         # 4. 応答を解析して結果を返す
         try:
+            return parse_analysis(response.text)
+        except AnalysisParseError as e:
+            print(f"❌ エラー: APIの応答がレスポンススキーマどおりではありませんでした: {e}")
             print(response.text)  # 応答内容をデバッグ表示
-            analysis_result = json.loads(response.text)
-            print(analysis_result)
-            return analysis_result
-        except json.JSONDecodeError:
-            print("❌ エラー: APIの応答が有効なJSON形式ではありませんでした。")
             return None
 
     except Exception as e:
@@ -141,6 +102,8 @@ def main_live_analysis():
     try:
         # シリアルポート接続
         ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1.0)
+        # 別のスクリプトがネゴシエーションしたレートのままならそれに合わせる
+        resync_baud_rate(ser)
         print(f"✅ シリアルポート {SERIAL_PORT} に接続しました")
         print("📷 Spresenseからの画像を待機し、リアルタイムで分析します...")
         print("🤖 Gemini AIによる画像内容認識を開始します")
@@ -149,37 +112,33 @@ def main_live_analysis():
         capture_count = 0
         last_log_time = time.time()
         
-        while True:
+        def log_waiting():
             # 10秒ごとに待機状態をログ出力
+            nonlocal last_log_time
             current_time = time.time()
             if current_time - last_log_time >= 10:
                 print(f"⏰ [{time.strftime('%H:%M:%S')}] データ待機中... (受信済み: {capture_count}枚)")
                 last_log_time = current_time
+        
+        # Spresenseから画像を受信した順に分析する
+        for frame in iter_frames(ser, start_timeout=1.0, payload_timeout=120, on_idle=log_waiting):
+            file_path = save_frame(frame)
+            capture_count += 1
+            print(f"\n🎯 [画像 {capture_count}] Gemini AI分析開始...")
             
-            # Spresenseから画像を受信
-            image_data, file_path = receive_image_from_spresense(ser)
-            
-            if image_data and file_path:
-                capture_count += 1
-                print(f"\n🎯 [画像 {capture_count}] Gemini AI分析開始...")
-                
-                # Gemini AIで画像分析
-                result = analyze_image_with_gemini(image_data)
-                
-                if result:
-                    print("\n" + "=" * 50)
-                    print(f"  🤖 AI画像分析結果 [画像 {capture_count}]")
-                    print("=" * 50)
-                    print(f"📷 ファイル: {os.path.basename(file_path)}")
-                    print(f"👁️  主な被写体: {result.get('main_subject', '不明')}")
-                    print(f"🏞️  背景: {result.get('background', '不明')}")
-                    print(f"💡 光の状況: {result.get('lighting', '不明')}")
-                    print(f"✨ 全体印象: {result.get('overall_impression', '不明')}")
-                    print("=" * 50)
-                else:
-                    print("❌ 画像分析に失敗しました")
+            # Gemini AIで画像分析
+            result = analyze_image_with_gemini(frame.data)
             
-            time.sleep(0.1)  # CPU負荷軽減のための短い待機
+            if result:
+                print("\n" + "=" * 50)
+                print(f"  🤖 AI画像分析結果 [画像 {capture_count}]")
+                print("=" * 50)
+                print(f"📷 ファイル: {os.path.basename(file_path)}")
+                print(f"👁️  人の顔: {format_flag(result['face_detected'])}")
+                print(f"🤲 ポーズ: {format_flag(result['is_pose'])}")
+                print("=" * 50)
+            else:
+                print("❌ 画像分析に失敗しました")
             
     except serial.SerialException as e:
         print(f"❌ シリアルポート接続エラー: {e}")
@@ -205,10 +164,8 @@ def main_file_analysis(image_path: str):
             print("  🤖 AI画像分析結果")
             print("=" * 50)
             print(f"📷 ファイル: {os.path.basename(image_path)}")
-            print(f"👁️  主な被写体: {result.get('main_subject', '不明')}")
-            print(f"🏞️  背景: {result.get('background', '不明')}")
-            print(f"💡 光の状況: {result.get('lighting', '不明')}")
-            print(f"✨ 全体印象: {result.get('overall_impression', '不明')}")
+            print(f"👁️  人の顔: {format_flag(result['face_detected'])}")
+            print(f"🤲 ポーズ: {format_flag(result['is_pose'])}")
             print("=" * 50)
 
 # --- メイン処理 ---
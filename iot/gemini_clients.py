@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Gemini クライアントのプロセス共有レジストリ
+
+フレーム毎に genai.configure() + GenerativeModel() を作り直したり、
+変換毎に ImageEditor（= genai.Client と HTTP スタック）を作り直したりすると、
+毎回クライアントの初期化と（多くの場合）新しいTLSハンドシェイクの分だけ遅くなる。
+ここではAPIキー・モデル名毎に1回だけ作ったものを使い回し、接続プールを温めたままにする。
+
+- get_genai_client(): google.genai の Client（画像編集・新SDK）
+- get_generative_model(): google.generativeai の GenerativeModel（AI分析）
+- prewarm(): 起動時に1回軽いリクエストを送り、最初のフレームでハンドシェイクを待たないようにする
+
+どの関数も複数のワーカースレッドから同時に呼んでよい（初回の生成だけロックで直列化し、
+生成済みのものはロックなしで返す）。生成にかかった時間は setup_stats() で確認できる。
+
+使用例:
+    model = get_generative_model("gemini-2.5-flash")
+    response = model.generate_content([prompt, image_part])
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+API_KEY_ENV = "GEMINI_API_KEY"
+
+_instances: Dict[Hashable, Any] = {}
+_setup_seconds: Dict[Hashable, float] = {}
+_lock = threading.Lock()
+_configured_api_key: Optional[str] = None  # google.generativeai はプロセス全体で1つの設定を持つ
+
+
+def resolve_api_key(api_key: Optional[str] = None) -> str:
+    """APIキー（省略時は環境変数 GEMINI_API_KEY）"""
+    api_key = api_key or os.getenv(API_KEY_ENV)
+    if not api_key:
+        raise ValueError(f"環境変数 '{API_KEY_ENV}' が設定されていません。")
+    return api_key
+
+
+def _get_or_create(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """key のインスタンスを返す（無ければ factory で1回だけ作る）"""
+    instance = _instances.get(key)
+    if instance is not None:
+        return instance
+    with _lock:
+        instance = _instances.get(key)
+        if instance is None:
+            start = time.perf_counter()
+            instance = factory()
+            _setup_seconds[key] = time.perf_counter() - start
+            _instances[key] = instance
+    return instance
+
+
+# =============================================================================
+# クライアント
+# =============================================================================
+
+def get_genai_client(api_key: Optional[str] = None):
+    """google.genai の Client（APIキー毎に1つ）"""
+    api_key = resolve_api_key(api_key)
+
+    def create():
+        from google import genai
+        return genai.Client(api_key=api_key)
+
+    return _get_or_create(("genai.Client", api_key), create)
+
+
+def get_generative_model(model_name: str, api_key: Optional[str] = None):
+    """
+    google.generativeai の GenerativeModel（APIキー・モデル名毎に1つ）
+
+    genai.configure() はプロセス全体の設定を書き換えるため、最初の1回だけ呼ぶ
+    （別のAPIキーが渡された場合のみ設定し直す）。
+    """
+    api_key = resolve_api_key(api_key)
+
+    def create():
+        global _configured_api_key
+        import google.generativeai as legacy_genai
+        if _configured_api_key != api_key:
+            legacy_genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+        return legacy_genai.GenerativeModel(model_name)
+
+    return _get_or_create(("GenerativeModel", api_key, model_name), create)
+
+
+def prewarm(model_name: str, api_key: Optional[str] = None, background: bool = True) -> None:
+    """
+    クライアントを作り、モデル情報の取得（生成はしない軽いリクエスト）で接続を確立しておく
+
+    失敗しても本処理には影響しないので、エラーは表示するだけにする。
+
+    Args:
+        model_name: 確認するモデル名
+        api_key: APIキー（省略時は環境変数）
+        background: True なら別スレッドで実行して待たない
+    """
+    def run():
+        try:
+            start = time.perf_counter()
+            get_genai_client(api_key).models.get(model=model_name)
+            print(f"🔥 Geminiクライアント準備完了: {model_name}（{time.perf_counter() - start:.2f}秒）")
+        except Exception as e:
+            print(f"⚠️ Geminiクライアントの事前接続に失敗（処理は続行）: {e}")
+
+    if background:
+        threading.Thread(target=run, name="gemini-prewarm", daemon=True).start()
+    else:
+        run()
+
+
+def setup_stats() -> List[Tuple[str, float]]:
+    """(生成したもの, 生成にかかった秒数) の一覧（APIキーは含めない）"""
+    with _lock:
+        return [
+            (f"{key[0]}({key[2]})" if len(key) > 2 else key[0], seconds)
+            for key, seconds in _setup_seconds.items()
+        ]
+
+
+def clear() -> None:
+    """生成済みのクライアントを破棄する（APIキーの入れ替え・ベンチマーク用）"""
+    global _configured_api_key
+    with _lock:
+        _instances.clear()
+        _setup_seconds.clear()
+        _configured_api_key = None
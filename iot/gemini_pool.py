@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Gemini リクエストの実行プール（同時実行数・レート制限・再試行・期限）
+
+AI分析・アメコミ変換の Gemini 呼び出しはその場で1回だけ実行していたため、
+429（レート超過）や一時的な 5xx が1回返っただけでそのフレームを失っていた。
+ここでは全ての Gemini リクエストを1つのプールに投入し、
+
+- 同時実行数を max_concurrency 本までに制限する
+- モデル毎のトークンバケットで1分あたりのリクエスト数を制限する（set_rate）
+- 429 / 5xx / 接続エラー・通信のタイムアウトはジッター付き指数バックオフで再試行する
+- リクエスト毎の期限（投入からの秒数）を超えたら RequestDeadlineExceeded にする
+  （レート制限・バックオフの待ちも期限に含め、1回の通信には残り時間をタイムアウトとして渡す）
+
+待ち行列の長さ（queue_depth）と実行中の数（in_flight）はいつでも参照できる。
+
+使用例:
+    pool = get_request_pool()
+    pool.set_rate("gemini-2.5-flash", requests_per_minute=60)
+    response = pool.call(
+        "gemini-2.5-flash",
+        lambda timeout: model.generate_content(contents, request_options={"timeout": timeout}),
+    )
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 120.0  # 秒（画像編集は数十秒かかることがある）
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_DELAY = 1.0  # 秒
+DEFAULT_MAX_DELAY = 30.0  # 秒
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+_default_pool: Optional["RequestPool"] = None
+_default_lock = threading.Lock()
+
+
+class RequestDeadlineExceeded(TimeoutError):
+    """リクエストの期限までに結果を得られなかった"""
+
+
+def status_code(error: Exception) -> Optional[int]:
+    """
+    例外のHTTPステータスコード（分からなければNone）
+
+    google.api_core（google.generativeai）の例外と google.genai.errors.APIError は
+    どちらも code 属性に int のステータスコードを持つ。
+    requests.exceptions.HTTPError は response.status_code に持つ。
+    """
+    for source in (error, getattr(error, "response", None)):
+        for attribute in ("code", "status_code"):
+            value = getattr(source, attribute, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    再試行すれば成功しうるエラーか（429 / 5xx / 接続エラー・通信のタイムアウト）
+
+    ステータスコードの無い OSError は一時的な通信エラーとして再試行する。
+    requests の例外（ConnectionError / ReadTimeout / ChunkedEncodingError など）は
+    組み込みの ConnectionError / TimeoutError ではないが、いずれも OSError の派生。
+    """
+    if isinstance(error, RequestDeadlineExceeded):
+        return False
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES
+    return isinstance(error, OSError)
+
+
+class TokenBucket:
+    """1分あたりのリクエスト数を制限するトークンバケット"""
+
+    def __init__(self, requests_per_minute: float, burst: Optional[int] = None):
+        """
+        Args:
+            requests_per_minute: 1分あたりの平均リクエスト数
+            burst: まとめて送ってよいリクエスト数（省略時は1）
+        """
+        self.rate = requests_per_minute / 60.0
+        self.capacity = float(burst or 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: float) -> bool:
+        """
+        トークンを1つ取る（無ければ補充を待つ）
+
+        deadline（time.monotonic() の値）までに取れない場合は待たずに False を返す。
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                wait = (1.0 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class RequestPool:
+    """
+    Gemini リクエストを同時実行数・レート・期限を守って実行するプール
+
+    submit() / call() は複数のスレッドから同時に呼んでよい。
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 timeout: float = DEFAULT_TIMEOUT, max_retries: int = DEFAULT_MAX_RETRIES,
+                 base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY):
+        """
+        Args:
+            max_concurrency: 同時に実行するリクエスト数の上限
+            timeout: リクエスト毎の既定の期限（投入からの秒数）
+            max_retries: 再試行の最大回数
+            base_delay: バックオフの初期値（秒、再試行毎に2倍）
+            max_delay: バックオフの上限（秒）
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'retries': 0,
+                      'deadline_exceeded': 0, 'rate_wait_seconds': 0.0}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._queued = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="gemini")
+
+    def set_rate(self, model_name: str, requests_per_minute: Optional[float],
+                 burst: Optional[int] = None) -> None:
+        """モデルのレート制限を設定する（None なら制限しない）"""
+        with self._lock:
+            if requests_per_minute:
+                self._buckets[model_name] = TokenBucket(requests_per_minute, burst)
+            else:
+                self._buckets.pop(model_name, None)
+
+    @property
+    def queue_depth(self) -> int:
+        """実行待ちのリクエスト数"""
+        return self._queued
+
+    @property
+    def in_flight(self) -> int:
+        """実行中（レート待ち・バックオフ中を含む）のリクエスト数"""
+        return self._in_flight
+
+    def submit(self, model_name: str, request: Callable[[float], Any],
+               timeout: Optional[float] = None) -> Future:
+        """
+        リクエストを投入して Future を返す
+
+        Args:
+            model_name: レート制限に使うモデル名
+            request: 残り秒数を受け取って1回の通信を行う関数（再試行時は再度呼ばれる）
+            timeout: このリクエストの期限（投入からの秒数、省略時はプールの既定値）
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        with self._lock:
+            self._queued += 1
+            self.stats['submitted'] += 1
+        return self._executor.submit(self._run, model_name, request, deadline)
+
+    def call(self, model_name: str, request: Callable[[float], Any],
+             timeout: Optional[float] = None) -> Any:
+        """
+        リクエストを投入して結果を待つ
+
+        Raises:
+            RequestDeadlineExceeded: 期限までに結果を得られなかった
+            Exception: 再試行しても成功しなかったリクエストの例外
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        future = self.submit(model_name, request, timeout)
+        try:
+            return future.result(timeout=timeout)
+        except RequestDeadlineExceeded:
+            raise  # ワーカー側で期限切れ（集計済み）
+        except FutureTimeoutError:
+            if future.done():
+                raise  # リクエスト自身のタイムアウト（再試行しても成功しなかった）
+            # 期限を過ぎても戻らない（実行中のワーカーは通信が終わり次第解放される）
+            cancelled = future.cancel()
+            with self._lock:
+                if cancelled:
+                    self._queued -= 1
+                self.stats['deadline_exceeded'] += 1
+            raise RequestDeadlineExceeded(f"{model_name}: {timeout:g}秒以内に応答がありません") from None
+
+    # -------------------------------------------------------------------------
+    # 実行
+    # -------------------------------------------------------------------------
+
+    def _run(self, model_name: str, request: Callable[[float], Any], deadline: float) -> Any:
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+        try:
+            result = self._attempt(model_name, request, deadline)
+            with self._lock:
+                self.stats['succeeded'] += 1
+            return result
+        except Exception as e:
+            with self._lock:
+                self.stats['failed'] += 1
+                if isinstance(e, RequestDeadlineExceeded):
+                    self.stats['deadline_exceeded'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _attempt(self, model_name: str, request: Callable[[float], Any], deadline: float) -> Any:
+        attempt = 0
+        while True:
+            bucket = self._buckets.get(model_name)
+            if bucket is not None:
+                wait_start = time.monotonic()
+                acquired = bucket.acquire(deadline)
+                with self._lock:
+                    self.stats['rate_wait_seconds'] += time.monotonic() - wait_start
+                if not acquired:
+                    raise RequestDeadlineExceeded(f"{model_name}: レート制限の待ちが期限を超えます")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RequestDeadlineExceeded(f"{model_name}: 実行前に期限を過ぎました")
+
+            try:
+                return request(remaining)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                # フルジッター: 0〜(base_delay * 2^attempt) の一様乱数（複数ワーカーの再試行を分散させる）
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.stats['retries'] += 1
+                code = status_code(e)
+                print(f"🔁 Gemini {model_name} {code or type(e).__name__}: "
+                      f"{delay:.1f}秒後に再試行します（{attempt}/{self.max_retries}）")
+                time.sleep(delay)
+
+    def print_stats(self) -> None:
+        with self._lock:
+            stats = dict(self.stats)
+            queued, in_flight = self._queued, self._in_flight
+        if not stats['submitted']:
+            return
+        print(f"📊 Geminiリクエスト: {stats['submitted']}件（成功 {stats['succeeded']} / 失敗 {stats['failed']}、"
+              f"再試行 {stats['retries']}回、期限切れ {stats['deadline_exceeded']}件）, "
+              f"待ち {queued}件 / 実行中 {in_flight}件 / 同時実行上限 {self.max_concurrency}, "
+              f"レート待ち合計 {stats['rate_wait_seconds']:.1f}秒")
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+# =============================================================================
+# プロセス共有のプール
+# =============================================================================
+
+def get_request_pool() -> RequestPool:
+    """プロセスで共有するプール（初回に既定の設定で作る）"""
+    global _default_pool
+    if _default_pool is None:
+        with _default_lock:
+            if _default_pool is None:
+                _default_pool = RequestPool()
+    return _default_pool
+
+
+def configure_request_pool(**kwargs) -> RequestPool:
+    """
+    共有プールを指定の設定で作り直す（起動時に1回呼ぶ）
+
+    Args:
+        **kwargs: RequestPool の引数
+    """
+    global _default_pool
+    with _default_lock:
+        previous = _default_pool
+        _default_pool = RequestPool(**kwargs)
+    if previous is not None:
+        previous.shutdown(wait=False)
+    return _default_pool
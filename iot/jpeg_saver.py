@@ -2,80 +2,52 @@ import serial
 import time
 import os
 
+from capture_store import CaptureStore
+from spresense_io import CallbackSink, iter_frames, pump_frames, resync_baud_rate
+
 # ⚠️ MacでのSpresenseのポート名に置き換えてください (例: /dev/cu.SLAB_USBtoUART)
-SERIAL_PORT = '/dev/cu.SLAB_USBtoUART' 
+# 環境変数 SPRESENSE_PORT で上書き可能（spresense_simulator.py の疑似端末を使う場合など）
+SERIAL_PORT = os.getenv("SPRESENSE_PORT", '/dev/cu.SLAB_USBtoUART')
 BAUD_RATE = 115200
 
-# SpresenseのC++コードと完全に一致させること
-# C++で Serial.println(END_MARKER) を使った場合、改行コードが末尾に付く
-START_MARKER = b'START_JPEG'
-END_MARKER = b'END_JPEG' 
+# START_JPEG / END_JPEG マーカーは spresense_io で定義（SpresenseのC++コードと一致）
 OUTPUT_DIR = "captured_images"
 
 def save_jpeg_from_spresense():
     """
     シリアル通信でSpresenseからJPEGデータを受信し、ファイルとして保存する。
     """
-    # 出力ディレクトリが存在しなければ作成
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    
     try:
         # シリアルポートを開く
         ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1.0)
+        # 別のスクリプトがネゴシエーションしたレートのままならそれに合わせる
+        resync_baud_rate(ser)
         print(f"✅ シリアルポート {SERIAL_PORT} でSpresenseからのデータ待機中...")
         print(f"📁 画像は '{OUTPUT_DIR}' フォルダに保存されます。")
         
-        capture_count = 0
         last_log_time = time.time()
+        # 同じ秒に届いたフレームも上書きしないよう通し番号と内容ハッシュで保存する
+        saver = CaptureStore(OUTPUT_DIR)
         
-        while True:
+        def log_waiting():
             # 10秒ごとに待機状態をログ出力
+            nonlocal last_log_time
             current_time = time.time()
             if current_time - last_log_time >= 10:
-                print(f"⏰ [{time.strftime('%H:%M:%S')}] データ待機中... (受信済み: {capture_count}枚)")
+                print(f"⏰ [{time.strftime('%H:%M:%S')}] データ待機中... (受信済み: {saver.saved}枚)")
                 last_log_time = current_time
-            
-            # 1. 開始マーカーを待機
-            # read_until()でSTART_MARKERが検出されるまでデータを読み捨てる
-            line = ser.read_until(START_MARKER)
-            
-            if line.endswith(START_MARKER):
-                capture_count += 1
-                print(f"\n--- [Capture {capture_count}] 受信開始 ---")
-                
-                jpeg_data = b''
-                start_time = time.time()
-                
-                # 2. JPEGデータ本体と終了マーカーを受信する
-                while True:
-                    # データを読み取り（タイムアウトあり）
-                    chunk = ser.read(1024)  # 1KBずつ読み取り
-                    
-                    if chunk:
-                        # 終了マーカーが含まれているかチェック
-                        if END_MARKER in chunk:
-                            # マーカーまでのデータ本体を取得
-                            jpeg_data += chunk.split(END_MARKER)[0]
-                            break
-                        else:
-                            jpeg_data += chunk
-                    
-                    # タイムアウト対策（高解像度画像用に延長）
-                    if time.time() - start_time > 30:  # 30秒に延長
-                        print("❌ 受信タイムアウト。データが途切れた可能性があります。")
-                        break
-
-                if jpeg_data:
-                    # 3. 受信完了とファイル保存
-                    file_name = os.path.join(OUTPUT_DIR, f"capture_{int(time.time())}.jpg")
-                    with open(file_name, "wb") as f:
-                        f.write(jpeg_data)
-                    
-                    print(f"💾 受信完了。サイズ: {len(jpeg_data)} bytes. 保存先: {file_name}")
-                else:
-                    print("⚠️ データを受信できませんでした。")
-
-            time.sleep(0.1) # CPU負荷軽減のための短い待機
+        
+        def report_saved(frame):
+            print(f"\n--- [Capture {frame.sequence}] 受信完了 ({frame.mode}) ---")
+            if frame.duplicate:
+                print(f"♻️ 保存済みの画像と同一のため保存を省略: {frame.path}")
+            else:
+                print(f"💾 受信完了。サイズ: {frame.size} bytes. 保存先: {frame.path}")
+        
+        # マーカー方式 / バイナリフレーム方式を自動判別して受信し続ける
+        # 開始前のデバッグ出力は読み捨て、マーカー前後の CRLF はパーサー側で取り除かれる
+        frames = iter_frames(ser, start_timeout=1.0, payload_timeout=30, on_idle=log_waiting)
+        pump_frames(frames, [saver, CallbackSink(report_saved)])
 
     except serial.SerialException as e:
         print(f"\n❌ シリアルポート接続エラー: {e}")
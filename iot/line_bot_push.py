@@ -15,13 +15,16 @@ import sys
 import requests
 import json
 from datetime import datetime
-from typing import Optional, Tuple, List, Dict, Any
+from typing import Optional, Tuple, List, Dict, Any, Union
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
 # .envファイルから環境変数を読み込み
 load_dotenv()
 
+# 画像はファイルパスか、メモリ上の画像データ（bytes / bytearray / memoryview）で渡せる
+ImageSource = Union[str, bytes, bytearray, memoryview]
+
 # Supabaseクライアントの初期化
 def _get_supabase_client() -> Tuple[Client, str]:
     """Supabaseクライアントとバケット名を取得"""
@@ -51,12 +54,37 @@ def _get_line_bot_config() -> Tuple[str, str, str]:
     return access_token, push_url, broadcast_url
 
 # [1] Supabaseへ画像をアップロードする関数
-def upload_images_to_supabase(original_path: str, preview_path: str) -> Optional[Tuple[str, str]]:
+def _load_upload_image(image: ImageSource, name: Optional[str]) -> Tuple[bytes, str]:
+    """
+    アップロードする画像のデータとファイル名を返す
+    
+    パスを渡された場合だけディスクから読み込み、画像データ（bytes / bytearray / memoryview）は
+    そのまま使う（bytes 以外はアップロードAPIに合わせてここで1回だけ bytes にする）。
+    """
+    if isinstance(image, str):
+        with open(image, 'rb') as f:
+            return f.read(), name or _default_image_name(image, "image.jpg")
+    data = image if isinstance(image, bytes) else bytes(image)
+    return data, name or _default_image_name(image, "image.jpg")
+
+def _default_image_name(image: ImageSource, fallback: str) -> str:
+    """パスならファイル名、画像データなら fallback を返す"""
+    return os.path.basename(image) if isinstance(image, str) else fallback
+
+def _content_type(data: bytes) -> str:
+    """画像データの先頭バイトから Content-Type を判定（PNG以外は JPEG 扱い）"""
+    return "image/png" if data.startswith(b'\x89PNG') else "image/jpeg"
+
+def upload_images_to_supabase(original: ImageSource, preview: ImageSource,
+                              original_name: Optional[str] = None,
+                              preview_name: Optional[str] = None) -> Optional[Tuple[str, str]]:
     """
     指定されたオリジナル画像とプレビュー画像をSupabaseストレージにアップロード
     Args:
-        original_path: オリジナル画像のファイルパス
-        preview_path: プレビュー画像のファイルパス
+        original: オリジナル画像のファイルパス、または画像データ
+        preview: プレビュー画像のファイルパス、または画像データ
+        original_name: オリジナル画像のファイル名（画像データを渡す場合）
+        preview_name: プレビュー画像のファイル名（画像データを渡す場合）
     Returns: 
         (original_url, preview_url) のタプル、失敗時はNone
     """
@@ -65,31 +93,29 @@ def upload_images_to_supabase(original_path: str, preview_path: str) -> Optional
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         # オリジナル画像をアップロード
-        with open(original_path, 'rb') as f:
-            original_data = f.read()
+        original_data, original_name = _load_upload_image(original, original_name)
         
-        original_file_name = f"{timestamp}_original_{os.path.basename(original_path)}"
+        original_file_name = f"{timestamp}_original_{original_name}"
         
         supabase.storage.from_(bucket_name).upload(
             original_file_name,
             original_data,
             file_options={
-                "content-type": "image/jpeg",
+                "content-type": _content_type(original_data),
                 "upsert": "true"
             }
         )
         
         # プレビュー画像をアップロード
-        with open(preview_path, 'rb') as f:
-            preview_data = f.read()
+        preview_data, preview_name = _load_upload_image(preview, preview_name)
         
-        preview_file_name = f"{timestamp}_preview_{os.path.basename(preview_path)}"
+        preview_file_name = f"{timestamp}_preview_{preview_name}"
         
         supabase.storage.from_(bucket_name).upload(
             preview_file_name,
             preview_data,
             file_options={
-                "content-type": "image/jpeg",
+                "content-type": _content_type(preview_data),
                 "upsert": "true"
             }
         )
@@ -157,28 +183,36 @@ def send_line_message(messages: List[Dict[str, Any]], user_id: Optional[str] = N
 
 
 # [3] preview/original URL指定してメッセージを送信する関数（他ファイルから呼び出し用）
-def send_image_with_line_push(original_path: str, preview_path: str, user_id: Optional[str] = None) -> bool:
+def send_image_with_line_push(original: ImageSource, preview: ImageSource,
+                              user_id: Optional[str] = None,
+                              original_name: Optional[str] = None,
+                              preview_name: Optional[str] = None) -> bool:
     """
     指定した画像をアップロードしてLINE Botで送信
     Args:
-        original_path: オリジナル画像のファイルパス
-        preview_path: プレビュー画像のファイルパス
+        original: オリジナル画像のファイルパス、または画像データ（bytes / bytearray / memoryview）
+        preview: プレビュー画像のファイルパス、または画像データ
         user_id: 送信先のユーザーID (Noneの場合はブロードキャスト)
+        original_name: オリジナル画像のファイル名（画像データを渡す場合）
+        preview_name: プレビュー画像のファイル名（画像データを渡す場合）
     Returns:
         送信成功時True、失敗時False
     """
     try:
-        # ファイルの存在確認
-        if not os.path.exists(original_path):
-            print(f"オリジナル画像が見つかりません: {original_path}")
+        # ファイルの存在確認（画像データを渡された場合はディスクを見ない）
+        if isinstance(original, str) and not os.path.exists(original):
+            print(f"オリジナル画像が見つかりません: {original}")
             return False
         
-        if not os.path.exists(preview_path):
-            print(f"プレビュー画像が見つかりません: {preview_path}")
+        if isinstance(preview, str) and not os.path.exists(preview):
+            print(f"プレビュー画像が見つかりません: {preview}")
             return False
         
+        original_name = original_name or _default_image_name(original, "original.jpg")
+        preview_name = preview_name or _default_image_name(preview, "preview.jpg")
+        
         # [1] 画像をSupabaseにアップロード
-        image_urls = upload_images_to_supabase(original_path, preview_path)
+        image_urls = upload_images_to_supabase(original, preview, original_name, preview_name)
         
         if not image_urls:
             print("画像のアップロードに失敗しました")
@@ -199,8 +233,8 @@ def send_image_with_line_push(original_path: str, preview_path: str, user_id: Op
         # 情報テキスト
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         info_text = f"""📸 画像送信完了
-オリジナル: {os.path.basename(original_path)}
-プレビュー: {os.path.basename(preview_path)}
+オリジナル: {original_name}
+プレビュー: {preview_name}
 送信時刻: {timestamp}
 ✅ 画像アップロード成功"""
         
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+負荷試験用のローカル分析サーバー（Gemini の代わり）
+
+HttpAnalyzer（--analyzer http）の接続先として、通信なし・決まった結果で
+パイプラインのスループットとテイルレイテンシを測るためのサーバー。
+
+- POST /analyze: JPEG本体を受け取り {"face_detected": bool, "is_pose": bool} を返す
+  - 応答までの遅延は --latency の分布から引く（fixed:MS / uniform:MIN:MAX / lognormal:MEDIAN:SIGMA）
+  - --error-rate の割合で 503、--throttle-rate の割合で 429 を返す（再試行の確認用）
+  - 結果は画像の内容ハッシュ（capture_store.content_hash）毎の固定回答（--answers のJSON）、
+    無ければ --default-answer に従う（hash: ハッシュから決まる結果で、同じ画像には常に同じ結果）
+- GET /stats: 処理件数・エラー件数（JSON）
+
+--seed を指定すると遅延・エラーの乱数列も再現できる。
+
+使用例:
+python mock_analysis_server.py --port 8765 --latency lognormal:300:0.5 --error-rate 0.02
+python integrated_photo_system.py --pipeline --analyzer http --analyzer-url http://127.0.0.1:8765/analyze --dry-run
+
+# 固定回答のファイルを作るために画像の内容ハッシュを表示
+python mock_analysis_server.py --hash captured_images/*.jpg
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from analysis_result import AnalysisResult, parse_analysis
+from capture_store import content_hash
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+DEFAULT_PORT = 8765
+DEFAULT_LATENCY = "lognormal:300:0.5"
+DEFAULT_ANSWERS = ("hash", "no", "face", "pose")
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+
+class LatencyModel:
+    """応答遅延の分布"""
+
+    def __init__(self, spec: str = DEFAULT_LATENCY):
+        """
+        Args:
+            spec: fixed:MS / uniform:MIN_MS:MAX_MS / lognormal:MEDIAN_MS:SIGMA
+        """
+        kind, *params = spec.split(":")
+        try:
+            values = [float(p) for p in params]
+        except ValueError:
+            raise ValueError(f"遅延の指定が不正です: {spec}") from None
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2}.get(kind)
+        if expected is None or len(values) != expected or any(v < 0 for v in values):
+            raise ValueError(f"遅延は fixed:MS / uniform:MIN:MAX / lognormal:MEDIAN:SIGMA で指定してください: {spec}")
+        self.spec = spec
+        self.kind = kind
+        self.values = values
+
+    def sample(self, rng: random.Random) -> float:
+        """遅延（秒）を1つ引く"""
+        if self.kind == "fixed":
+            ms = self.values[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(*self.values)
+        else:
+            median, sigma = self.values
+            ms = median * rng.lognormvariate(0.0, sigma)
+        return ms / 1000.0
+
+
+def hash_answer(digest: str) -> AnalysisResult:
+    """内容ハッシュから決まる回答（およそ 1/2 が顔あり、1/4 がポーズあり）"""
+    value = int(digest[:2], 16)
+    face = value % 2 == 0
+    return {"face_detected": face, "is_pose": face and value % 4 == 0}
+
+
+def load_answers(path: Optional[str]) -> Dict[str, AnalysisResult]:
+    """{内容ハッシュ: {"face_detected": bool, "is_pose": bool}} のJSONファイルを読む"""
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    return {digest: parse_analysis(json.dumps(answer)) for digest, answer in raw.items()}
+
+
+class MockAnalysisBackend:
+    """リクエスト毎の遅延・エラー・回答を決める（複数のリクエストスレッドから使われる）"""
+
+    def __init__(self, latency: LatencyModel, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 answers: Optional[Dict[str, AnalysisResult]] = None, default_answer: str = "hash",
+                 seed: Optional[int] = None):
+        """
+        Args:
+            latency: 応答遅延の分布
+            error_rate: 503 を返す割合（0〜1）
+            throttle_rate: 429 を返す割合（0〜1）
+            answers: 内容ハッシュ毎の固定回答
+            default_answer: 固定回答が無い画像の回答（hash / no / face / pose）
+            seed: 乱数シード
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.answers = answers or {}
+        self.default_answer = default_answer
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0, "canned": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def answer_for(self, digest: str) -> AnalysisResult:
+        answer = self.answers.get(digest)
+        if answer is not None:
+            return answer
+        if self.default_answer == "hash":
+            return hash_answer(digest)
+        face = self.default_answer in ("face", "pose")
+        return {"face_detected": face, "is_pose": self.default_answer == "pose"}
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+    def handle(self, body: bytes):
+        """(ステータス, 応答の辞書, 遅延秒) を返す"""
+        with self._lock:
+            self.stats["requests"] += 1
+            delay = self.latency.sample(self._rng)
+            roll = self._rng.random()
+        if roll < self.throttle_rate:
+            status = 429
+        elif roll < self.throttle_rate + self.error_rate:
+            status = 503
+        else:
+            status = 200
+        if status != 200:
+            with self._lock:
+                self.stats["throttled" if status == 429 else "errors"] += 1
+            return status, {"error": "throttled" if status == 429 else "unavailable"}, delay
+        digest = content_hash(body)
+        answer = self.answer_for(digest)
+        with self._lock:
+            self.stats["ok"] += 1
+            if digest in self.answers:
+                self.stats["canned"] += 1
+        return status, answer, delay
+
+
+def start_mock_server(backend: MockAnalysisBackend, port: int = DEFAULT_PORT,
+                      host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    分析サーバーをデーモンスレッドで起動する
+
+    Args:
+        backend: 応答を決めるバックエンド
+        port: 待ち受けポート（0 なら空いているポート）
+        host: 待ち受けアドレス（既定はローカルのみ）
+
+    Returns:
+        起動したサーバー（server_address で実際のポート、shutdown() で停止）
+    """
+
+    class AnalysisHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # HttpAnalyzer が接続を使い回せるようにする
+
+        def do_POST(self):
+            if self.path.split("?", 1)[0] != "/analyze":
+                self._reply(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if not 0 < length <= MAX_BODY_BYTES:
+                self.close_connection = True  # 本体を読まないので接続は使い回さない
+                self._reply(400, {"error": "body required"})
+                return
+            status, payload, delay = backend.handle(self.rfile.read(length))
+            time.sleep(delay)
+            self._reply(status, payload)
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/stats":
+                self._reply(404, {"error": "not found"})
+                return
+            self._reply(200, backend.snapshot())
+
+        def _reply(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # リクエスト毎のアクセスログは出さない
+
+    server = ThreadingHTTPServer((host, port), AnalysisHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="mock-analysis-server", daemon=True)
+    thread.start()
+    return server
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='負荷試験用のローカル分析サーバー')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'待ち受けポート（既定: {DEFAULT_PORT}）')
+    parser.add_argument('--host', default="127.0.0.1", help='待ち受けアドレス（既定: 127.0.0.1）')
+    parser.add_argument('--latency', default=DEFAULT_LATENCY,
+                        help=f'応答遅延の分布 fixed:MS / uniform:MIN:MAX / lognormal:MEDIAN:SIGMA（既定: {DEFAULT_LATENCY}）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='503 を返す割合（0〜1、既定: 0）')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='429 を返す割合（0〜1、既定: 0）')
+    parser.add_argument('--answers', default=None, metavar='JSON',
+                        help='{内容ハッシュ: {"face_detected": bool, "is_pose": bool}} の固定回答ファイル')
+    parser.add_argument('--default-answer', choices=DEFAULT_ANSWERS, default="hash",
+                        help='固定回答が無い画像の回答（既定: hash = 内容ハッシュから決める）')
+    parser.add_argument('--seed', type=int, default=None, help='乱数シード')
+    parser.add_argument('--hash', nargs='+', default=None, metavar='IMAGE',
+                        help='画像の内容ハッシュを表示して終了する（固定回答ファイルの作成用）')
+    args = parser.parse_args(argv)
+    if not 0 <= args.error_rate <= 1 or not 0 <= args.throttle_rate <= 1 \
+            or args.error_rate + args.throttle_rate > 1:
+        parser.error('--error-rate / --throttle-rate は 0〜1（合計 1 以下）で指定してください')
+    try:
+        args.latency = LatencyModel(args.latency)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.hash:
+        for path in args.hash:
+            with open(path, "rb") as f:
+                print(f"{content_hash(f.read())}  {path}")
+        return
+
+    answers = load_answers(args.answers)
+    backend = MockAnalysisBackend(args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                                  answers=answers, default_answer=args.default_answer, seed=args.seed)
+    server = start_mock_server(backend, args.port, args.host)
+    host, port = server.server_address[:2]
+    print(f"🧪 分析サーバー起動: http://{host}:{port}/analyze")
+    print(f"   遅延 {args.latency.spec} / 503 {args.error_rate:.0%} / 429 {args.throttle_rate:.0%} / "
+          f"固定回答 {len(answers)}件（その他: {args.default_answer}）")
+    print("   🛑 終了するには Ctrl+C を押してください")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"📊 {json.dumps(backend.snapshot())}")
+    except KeyboardInterrupt:
+        print(f"\n👋 分析サーバーを終了します: {json.dumps(backend.snapshot())}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+シーン変化のローカル事前判定（Gemini 呼び出しの前段フィルター）
+
+常時稼働では、誰もいない同じ部屋を写したフレームまで毎回 Gemini に送っていた。
+ここでは CPU だけでフレームを縮小デコードし、カメラ毎の背景（最近のフレームの
+移動平均）と比べて変化があったフレームだけを AI 分析に回す。
+
+- デコード: Pillow の draft() で JPEG を DCT 段階で 1/2〜1/8 に縮小しながらグレースケールで読み込み、
+  THUMBNAIL_SIZE に揃える（QVGA なら数百マイクロ秒）
+- 判定: 背景との平均絶対差（画面全体の変化）と、BLOCK_SIZE 四方のブロック毎の
+  平均絶対差（人が小さく写り込んだ等の局所的な変化）のどちらかが閾値を超えたら「変化あり」
+- 背景: 変化なしのフレームは移動平均に取り込み（照明のゆっくりした変化を吸収）、
+  変化ありのフレームで置き換える
+- max_skip_seconds 以上スキップが続いたら、変化が無くても1枚は分析に回す（静止した人の見逃し対策）
+
+使用例:
+    motion_filter = MotionFilter(threshold=6.0)
+    result = motion_filter.check(frame.data, camera=frame.camera)
+    if result.changed and analyze_person_and_pose(frame.data) is None:
+        motion_filter.reset(frame.camera)  # 分析できなかった場面は次のフレームで改めて通す
+"""
+
+import threading
+import time
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+THUMBNAIL_SIZE = (64, 48)  # 比較用の縮小サイズ（幅, 高さ）。BLOCK_SIZE の倍数にする
+BLOCK_SIZE = 8  # ブロック統計の1辺（縮小後のピクセル）
+DEFAULT_THRESHOLD = 6.0  # 画面全体の平均絶対差（0〜255）がこれ以上なら変化あり
+DEFAULT_BLOCK_THRESHOLD = 20.0  # ブロックの平均絶対差がこれ以上のブロックを「変化したブロック」とする
+DEFAULT_MIN_BLOCKS = 1  # 変化したブロックがこの数以上なら変化あり（遠くの小さな人も拾う）
+DEFAULT_BACKGROUND_ALPHA = 0.2  # 変化なしのフレームを背景に取り込む割合
+DEFAULT_MAX_SKIP_SECONDS = 60.0
+
+
+class MotionResult:
+    """1フレームの判定結果"""
+
+    def __init__(self, changed: bool, reason: str, score: float = 0.0,
+                 changed_blocks: int = 0, decode_seconds: float = 0.0):
+        """
+        Args:
+            changed: 分析に回すなら True
+            reason: 判定理由（first / motion / blocks / heartbeat / static / decode_error）
+            score: 背景との平均絶対差（0〜255）
+            changed_blocks: 閾値を超えたブロック数
+            decode_seconds: 縮小デコードにかかった秒数
+        """
+        self.changed = changed
+        self.reason = reason
+        self.score = score
+        self.changed_blocks = changed_blocks
+        self.decode_seconds = decode_seconds
+
+    def __repr__(self) -> str:
+        return (f"MotionResult(changed={self.changed}, reason={self.reason!r}, "
+                f"score={self.score:.1f}, changed_blocks={self.changed_blocks})")
+
+
+def decode_thumbnail(image_data, size: Tuple[int, int] = THUMBNAIL_SIZE) -> np.ndarray:
+    """
+    JPEG を縮小デコードしてグレースケールの float32 配列（高さ×幅）にする
+
+    Args:
+        image_data: JPEGデータ（bytes / bytearray / memoryview）
+        size: 縮小後のサイズ（幅, 高さ）
+    """
+    with Image.open(BytesIO(image_data)) as image:
+        image.draft("L", size)  # JPEG は DCT のスケーリングで縮小しながらデコードする
+        thumbnail = image.convert("L").resize(size, Image.BILINEAR)
+    return np.array(thumbnail, dtype=np.float32)
+
+
+class MotionFilter:
+    """
+    カメラ毎の背景と比べて変化のあったフレームだけを通すフィルター
+
+    複数のカメラスレッド・パイプラインワーカーから同時に check() してよい。
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD,
+                 block_threshold: float = DEFAULT_BLOCK_THRESHOLD,
+                 min_blocks: int = DEFAULT_MIN_BLOCKS,
+                 background_alpha: float = DEFAULT_BACKGROUND_ALPHA,
+                 max_skip_seconds: Optional[float] = DEFAULT_MAX_SKIP_SECONDS,
+                 size: Tuple[int, int] = THUMBNAIL_SIZE):
+        """
+        Args:
+            threshold: 画面全体の平均絶対差の閾値
+            block_threshold: ブロック毎の平均絶対差の閾値
+            min_blocks: 変化ありとする変化ブロック数
+            background_alpha: 変化なしのフレームを背景に取り込む割合（0〜1）
+            max_skip_seconds: この秒数以上スキップが続いたら1枚通す（None なら通さない）
+            size: 比較用の縮小サイズ（幅, 高さ、BLOCK_SIZE の倍数）
+        """
+        self.threshold = threshold
+        self.block_threshold = block_threshold
+        self.min_blocks = min_blocks
+        self.background_alpha = background_alpha
+        self.max_skip_seconds = max_skip_seconds
+        self.size = size
+        self._backgrounds: Dict[str, np.ndarray] = {}
+        self._last_forwarded: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def check(self, image_data, camera: str = "default") -> MotionResult:
+        """
+        フレームを判定し、カメラの背景を更新する
+
+        デコードできないフレームは判定できないので通す（分析側でエラーにする）。
+        変化ありのフレームはその場で背景になるため、通したフレームの分析に失敗した場合は
+        reset(camera) を呼ぶ（同じ場面の後続フレームを「変化なし」にしない）。
+        """
+        start = time.perf_counter()
+        try:
+            current = decode_thumbnail(image_data, self.size)
+        except Exception:
+            result = MotionResult(True, "decode_error")
+            self._count(camera, result)
+            return result
+        decode_seconds = time.perf_counter() - start
+
+        now = time.time()
+        with self._lock:
+            background = self._backgrounds.get(camera)
+            if background is None:
+                result = MotionResult(True, "first")
+            else:
+                diff = np.abs(current - background)
+                score = float(diff.mean())
+                changed_blocks = self._count_changed_blocks(diff)
+                if score >= self.threshold:
+                    result = MotionResult(True, "motion", score, changed_blocks)
+                elif changed_blocks >= self.min_blocks:
+                    result = MotionResult(True, "blocks", score, changed_blocks)
+                elif (self.max_skip_seconds is not None
+                      and now - self._last_forwarded.get(camera, now) >= self.max_skip_seconds):
+                    result = MotionResult(True, "heartbeat", score, changed_blocks)
+                else:
+                    result = MotionResult(False, "static", score, changed_blocks)
+
+            if result.changed:
+                self._backgrounds[camera] = current
+                self._last_forwarded[camera] = now
+            else:
+                # ゆっくりした変化（照明など）は背景に取り込む
+                background += self.background_alpha * (current - background)
+        result.decode_seconds = decode_seconds
+        self._count(camera, result)
+        return result
+
+    def _count_changed_blocks(self, diff: np.ndarray) -> int:
+        """BLOCK_SIZE 四方のブロック毎の平均差が block_threshold 以上のブロック数"""
+        height, width = diff.shape
+        rows, cols = height // BLOCK_SIZE, width // BLOCK_SIZE
+        blocks = diff[:rows * BLOCK_SIZE, :cols * BLOCK_SIZE].reshape(rows, BLOCK_SIZE, cols, BLOCK_SIZE)
+        return int((blocks.mean(axis=(1, 3)) >= self.block_threshold).sum())
+
+    def _count(self, camera: str, result: MotionResult) -> None:
+        with self._lock:
+            stat = self.stats.setdefault(
+                camera, {'checked': 0, 'forwarded': 0, 'skipped': 0, 'decode_seconds': 0.0}
+            )
+            stat['checked'] += 1
+            stat['forwarded' if result.changed else 'skipped'] += 1
+            stat['decode_seconds'] += result.decode_seconds
+
+    def reset(self, camera: Optional[str] = None) -> None:
+        """背景を捨てる（次のフレームは必ず通す。通したフレームの分析に失敗した時など）"""
+        with self._lock:
+            if camera is None:
+                self._backgrounds.clear()
+                self._last_forwarded.clear()
+            else:
+                self._backgrounds.pop(camera, None)
+                self._last_forwarded.pop(camera, None)
+
+    @property
+    def skipped(self) -> int:
+        """スキップした（Gemini 呼び出しを省略した）フレーム数の合計"""
+        with self._lock:
+            return int(sum(stat['skipped'] for stat in self.stats.values()))
+
+    def print_stats(self) -> None:
+        """カメラ毎の判定数・スキップ数（= 省略したAPI呼び出し）を表示"""
+        with self._lock:
+            stats = {camera: dict(stat) for camera, stat in self.stats.items()}
+        if not stats:
+            return
+        print("📊 変化検出フィルター:")
+        for camera, stat in stats.items():
+            checked = int(stat['checked'])
+            rate = stat['skipped'] / checked * 100 if checked else 0.0
+            decode_ms = stat['decode_seconds'] / checked * 1000 if checked else 0.0
+            print(f"   [{camera}] 判定 {checked}枚 / 分析へ {int(stat['forwarded'])}枚 "
+                  f"/ API呼び出し省略 {int(stat['skipped'])}回 ({rate:.0f}%) / デコード平均 {decode_ms:.2f}ms")
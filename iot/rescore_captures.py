@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+保存済みキャプチャの一括（再）分析
+
+プロンプトや判定方法を変えた後に、captured_images や capture_archive に溜まった
+数千枚を分析し直すためのツール。gemini_analyzer*.py のように1ファイルずつではなく、
+
+- ディレクトリ（JPEGを再帰的に探す）またはキャプチャアーカイブ（segment_*.idx があれば自動判定）を読む
+- 分析バックエンド（analyzers.py の gemini / rule / http）を --workers 本で並行に呼ぶ
+  （読み込み待ちの画像も --workers の2倍までに抑え、メモリに全件を載せない）
+- 結果を1件ずつ結果ファイルへ書く（拡張子 .db / .sqlite / .sqlite3 は SQLite、それ以外は JSON Lines）
+- 再実行時は結果ファイルにある内容ハッシュ（capture_store.content_hash）を読み飛ばす
+  （中断しても続きから再開でき、同じ内容の画像は1回だけ分析する）
+- 処理速度（枚/秒）と1枚あたりの分析時間の p50 / p95 を途中経過と最後に表示する
+
+プロンプトを変えて全件を分析し直す場合は、新しい結果ファイルを指定する。
+分析に失敗した画像は結果ファイルに書かないので、再実行すると分析し直す。
+
+使用例:
+python rescore_captures.py captured_images scores.jsonl
+python rescore_captures.py capture_archive scores.db --workers 8 --rpm 300 --start 2025-10-18T12:00
+python rescore_captures.py captured_images scores.jsonl --analyzer http --workers 16
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from analysis_image import AnalysisDownscaler
+from analyzers import ANALYZER_BACKENDS, DEFAULT_GEMINI_MODEL, DEFAULT_MOCK_URL, Analyzer, create_analyzer
+from capture_archive import CaptureArchive, parse_time
+from capture_store import content_hash
+from gemini_pool import configure_request_pool
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+DEFAULT_WORKERS = 4
+PROGRESS_INTERVAL = 10.0  # 秒
+SQLITE_COMMIT_EVERY = 50  # 件（中断時に失うのは最大この件数で、再実行で分析し直す）
+
+# 画像の読み込み元: (表示名, データを読む関数)
+ImageSource = Tuple[str, Callable[[], bytes]]
+
+
+# =============================================================================
+# 入力
+# =============================================================================
+
+def is_archive(path: str) -> bool:
+    return bool(glob.glob(os.path.join(path, "segment_*.idx")))
+
+
+def iter_directory(directory: str) -> Iterator[ImageSource]:
+    """ディレクトリ以下のJPEGを名前順に返す（読み込みはワーカー側で行う）"""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+
+                def read(path=path) -> bytes:
+                    with open(path, "rb") as f:
+                        return f.read()
+
+                yield os.path.relpath(path, directory), read
+
+
+def iter_archive(archive: CaptureArchive, start: Optional[float] = None, end: Optional[float] = None,
+                 camera: Optional[str] = None) -> Iterator[ImageSource]:
+    """アーカイブのフレームを古い順に返す（データはセグメントを指す memoryview のまま渡す）"""
+    for record in archive.iter_range(start, end, camera):
+        yield f"{record.segment}#{record.sequence}", (lambda data=record.data: data)
+
+
+# =============================================================================
+# 結果ファイル
+# =============================================================================
+
+class JsonlResults:
+    """1件1行の JSON Lines（追記のたびに flush する）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def load_hashes(self) -> Set[str]:
+        """分析済みの内容ハッシュ（途中で切れた最後の行は無視する）"""
+        hashes: Set[str] = set()
+        if not os.path.exists(self.path):
+            return hashes
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    hashes.add(json.loads(line)["hash"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return hashes
+
+    def open(self) -> None:
+        needs_newline = False
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(self.path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")  # 中断で切れた行の後ろに続けて書かない
+
+    def write(self, record: Dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SqliteResults:
+    """SQLite の results テーブル（内容ハッシュが主キー）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pending = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " hash TEXT PRIMARY KEY, source TEXT, face_detected INTEGER, is_pose INTEGER,"
+                " analyzer TEXT, latency_ms REAL, scored_at TEXT)"
+            )
+        return self._connection
+
+    def load_hashes(self) -> Set[str]:
+        return {row[0] for row in self._connect().execute("SELECT hash FROM results")}
+
+    def open(self) -> None:
+        self._connect()
+
+    def write(self, record: Dict) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (:hash, :source, :face_detected, :is_pose,"
+            " :analyzer, :latency_ms, :scored_at)", record
+        )
+        self._pending += 1
+        if self._pending >= SQLITE_COMMIT_EVERY:
+            self._connection.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+
+
+def open_results(path: str):
+    """拡張子で JSON Lines / SQLite を選ぶ"""
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteResults(path)
+    return JsonlResults(path)
+
+
+# =============================================================================
+# 一括分析
+# =============================================================================
+
+class Rescorer:
+    """画像を並行に分析し、結果を呼び出し元のスレッドで1件ずつ書く"""
+
+    def __init__(self, analyzer: Analyzer, results, workers: int = DEFAULT_WORKERS,
+                 progress_interval: float = PROGRESS_INTERVAL):
+        """
+        Args:
+            analyzer: 分析バックエンド
+            results: 結果ファイル（JsonlResults / SqliteResults）
+            workers: 並行して分析する数
+            progress_interval: 途中経過を表示する間隔（秒）
+        """
+        self.analyzer = analyzer
+        self.results = results
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.stats = {'scored': 0, 'skipped': 0, 'failed': 0, 'unreadable': 0}
+        self.latencies: List[float] = []
+        self._seen: Set[str] = set()
+        self._seen_lock = threading.Lock()
+        self._started = 0.0
+
+    def _claim(self, digest: str) -> bool:
+        """未分析の内容ハッシュなら確保して True（同じ内容の画像を並行して分析しない）"""
+        with self._seen_lock:
+            if digest in self._seen:
+                return False
+            self._seen.add(digest)
+            return True
+
+    def _score(self, source: str, read) -> Tuple[str, Optional[Dict]]:
+        """1枚を読み込んで分析する（ワーカースレッド）"""
+        try:
+            data = read()
+            digest = content_hash(data)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 読み込めません: {source}: {e}")
+            return "unreadable", None
+        if not self._claim(digest):
+            return "skipped", None
+        start = time.perf_counter()
+        result = self.analyzer.analyze(data)
+        latency = time.perf_counter() - start
+        if result is None:
+            with self._seen_lock:
+                self._seen.discard(digest)  # 結果ファイルに書かないので、再実行時に分析し直す
+            return "failed", None
+        return "scored", {
+            "hash": digest,
+            "source": source,
+            "face_detected": result["face_detected"],
+            "is_pose": result["is_pose"],
+            "analyzer": self.analyzer.name,
+            "latency_ms": round(latency * 1000, 1),
+            "scored_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def run(self, sources: Iterator[ImageSource]) -> None:
+        self._seen = self.results.load_hashes()
+        if self._seen:
+            print(f"⏭️ 結果ファイルの {len(self._seen)}件は分析済みとして読み飛ばします")
+        self.results.open()
+        self._started = time.time()
+        last_progress = self._started
+        pending: Set[Future] = set()
+        sources = iter(sources)
+        exhausted = False
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rescore")
+        try:
+            while pending or not exhausted:
+                # 読み込み待ちを含めて workers の2倍までに抑える
+                while not exhausted and len(pending) < self.workers * 2:
+                    try:
+                        source, read = next(sources)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(executor.submit(self._score, source, read))
+                if not pending:
+                    break
+                done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._record(*future.result())
+                if time.time() - last_progress >= self.progress_interval:
+                    self.print_progress()
+                    last_progress = time.time()
+        finally:
+            # 中断時は未着手の画像を捨てる（分析中のものは結果を書かずに終わり、再実行で分析し直す）
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.results.close()
+
+    def _record(self, outcome: str, record: Optional[Dict]) -> None:
+        self.stats[outcome] += 1
+        if record is not None:
+            self.results.write(record)
+            self.latencies.append(record["latency_ms"] / 1000)
+
+    def print_progress(self, final: bool = False) -> None:
+        elapsed = max(time.time() - self._started, 1e-9)
+        scored = self.stats['scored']
+        line = (f"{'✅ 完了' if final else '⏳ 途中経過'}: 分析 {scored}枚 ({scored / elapsed:.2f} 枚/秒), "
+                f"分析済みで省略 {self.stats['skipped']}枚, 失敗 {self.stats['failed']}枚, "
+                f"読込不可 {self.stats['unreadable']}枚, 経過 {elapsed:.0f}秒")
+        if len(self.latencies) >= 2:
+            cuts = statistics.quantiles(self.latencies, n=100)
+            line += f", 分析時間 p50 {cuts[49] * 1000:.0f}ms / p95 {cuts[94] * 1000:.0f}ms"
+        elif self.latencies:
+            line += f", 分析時間 {self.latencies[0] * 1000:.0f}ms"
+        print(line)
+
+
+# =============================================================================
+# メイン
+# =============================================================================
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='保存済みキャプチャの一括（再）分析')
+    parser.add_argument('source', help='画像ディレクトリまたはキャプチャアーカイブ')
+    parser.add_argument('results', help='結果ファイル（.jsonl / .db）。既にある場合は分析済みの画像を読み飛ばす')
+    parser.add_argument('--analyzer', choices=ANALYZER_BACKENDS, default='gemini',
+                        help='分析バックエンド（既定: gemini）')
+    parser.add_argument('--analyzer-url', default=DEFAULT_MOCK_URL,
+                        help=f'--analyzer http の分析エンドポイント（既定: {DEFAULT_MOCK_URL}）')
+    parser.add_argument('--model', default=DEFAULT_GEMINI_MODEL,
+                        help=f'--analyzer gemini のモデル（既定: {DEFAULT_GEMINI_MODEL}）')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'並行して分析する数（既定: {DEFAULT_WORKERS}）')
+    parser.add_argument('--rpm', type=float, default=None,
+                        help='1分あたりのリクエスト上限（既定: 無制限）')
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='1枚あたりの期限（秒、再試行の待ちを含む、既定: 120）')
+    parser.add_argument('--analysis-max-edge', type=int, default=768,
+                        help='--analyzer gemini で送る画像の長辺（0で縮小しない、既定: 768）')
+    parser.add_argument('--start', type=parse_time, default=None, help='アーカイブの開始時刻（UNIX秒 / ISO 8601）')
+    parser.add_argument('--end', type=parse_time, default=None, help='アーカイブの終了時刻（この時刻を含まない）')
+    parser.add_argument('--camera', default=None, help='アーカイブをカメラ（ポート名）で絞り込む')
+    parser.add_argument('--progress', type=float, default=PROGRESS_INTERVAL,
+                        help=f'途中経過の表示間隔（秒、既定: {PROGRESS_INTERVAL:g}）')
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers は 1 以上で指定してください')
+    if (args.rpm is not None and args.rpm <= 0) or args.timeout <= 0 or args.analysis_max_edge < 0:
+        parser.error('--rpm / --timeout は 0 より大きく、--analysis-max-edge は 0 以上で指定してください')
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv()
+    args = parse_args(argv)
+    if not os.path.isdir(args.source):
+        print(f"❌ ディレクトリが見つかりません: {args.source}")
+        return 1
+
+    # 分析リクエストは共有プール経由（同時実行数 = ワーカー数、429/5xx は再試行）
+    pool = configure_request_pool(max_concurrency=args.workers, timeout=args.timeout)
+    analyzer = create_analyzer(args.analyzer, model_name=args.model,
+                               downscaler=AnalysisDownscaler(max_edge=args.analysis_max_edge or None),
+                               url=args.analyzer_url)
+    pool.set_rate(args.model if args.analyzer == 'gemini' else args.analyzer_url, args.rpm)
+
+    archive = None
+    if is_archive(args.source):
+        # 稼働中の integrated_photo_system が書き込み中でもよいよう読み取り専用で開く
+        # （末尾の書きかけレコードを切り詰めたりロックを奪ったりしない）
+        archive = CaptureArchive(args.source, read_only=True)
+        print(f"🗄️ アーカイブ: {args.source}（{len(archive)}フレーム）")
+        sources = iter_archive(archive, args.start, args.end, args.camera)
+    else:
+        print(f"📁 ディレクトリ: {args.source}")
+        sources = iter_directory(args.source)
+    print(f"🧠 分析バックエンド: {analyzer.name} / 並行 {args.workers} / 結果: {args.results}")
+
+    rescorer = Rescorer(analyzer, open_results(args.results), workers=args.workers,
+                        progress_interval=args.progress)
+    try:
+        rescorer.run(sources)
+    except KeyboardInterrupt:
+        print("\n👋 中断しました（再実行すると続きから分析します）")
+    finally:
+        rescorer.print_progress(final=True)
+        analyzer.print_stats()
+        pool.print_stats()
+        if archive is not None:
+            archive.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
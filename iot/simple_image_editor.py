@@ -1,5 +1,4 @@
 import os
-from google import genai
 from google.genai import types
 from PIL import Image
 from dotenv import load_dotenv
@@ -7,16 +6,27 @@ import time
 from io import BytesIO
 import base64
 import sys
+import threading
+
+from gemini_clients import get_genai_client
+from gemini_pool import get_request_pool
 
 # 環境変数をロード
 load_dotenv()
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+DEFAULT_EDIT_MODEL = 'gemini-2.0-flash-exp'
+
+# 変換毎に作り直さないよう、ImageEditor はモデル名・出力先毎に1つを共有する
+_editors = {}
+_editors_lock = threading.Lock()
+
 class ImageEditor:
     """
     Gemini 2.0 Flash を使用したアメコミ風画像変換クラス
     """
     
-    def __init__(self, model_name='gemini-2.0-flash-exp', output_dir="edited_images"):
+    def __init__(self, model_name=DEFAULT_EDIT_MODEL, output_dir="edited_images"):
         """
         初期化
         
@@ -36,7 +46,8 @@ class ImageEditor:
             raise ValueError("環境変数 'GEMINI_API_KEY' が設定されていません。")
         
         try:
-            self.client = genai.Client(api_key=api_key)
+            # genai.Client はプロセスで共有する（接続プールを使い回す）
+            self.client = get_genai_client(api_key)
             print(f"✅ Gemini API 初期化完了: {self.model_name}")
         except Exception as e:
             raise Exception(f"Gemini API初期化に失敗しました: {e}")
@@ -57,99 +68,125 @@ class ImageEditor:
 - **Do not add any new objects or complex backgrounds.** A simple halftone dot pattern is acceptable for shadows or the background.
 - The final result should look like a cool hero's introduction scene from a comic book."""
     
-    def edit_image(self, image_path, edit_prompt, output_filename=None):
+    def edit_image(self, image, edit_prompt, output_filename=None, name=None):
         """
-        指定された画像を編集する
+        指定された画像を編集してファイルに保存する
         
         Args:
-            image_path (str): 編集する画像のパス
+            image: 編集する画像のパス、または画像データ（bytes / bytearray / memoryview）
             edit_prompt (str): 編集内容のプロンプト
             output_filename (str): 保存ファイル名（省略時は自動生成）
+            name (str): 画像データを渡す場合の元ファイル名（MIMEタイプ判定・出力名に使う）
         
         Returns:
             str: 編集された画像のファイルパス（失敗時はNone）
         """
+        source_name = image if isinstance(image, str) else name
+        edited_data = self.edit_image_data(image, edit_prompt, name=name)
+        if edited_data is None:
+            return None
         
-        # ファイル存在確認
-        if not os.path.exists(image_path):
-            print(f"❌ ファイルが見つかりません: {image_path}")
+        # 出力ディレクトリ作成
+        os.makedirs(self.output_dir, exist_ok=True)
+        
+        # 出力ファイル名生成
+        if not output_filename:
+            output_filename = self.make_output_filename(source_name)
+        
+        output_path = os.path.join(self.output_dir, output_filename)
+        try:
+            with open(output_path, 'wb') as f:
+                f.write(edited_data)
+            print(f"💾 編集画像保存完了: {output_path}")
+            return output_path
+        except Exception as e:
+            print(f"⚠️ 画像保存エラー: {e}")
             return None
+    
+    @staticmethod
+    def make_output_filename(source_name=None):
+        """
+        編集画像の保存ファイル名を生成する
+        
+        Args:
+            source_name (str): 元画像のファイル名またはパス（省略時は image）
+        
+        Returns:
+            str: comic_<元ファイル名>_<UNIX時刻>.png
+        """
+        base_name = os.path.splitext(os.path.basename(source_name or "image"))[0]
+        timestamp = int(time.time())
+        return f"comic_{base_name}_{timestamp}.png"
+    
+    def edit_image_data(self, image, edit_prompt, name=None):
+        """
+        画像を編集し、編集後のPNGデータをメモリ上で返す（ファイルには保存しない）
+        
+        Args:
+            image: 編集する画像のパス、または画像データ（bytes / bytearray / memoryview）
+            edit_prompt (str): 編集内容のプロンプト
+            name (str): 画像データを渡す場合の元ファイル名（MIMEタイプ判定に使う）
         
+        Returns:
+            bytes: 編集されたPNG画像データ（失敗時はNone）
+        """
         if not self.client:
             print("❌ Gemini APIが初期化されていません")
             return None
         
-        # 画像を読み込み
+        # 画像を読み込み（データを渡された場合はディスクを経由しない）
         try:
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
+            image_data, mime_type, display_name = load_image_source(image, name)
+            if image_data is None:
+                return None
             
             encoded_image = base64.b64encode(image_data).decode('utf-8')
             
-            # MIMEタイプを判定
-            if image_path.lower().endswith('.png'):
-                mime_type = 'image/png'
-            elif image_path.lower().endswith(('.jpg', '.jpeg')):
-                mime_type = 'image/jpeg'
-            elif image_path.lower().endswith('.gif'):
-                mime_type = 'image/gif'
-            elif image_path.lower().endswith('.webp'):
-                mime_type = 'image/webp'
-            else:
-                mime_type = 'image/jpeg'  # デフォルト
-            
-            print(f"📷 画像読み込み完了: {os.path.basename(image_path)}")
+            print(f"📷 画像読み込み完了: {display_name}")
             print(f"📊 ファイルサイズ: {len(image_data):,} bytes")
             
         except Exception as e:
             print(f"❌ 画像読み込みエラー: {e}")
             return None
         
-        # 出力ディレクトリ作成
-        os.makedirs(self.output_dir, exist_ok=True)
-        
-        # 出力ファイル名生成
-        if not output_filename:
-            base_name = os.path.splitext(os.path.basename(image_path))[0]
-            timestamp = int(time.time())
-            output_filename = f"comic_{base_name}_{timestamp}.png"
-        
-        output_path = os.path.join(self.output_dir, output_filename)
-        
         try:
             print(f"🎨 画像編集中...")
             print("⏳ Gemini APIに送信中...")
             
-            # 画像編集リクエスト
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=[
-                    {
-                        "role": "user",
-                        "parts": [
-                            {
-                                "text": f"Edit this image: {edit_prompt}"
-                            },
-                            {
-                                "inline_data": {
-                                    "mime_type": mime_type,
-                                    "data": encoded_image
+            # 画像編集リクエスト（共有プールで実行し、429/5xx は再試行する）
+            def request(timeout):
+                return self.client.models.generate_content(
+                    model=self.model_name,
+                    contents=[
+                        {
+                            "role": "user",
+                            "parts": [
+                                {
+                                    "text": f"Edit this image: {edit_prompt}"
+                                },
+                                {
+                                    "inline_data": {
+                                        "mime_type": mime_type,
+                                        "data": encoded_image
+                                    }
                                 }
-                            }
-                        ]
-                    }
-                ],
-                config=types.GenerateContentConfig(
-                    response_modalities=["Text", "Image"],
-                    temperature=0.7,
-                    max_output_tokens=2048
+                            ]
+                        }
+                    ],
+                    config=types.GenerateContentConfig(
+                        response_modalities=["Text", "Image"],
+                        temperature=0.7,
+                        max_output_tokens=2048,
+                        http_options=types.HttpOptions(timeout=int(timeout * 1000))
+                    )
                 )
-            )
+            
+            response = get_request_pool().call(self.model_name, request)
             
             print("✨ レスポンス受信完了")
             
             # 編集された画像を処理
-            image_saved = False
+            edited_data = None
             
             for part in response.parts:
                 if hasattr(part, 'inline_data') and part.inline_data:
@@ -159,44 +196,129 @@ class ImageEditor:
                         if isinstance(new_image_data, str):
                             new_image_data = base64.b64decode(new_image_data)
                         
-                        # PILで画像を保存
-                        image = Image.open(BytesIO(new_image_data))
-                        image.save(output_path)
-                        
-                        print(f"💾 編集画像保存完了: {output_path}")
-                        image_saved = True
+                        edited_data = to_png_bytes(new_image_data)
                         
                     except Exception as img_error:
-                        print(f"⚠️ 画像保存エラー: {img_error}")
+                        print(f"⚠️ 画像変換エラー: {img_error}")
             
-            if image_saved:
-                return output_path
-            else:
+            if edited_data is None:
                 print("⚠️ 編集画像が生成されませんでした")
-                return None
+            return edited_data
             
         except Exception as e:
             print(f"❌ 画像編集エラー: {e}")
             return None
 
-def convert_to_comic_style(image_path):
+def get_image_editor(model_name=DEFAULT_EDIT_MODEL, output_dir="edited_images"):
+    """
+    共有の ImageEditor を返す（初回のみ作成、複数スレッドから使ってよい）
+    
+    Args:
+        model_name (str): 使用するGeminiモデル名
+        output_dir (str): 出力ディレクトリ
+    
+    Returns:
+        ImageEditor: 共有インスタンス（初期化に失敗した場合は例外）
+    """
+    key = (model_name, output_dir)
+    with _editors_lock:
+        editor = _editors.get(key)
+        if editor is None:
+            editor = ImageEditor(model_name=model_name, output_dir=output_dir)
+            _editors[key] = editor
+    return editor
+
+def detect_mime_type(image_data, name=None):
+    """
+    画像のMIMEタイプを判定する（ファイル名の拡張子 → 先頭バイトの順）
+    
+    Args:
+        image_data: 画像データ（bytes / bytearray / memoryview）
+        name (str): ファイル名（省略可）
+    
+    Returns:
+        str: MIMEタイプ
+    """
+    if name:
+        lower_name = name.lower()
+        if lower_name.endswith('.png'):
+            return 'image/png'
+        elif lower_name.endswith(('.jpg', '.jpeg')):
+            return 'image/jpeg'
+        elif lower_name.endswith('.gif'):
+            return 'image/gif'
+        elif lower_name.endswith('.webp'):
+            return 'image/webp'
+    
+    head = bytes(memoryview(image_data)[:12])
+    if head.startswith(PNG_SIGNATURE):
+        return 'image/png'
+    elif head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    elif head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'  # デフォルト
+
+def load_image_source(image, name=None):
+    """
+    パスまたは画像データから (データ, MIMEタイプ, 表示名) を返す
+    
+    データ（bytes / bytearray / memoryview）を渡された場合はコピーも読み込みもしない。
+    
+    Args:
+        image: 画像のパス、または画像データ
+        name (str): 画像データを渡す場合の元ファイル名
+    
+    Returns:
+        tuple: (画像データ, MIMEタイプ, 表示名)、ファイルが無い場合は (None, None, None)
+    """
+    if isinstance(image, str):
+        if not os.path.exists(image):
+            print(f"❌ ファイルが見つかりません: {image}")
+            return None, None, None
+        with open(image, 'rb') as f:
+            image_data = f.read()
+        return image_data, detect_mime_type(image_data, image), os.path.basename(image)
+    
+    return image, detect_mime_type(image, name), os.path.basename(name) if name else "メモリ上の画像"
+
+def to_png_bytes(image_data):
+    """
+    画像データをPNGに揃える（既にPNGならデコードせずそのまま返す）
+    
+    Args:
+        image_data: 画像データ（bytes / bytearray / memoryview）
+    
+    Returns:
+        bytes: PNG画像データ
+    """
+    if bytes(memoryview(image_data)[:len(PNG_SIGNATURE)]) == PNG_SIGNATURE:
+        return bytes(image_data)
+    
+    # PILでPNGに変換
+    output = BytesIO()
+    Image.open(BytesIO(image_data)).save(output, format='PNG')
+    return output.getvalue()
+
+def convert_to_comic_style(image, name=None):
     """
-    指定された画像をアメコミ風に変換する
+    指定された画像をアメコミ風に変換してファイルに保存する
     
     Args:
-        image_path (str): 変換する画像のファイルパス
+        image: 変換する画像のファイルパス、または画像データ（bytes / bytearray / memoryview）
+        name (str): 画像データを渡す場合の元ファイル名
     
     Returns:
         str: 変換された画像のファイルパス（失敗時はNone）
     """
     # ファイル存在確認
-    if not os.path.exists(image_path):
-        print(f"❌ ファイルが見つかりません: {image_path}")
+    if isinstance(image, str) and not os.path.exists(image):
+        print(f"❌ ファイルが見つかりません: {image}")
         return None
     
-    # ImageEditorインスタンス作成
+    # ImageEditorインスタンス取得（2回目以降は共有インスタンス）
     try:
-        editor = ImageEditor()
+        editor = get_image_editor()
     except Exception as e:
         print(f"❌ 初期化エラー: {e}")
         return None
@@ -204,10 +326,11 @@ def convert_to_comic_style(image_path):
     # アメコミ風プロンプト取得
     comic_prompt = ImageEditor.get_comic_style_prompt()
     
-    print(f"🦸 アメコミ風変換開始: {os.path.basename(image_path)}")
+    source_name = image if isinstance(image, str) else (name or "メモリ上の画像")
+    print(f"🦸 アメコミ風変換開始: {os.path.basename(source_name)}")
     
     # 画像変換実行
-    result = editor.edit_image(image_path, comic_prompt)
+    result = editor.edit_image(image, comic_prompt, name=name)
     
     if result:
         print(f"✅ アメコミ風変換完了: {result}")
@@ -216,6 +339,33 @@ def convert_to_comic_style(image_path):
         print("❌ アメコミ風変換に失敗しました")
         return None
 
+def convert_to_comic_data(image, name=None):
+    """
+    画像をアメコミ風に変換し、変換後のPNGデータを返す（ファイルには保存しない）
+    
+    保存は呼び出し元に任せる（integrated_photo_system ではライトビハインド書き込み）。
+    
+    Args:
+        image: 変換する画像のファイルパス、または画像データ（bytes / bytearray / memoryview）
+        name (str): 画像データを渡す場合の元ファイル名
+    
+    Returns:
+        bytes: 変換されたPNG画像データ（失敗時はNone）
+    """
+    try:
+        editor = get_image_editor()
+    except Exception as e:
+        print(f"❌ 初期化エラー: {e}")
+        return None
+    
+    source_name = image if isinstance(image, str) else (name or "メモリ上の画像")
+    print(f"🦸 アメコミ風変換開始: {os.path.basename(source_name)}")
+    
+    result = editor.edit_image_data(image, ImageEditor.get_comic_style_prompt(), name=name)
+    if result is None:
+        print("❌ アメコミ風変換に失敗しました")
+    return result
+
 def main():
     """メイン実行関数"""
     print("🦸 アメコミ風画像変換ツール")
@@ -0,0 +1,1546 @@
+#!/usr/bin/env python3
+"""
+Spresenseシリアル受信の共通部品
+
+各スクリプトの受信ループで共有するバッファ・パーサーをまとめたモジュール。
+bytes の連結（jpeg_data += chunk）はチャンク毎にバッファ全体をコピーするため
+フレームサイズに対して二乗の時間がかかる。ここでは事前確保した bytearray に
+直接読み込み、受信完了時にはコピーせずにそのまま呼び出し元へ渡す。
+
+マーカー検出は JpegFrameParser が担当する。read の境界をまたいで
+START_JPEG / END_JPEG が分割されても検出でき、END_JPEG が届いた時点で
+フレームを返すため、受信時間は転送時間だけで決まる（タイムアウト待ちにならない）。
+
+フレーミングは2種類に対応する。従来のマーカー方式に加え、
+マジック・ペイロード長・CRC32 のヘッダーを先頭に付けるバイナリフレーム方式では
+ヘッダーで受信サイズが確定するため、1回の確保と readinto で受信しCRCで検証できる。
+FrameReceiver はどちらの方式で送られてきたかを自動判別する。
+
+negotiate_baud_rate() は 115200 で接続した後に高速なボーレートを順に提案し、
+デバイスの応答とテストパターンの照合が成功したレートに切り替える。
+デバイスは電源を入れ直すまでそのレートのままなので、成功したレートはポートキャッシュに記録し、
+後の接続（再接続・再起動・別のスクリプト）では resync_baud_rate() がデバイスのレートに合わせる。
+
+ポート検出は pyserial の list_ports が返すUSBメタデータ（CP210xのVID/PID、
+シリアル番号）で行い、結果を小さな状態ファイルにキャッシュする。
+次回以降はキャッシュしたポートが存在するかだけを確認し、
+消えていた場合のみ全体をスキャンし直す（ポートの試し開きはしない）。
+環境変数 SPRESENSE_PORT が設定されている場合は検出せずにそのポートを使う
+（spresense_simulator.py の疑似端末などUSBメタデータの無いポート向け）。
+
+各スクリプトはこのモジュールの受信経路だけを使う薄いフロントエンドで、
+iter_frames() が返すフレームをシンク（ディスク保存・キュー・コールバック）に渡す。
+WriteBehindWriter を使うとディスクへの保存を専用スレッドに任せ、
+フレームはメモリ上のまま後段（分析・変換・送信）へ渡せる。
+
+使用例:
+    port = find_spresense_port()
+    frame = capture_frame(ser, start_timeout=10, payload_timeout=30)
+    for frame in iter_frames(ser):
+        DiskSink("captured_images").handle(frame)
+"""
+
+import atexit
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from serial.tools import list_ports
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+RECEIVE_CHUNK_SIZE = 1024  # 1回の read で要求するバイト数
+DEFAULT_FRAME_CAPACITY = 256 * 1024  # 初期確保サイズ（QVGA〜VGAのJPEGが収まる程度）
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # これを超えたらフレームを破棄して同期し直す
+
+START_MARKER = b'START_JPEG'
+END_MARKER = b'END_JPEG'
+CRLF = b'\r\n'
+
+# ボーレートネゴシエーション（115200で接続後に高速なレートへ切り替える）
+BASE_BAUD_RATE = 115200
+HIGH_BAUD_RATES = [2000000, 1000000, 921600]  # 速い順に試す
+BAUD_TEST_PATTERN = bytes(i & 0xFF for i in range(1024))
+BAUD_REVERT_WAIT = 2.0  # 確認が来ないとデバイスが BASE_BAUD_RATE に戻るまでの秒数
+BAUD_PROBE_COMMAND = "PING"  # デバイスが応答するかを確かめる無害なコマンド（Unknown command が返る）
+BAUD_PROBE_TIMEOUT = 0.5
+
+# バイナリフレーム方式: magic(4) + payload長(uint32 LE) + CRC32(uint32 LE) + payload
+FRAME_MAGIC = b'SPJF'
+FRAME_HEADER = struct.Struct('<4sII')
+MODE_MARKER = 'marker'
+MODE_FRAMED = 'framed'
+
+# Spresenseメインボードの USB-UART（Silicon Labs CP210x）
+SPRESENSE_USB_IDS = [(0x10C4, 0xEA60)]
+# USBメタデータが取れない環境向けのポート名キーワード（macOS / Linux）
+SPRESENSE_PORT_KEYWORDS = ['SLAB_USBtoUART', 'usbserial', 'ttyUSB']
+PORT_CACHE_FILE = ".spresense_port.json"
+# ポートを明示する環境変数（カンマ区切りで複数可）。シミュレーター等の検出できないポート用
+PORT_OVERRIDE_ENV = "SPRESENSE_PORT"
+
+class FrameError(Exception):
+    """受信フレームの検証エラー（長さ超過・CRC不一致・途中切断など）"""
+
+    def __init__(self, message: str, kind: str = "invalid"):
+        """
+        Args:
+            message: エラー内容
+            kind: エラー種別（"timeout" / "length" / "crc" など、テレメトリのラベルに使う）
+        """
+        super().__init__(message)
+        self.kind = kind
+
+# =============================================================================
+# ポート検出
+# =============================================================================
+
+def _matches_spresense(info, serial_number: Optional[str]) -> bool:
+    """list_ports のポート情報がSpresenseのものか判定する"""
+    if (info.vid, info.pid) not in SPRESENSE_USB_IDS:
+        return False
+    return not serial_number or info.serial_number == serial_number
+
+
+def configured_ports() -> List[str]:
+    """環境変数 SPRESENSE_PORT で明示されたポートのリスト（未設定なら空）"""
+    value = os.getenv(PORT_OVERRIDE_ENV, "")
+    return [port.strip() for port in value.split(",") if port.strip()]
+
+
+def list_spresense_ports(serial_number: Optional[str] = None) -> List[str]:
+    """
+    接続されているSpresenseのシリアルポートを列挙する
+
+    ポートを開かずに USB の VID/PID（と指定時はシリアル番号）で判定する。
+    VID/PID が一致するポートが無い場合のみ、ポート名のキーワードで判定する。
+    SPRESENSE_PORT が設定されている場合はスキャンせずにそのポートを返す。
+
+    Args:
+        serial_number: 特定のボードに限定する場合のUSBシリアル番号
+
+    Returns:
+        デバイスパスのリスト（名前順）
+    """
+    override = configured_ports()
+    if override:
+        return override
+
+    ports = list_ports.comports()
+    matched = [info.device for info in ports if _matches_spresense(info, serial_number)]
+    if not matched and not serial_number:
+        matched = [
+            info.device for info in ports
+            if any(keyword in info.device for keyword in SPRESENSE_PORT_KEYWORDS)
+        ]
+    return sorted(matched)
+
+
+# ポートキャッシュの読み込み→変更→書き込みを直列化する（マルチカメラで同時にネゴシエーションする場合）
+_cache_lock = threading.Lock()
+
+
+def _read_cache_file(cache_file: str) -> dict:
+    """キャッシュファイルの内容（読めなければ空）"""
+    try:
+        with open(cache_file, "r") as f:
+            cached = json.load(f)
+        return cached if isinstance(cached, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache_file(cache_file: str, cache: dict) -> None:
+    """一時ファイルに書いてから os.replace で置き換える（読み込み側に書きかけのファイルを見せない）"""
+    tmp_path = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_file)
+    except OSError as e:
+        print(f"⚠️ ポートキャッシュ保存失敗: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _update_cache_file(cache_file: str, update: Callable[[dict], None]) -> None:
+    """キャッシュを読み込み、update で変更して書き戻す（ロックを持ったまま行う）"""
+    with _cache_lock:
+        cache = _read_cache_file(cache_file)
+        update(cache)
+        _write_cache_file(cache_file, cache)
+
+
+def _load_port_cache(cache_file: str) -> Optional[Dict[str, str]]:
+    """キャッシュ済みのポート情報を読み込む"""
+    cached = _read_cache_file(cache_file)
+    return cached if cached.get('device') else None
+
+
+def _save_port_cache(cache_file: str, device: str, serial_number: Optional[str]) -> None:
+    """検出したポートをキャッシュに保存する（ポート毎のボーレートは残す）"""
+    _update_cache_file(cache_file, lambda cache: cache.update(device=device, serial_number=serial_number))
+
+
+def cached_baud_rate(device: Optional[str], cache_file: Optional[str] = PORT_CACHE_FILE) -> Optional[int]:
+    """ポートで最後にネゴシエーションしたボーレート（記録が無ければNone）"""
+    if not device or not cache_file:
+        return None
+    rate = _read_cache_file(cache_file).get('baud_rates', {}).get(device)
+    return rate if isinstance(rate, int) else None
+
+
+def remember_baud_rate(device: Optional[str], rate: int,
+                       cache_file: Optional[str] = PORT_CACHE_FILE) -> None:
+    """
+    ポートのデバイスが使っているボーレートを記録する
+
+    デバイスは電源を入れ直すまで切り替えたレートのままなので、次回の接続で最初に試す。
+    """
+    if not device or not cache_file or cached_baud_rate(device, cache_file) == rate:
+        return
+
+    def update(cache: dict) -> None:
+        rates = cache.get('baud_rates')
+        cache['baud_rates'] = dict(rates) if isinstance(rates, dict) else {}
+        cache['baud_rates'][device] = rate
+
+    _update_cache_file(cache_file, update)
+
+
+def forget_cached_port(cache_file: str = PORT_CACHE_FILE) -> None:
+    """ポートキャッシュを削除する（次回は全体スキャン）"""
+    with _cache_lock:
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+
+
+def find_spresense_port(serial_number: Optional[str] = None,
+                        cache_file: Optional[str] = PORT_CACHE_FILE,
+                        refresh: bool = False) -> Optional[str]:
+    """
+    Spresenseのシリアルポートを1つ選ぶ
+
+    キャッシュのポートがまだ存在すればスキャンせずにそれを返す。
+
+    Args:
+        serial_number: 特定のボードに限定する場合のUSBシリアル番号
+        cache_file: キャッシュファイルのパス（None でキャッシュ無効）
+        refresh: True の場合はキャッシュを無視して再スキャンする
+
+    Returns:
+        デバイスパス、見つからない場合はNone
+    """
+    override = configured_ports()
+    if override:
+        return override[0]
+
+    if cache_file and not refresh:
+        cached = _load_port_cache(cache_file)
+        if (cached and os.path.exists(cached['device'])
+                and (not serial_number or cached.get('serial_number') == serial_number)):
+            return cached['device']
+
+    ports = list_spresense_ports(serial_number)
+    if not ports:
+        return None
+
+    if cache_file:
+        _save_port_cache(cache_file, ports[0], serial_number)
+    return ports[0]
+
+# =============================================================================
+# フレームバッファ
+# =============================================================================
+
+class FrameBuffer:
+    """
+    受信中のJPEGフレームを蓄積する可変長バッファ
+
+    容量が足りなくなった時だけ倍々で拡張するため、追記は償却O(1)、
+    1フレームの受信全体はフレームサイズに対して線形時間になる。
+    """
+
+    def __init__(self, initial_capacity: int = DEFAULT_FRAME_CAPACITY):
+        """
+        Args:
+            initial_capacity: 最初に確保するバイト数
+        """
+        self._initial_capacity = max(1, initial_capacity)
+        self._buf = bytearray(self._initial_capacity)
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    @property
+    def capacity(self) -> int:
+        """現在確保済みのバイト数"""
+        return len(self._buf)
+
+    def _reserve(self, extra: int) -> None:
+        """追記に備えて extra バイト分の空きを確保する"""
+        needed = self._len + extra
+        if needed <= len(self._buf):
+            return
+        new_capacity = max(needed, len(self._buf) * 2)
+        new_buf = bytearray(new_capacity)
+        new_buf[:self._len] = memoryview(self._buf)[:self._len]
+        self._buf = new_buf
+
+    def append(self, chunk) -> None:
+        """バイト列（buffer protocol 対応オブジェクト）を末尾に追記する"""
+        n = len(chunk)
+        self._reserve(n)
+        self._buf[self._len:self._len + n] = chunk
+        self._len += n
+
+    def read_from(self, ser, size: int = RECEIVE_CHUNK_SIZE) -> int:
+        """
+        シリアルポートから最大 size バイトをバッファへ直接読み込む
+
+        中間の bytes オブジェクトを作らないよう readinto を使う。
+
+        Args:
+            ser: readinto を持つシリアル接続（pyserial の Serial など）
+            size: 1回で読み込む最大バイト数
+
+        Returns:
+            実際に読み込んだバイト数（タイムアウト時は0）
+        """
+        self._reserve(size)
+        with memoryview(self._buf) as mv:
+            n = ser.readinto(mv[self._len:self._len + size]) or 0
+        self._len += n
+        return n
+
+    def find(self, sub: bytes, start: int = 0) -> int:
+        """受信済み範囲から sub を検索する（見つからなければ -1）"""
+        return self._buf.find(sub, start, self._len)
+
+    def truncate(self, length: int) -> None:
+        """受信済みデータを先頭 length バイトに切り詰める"""
+        self._len = max(0, min(length, self._len))
+
+    def view(self) -> memoryview:
+        """受信済み範囲の読み取り用ビューを返す（コピーなし）"""
+        return memoryview(self._buf)[:self._len].toreadonly()
+
+    def detach(self) -> bytearray:
+        """
+        受信済みフレームをコピーせずに取り出し、バッファを空に戻す
+
+        Returns:
+            フレームデータ（未使用の末尾領域は切り落とし済み）
+        """
+        frame = self._buf
+        del frame[self._len:]
+        self._buf = bytearray(self._initial_capacity)
+        self._len = 0
+        return frame
+
+    def clear(self) -> None:
+        """確保済み領域を残したまま内容を破棄する"""
+        self._len = 0
+
+
+def as_bytes(data) -> Optional[bytes]:
+    """
+    bytes を要求するAPI（google.generativeai など）向けに変換する
+
+    既に bytes の場合はそのまま返し、bytearray / memoryview の場合のみコピーする。
+    """
+    if data is None or isinstance(data, bytes):
+        return data
+    return bytes(data)
+
+# =============================================================================
+# マーカー区切りフレームパーサー
+# =============================================================================
+
+class JpegFrameParser:
+    """
+    START_JPEG / END_JPEG で区切られたJPEGフレームを逐次解析するステートマシン
+
+    任意の長さのバイト列を feed() で渡すと、完成したフレームのリストを返す。
+    マーカー長-1 バイトの末尾ウィンドウを毎回の検索範囲に含めるため、
+    マーカーが read の境界で分割されていても取りこぼさない。
+
+    Spresense側の Serial.println() によってマーカー前後に付く CRLF は
+    フレームに含めない（JPEGは FFD8 で始まり FFD9 で終わるため安全に除去できる）。
+    """
+
+    WAIT_START = 'WAIT_START'
+    IN_FRAME = 'IN_FRAME'
+
+    def __init__(self,
+                 start_marker: bytes = START_MARKER,
+                 end_marker: bytes = END_MARKER,
+                 max_frame_size: int = MAX_FRAME_SIZE,
+                 initial_capacity: int = DEFAULT_FRAME_CAPACITY):
+        """
+        Args:
+            start_marker: フレーム開始マーカー
+            end_marker: フレーム終了マーカー
+            max_frame_size: 1フレームの上限サイズ（超過時は破棄して再同期）
+            initial_capacity: フレームバッファの初期確保サイズ
+        """
+        self.start_marker = start_marker
+        self.end_marker = end_marker
+        self.max_frame_size = max_frame_size
+        self.state = self.WAIT_START
+        self.frame = FrameBuffer(initial_capacity)
+        self._tail = bytearray()  # WAIT_START 中に持ち越すマーカー断片
+        self._scan_from = 0  # フレーム内で END_MARKER 検索を再開する位置
+        self._skip_crlf = False  # 開始マーカー直後の CRLF を読み飛ばすか
+        self.dropped_frames = 0
+
+    @property
+    def in_frame(self) -> bool:
+        """フレーム受信中かどうか"""
+        return self.state == self.IN_FRAME
+
+    @property
+    def buffered(self) -> int:
+        """受信中フレームの現在のバイト数"""
+        return len(self.frame)
+
+    def start_frame(self) -> None:
+        """
+        開始マーカーを呼び出し側で消費済みの場合に、フレーム受信状態へ移る
+
+        read_until(START_MARKER) で撮影応答を待つ既存コードとの併用向け。
+        """
+        self.frame.clear()
+        self._tail.clear()
+        self._scan_from = 0
+        self._skip_crlf = True
+        self.state = self.IN_FRAME
+
+    def reset(self) -> None:
+        """受信途中のデータを破棄して開始マーカー待ちに戻る"""
+        self.frame.clear()
+        self._tail.clear()
+        self._scan_from = 0
+        self._skip_crlf = False
+        self.state = self.WAIT_START
+
+    def feed(self, data) -> List[bytearray]:
+        """
+        受信データを投入する
+
+        Args:
+            data: 受信したバイト列（bytes / bytearray / memoryview）
+
+        Returns:
+            このデータで完成したフレームのリスト（無ければ空）
+        """
+        frames: List[bytearray] = []
+        view = memoryview(data)
+        while len(view):
+            if self.state == self.WAIT_START:
+                view = self._consume_until_start(view)
+            else:
+                self.frame.append(view)
+                view = view[len(view):]
+                frame, rest = self._scan_for_end()
+                if frame is not None:
+                    frames.append(frame)
+                    view = memoryview(rest)
+        return frames
+
+    def feed_until_frame(self, data) -> Tuple[Optional[bytearray], bytes]:
+        """
+        受信データを最初のフレームが完成するところまで投入する
+
+        終了マーカーより後ろは解析しない（後続がバイナリフレーム方式の場合もあるため、
+        方式の判別からやり直せるよう呼び出し側に返す）。
+
+        Returns:
+            (完成フレーム, 終了マーカー以降の未解析データ)。未完成なら (None, b'')
+        """
+        view = memoryview(data)
+        while len(view):
+            if self.state == self.WAIT_START:
+                view = self._consume_until_start(view)
+            else:
+                self.frame.append(view)
+                view = view[len(view):]
+                frame, rest = self._scan_for_end()
+                if frame is not None:
+                    return frame, rest
+        return None, b''
+
+    def read_frame_from(self, ser, size: int = RECEIVE_CHUNK_SIZE) -> Tuple[Optional[bytearray], bytes]:
+        """
+        read_from() の1フレーム版（終了マーカー以降は解析せずに返す）
+
+        Returns:
+            (完成フレーム, 終了マーカー以降の未解析データ)。未完成なら (None, b'')
+        """
+        size = _ready_size(ser, size)
+        if self.state == self.WAIT_START:
+            chunk = ser.read(size)
+            return self.feed_until_frame(chunk) if chunk else (None, b'')
+
+        if not self.frame.read_from(ser, size):
+            return None, b''
+        return self._scan_for_end()
+
+    def read_from(self, ser, size: int = RECEIVE_CHUNK_SIZE) -> List[bytearray]:
+        """
+        シリアルポートから読み込んで解析する
+
+        フレーム受信中はバッファへ直接読み込む（中間コピーなし）。
+        in_waiting が分かる場合は受信済みの分だけを要求し、
+        最後の端数チャンクでタイムアウトまで待たされないようにする。
+
+        Args:
+            ser: read / readinto を持つシリアル接続
+            size: 1回で読み込む最大バイト数
+
+        Returns:
+            完成したフレームのリスト（無ければ空）
+        """
+        size = _ready_size(ser, size)
+        if self.state == self.WAIT_START:
+            chunk = ser.read(size)
+            return self.feed(chunk) if chunk else []
+
+        n = self.frame.read_from(ser, size)
+        if not n:
+            return []
+        frame, rest = self._scan_for_end()
+        if frame is None:
+            return []
+        frames = [frame]
+        if rest:
+            frames.extend(self.feed(rest))
+        return frames
+
+    def _consume_until_start(self, view: memoryview) -> memoryview:
+        """開始マーカーを探し、見つかればその直後からのビューを返す"""
+        window = self._tail + view
+        pos = window.find(self.start_marker)
+        if pos == -1:
+            keep = len(self.start_marker) - 1
+            self._tail = window[-keep:] if keep else bytearray()
+            return view[len(view):]
+
+        consumed = pos + len(self.start_marker) - len(self._tail)
+        self._tail.clear()
+        self.frame.clear()
+        self._scan_from = 0
+        self._skip_crlf = True
+        self.state = self.IN_FRAME
+        return view[consumed:]
+
+    def _scan_for_end(self):
+        """
+        受信中フレームから終了マーカーを探す
+
+        Returns:
+            (完成フレーム, 終了マーカー以降の余りデータ)。未完成なら (None, b'')
+        """
+        if self._skip_crlf and len(self.frame) >= len(CRLF):
+            if self.frame.find(CRLF, 0) == 0:
+                self._drop_head(len(CRLF))
+            self._skip_crlf = False
+
+        pos = self.frame.find(self.end_marker, self._scan_from)
+        if pos == -1:
+            # 次回はマーカー断片が残りうる末尾ウィンドウから検索する
+            self._scan_from = max(0, len(self.frame) - len(self.end_marker) + 1)
+            if len(self.frame) > self.max_frame_size:
+                print(f"⚠️ フレームが上限サイズ({self.max_frame_size:,} bytes)を超えたため破棄します")
+                self.dropped_frames += 1
+                self.reset()
+            return None, b''
+
+        rest = bytes(self.frame.view()[pos + len(self.end_marker):])
+        end = pos
+        if end >= len(CRLF) and self.frame.find(CRLF, end - len(CRLF)) == end - len(CRLF):
+            end -= len(CRLF)
+        self.frame.truncate(end)
+        frame = self.frame.detach()
+        self._scan_from = 0
+        self.state = self.WAIT_START
+        return frame, rest
+
+    def _drop_head(self, n: int) -> None:
+        """フレーム先頭の n バイトを取り除く"""
+        remaining = bytes(self.frame.view()[n:])
+        self.frame.clear()
+        self.frame.append(remaining)
+
+
+def _read_exact(ser, size: int, deadline: float) -> Optional[bytearray]:
+    """size バイトちょうどを読み込む（期限切れならNone）"""
+    buf = bytearray(size)
+    received = 0
+    with memoryview(buf) as mv:
+        while received < size:
+            if time.time() >= deadline:
+                return None
+            received += ser.readinto(mv[received:]) or 0
+    return buf
+
+
+def _wait_for_tokens(ser, tokens: List[bytes], timeout: float,
+                     initial=b'') -> Tuple[Optional[bytes], bytearray]:
+    """
+    tokens のいずれかを受信するまで読み進める
+
+    Args:
+        initial: 読み込み済みのデータ（シリアルより先に検索する）
+
+    Returns:
+        (最初に見つかったトークン, トークン直後から読み込み済みのデータ)。
+        タイムアウト時は (None, 空)
+    """
+    deadline = time.time() + timeout
+    keep = max(len(t) for t in tokens) - 1
+    window = bytearray(initial)
+    while True:
+        found = [(window.find(t), t) for t in tokens if t in window]
+        if found:
+            pos, token = min(found)
+            return token, window[pos + len(token):]
+        if len(window) > keep:
+            del window[:-keep]
+        if time.time() >= deadline:
+            return None, bytearray()
+        chunk = ser.read(_ready_size(ser, RECEIVE_CHUNK_SIZE))
+        if chunk:
+            window += chunk
+
+
+def _ready_size(ser, size: int) -> int:
+    """受信済みバイト数に合わせて read で要求するサイズを決める"""
+    try:
+        waiting = ser.in_waiting
+    except (AttributeError, OSError):
+        return size
+    if not waiting:
+        return 1
+    return min(waiting, size)
+
+# =============================================================================
+# フレーミング方式の自動判別つき受信
+# =============================================================================
+
+class FrameReceiver:
+    """
+    マーカー方式とバイナリフレーム方式を自動判別して1フレームを受信する
+
+    wait_for_start() で START_JPEG か FRAME_MAGIC のどちらが先に来たかを判別し、
+    read_payload() でその方式に応じてペイロードを受信する。
+    バイナリフレーム方式ではマーカー走査を行わず、ヘッダーの長さ分を
+    確保済みバッファへ readinto で読み込んでから CRC32 を検証する。
+    """
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        """
+        Args:
+            max_frame_size: 受け付ける最大フレームサイズ
+        """
+        self.max_frame_size = max_frame_size
+        self.parser = JpegFrameParser(max_frame_size=max_frame_size)
+        self.mode: Optional[str] = None  # 直近のフレームで検出した方式
+        self.reads = 0  # 直近のペイロード受信での read 回数
+        self.dropped_frames = 0  # 撮影コマンド送信時に破棄した受信済みフレーム数
+        self._pending = bytearray()  # 開始検出時に読み込み済みのペイロード先頭
+        # フレームの後ろまで読み込んだ分（後続フレームを含みうる。次の開始検出で方式の判別からやり直す）
+        self._leftover = bytearray()
+
+    def wait_for_start(self, ser, timeout: float) -> bool:
+        """
+        フレームの開始（START_JPEG または FRAME_MAGIC）を待つ
+
+        開始前のデバッグ出力（"Spresense: ..." など）は読み捨てる。
+        前回の受信でフレームの後ろまで読み込んでいれば、その分をシリアルより先に検索する
+        （後続フレームの開始が含まれていればシリアルを待たずに True を返す）。
+
+        Args:
+            ser: シリアル接続
+            timeout: 待機する最大秒数
+
+        Returns:
+            開始を検出したらTrue
+        """
+        token, rest = _wait_for_tokens(ser, [START_MARKER, FRAME_MAGIC], timeout, self._leftover)
+        self._leftover = bytearray()
+        self.mode = {START_MARKER: MODE_MARKER, FRAME_MAGIC: MODE_FRAMED}.get(token)
+        self._pending = rest
+        return self.mode is not None
+
+    def read_payload(self, ser, timeout: float,
+                     on_progress: Optional[Callable[[int], None]] = None) -> Optional[bytearray]:
+        """
+        wait_for_start() で検出した方式でペイロードを受信する
+
+        Args:
+            ser: シリアル接続
+            timeout: 受信する最大秒数
+            on_progress: 受信済みバイト数を受け取るコールバック（read毎に呼ばれる）
+
+        Returns:
+            フレームデータ、タイムアウト時はNone
+
+        Raises:
+            FrameError: バイナリフレームの長さ超過・CRC不一致
+        """
+        deadline = time.time() + timeout
+        self.reads = 0
+        if self.mode == MODE_FRAMED:
+            return self._read_framed(ser, deadline, on_progress)
+        return self._read_marker(ser, deadline, on_progress)
+
+    def discard(self) -> None:
+        """
+        読み込み済みの後続フレームを破棄する
+
+        撮影コマンドの送信前に呼ぶ（入力バッファと同様に、前回の応答の残りは使わない）。
+        """
+        dropped = self._leftover.count(START_MARKER) + self._leftover.count(FRAME_MAGIC)
+        if dropped:
+            print(f"⚠️ 受信済みの後続フレーム {dropped}件を破棄します")
+            self.dropped_frames += dropped
+        self._pending = bytearray()
+        self._leftover = bytearray()
+        self.parser.reset()
+
+    def _read_marker(self, ser, deadline: float, on_progress) -> Optional[bytearray]:
+        """
+        マーカー方式: END_JPEG まで逐次解析
+
+        END_JPEG より後ろに読み込んだ分（同じ read で届いた後続フレームなど）は
+        マーカー方式とは限らないので解析せず、次の wait_for_start() で方式の判別からやり直す。
+        """
+        self.parser.start_frame()
+        frame, rest = self.parser.feed_until_frame(self._pending)
+        self._pending = bytearray()
+        while frame is None:
+            if time.time() >= deadline:
+                self.parser.reset()
+                return None
+            frame, rest = self.parser.read_frame_from(ser, RECEIVE_CHUNK_SIZE)
+            self.reads += 1
+            if on_progress:
+                on_progress(self.parser.buffered)
+        self._leftover = bytearray(rest)
+        return frame
+
+    def _read_framed(self, ser, deadline: float, on_progress) -> Optional[bytearray]:
+        """バイナリフレーム方式: ヘッダーの長さ分を一括受信してCRC検証"""
+        header_rest = FRAME_HEADER.size - len(FRAME_MAGIC)
+        head = self._pending
+        self._pending = bytearray()
+        if len(head) < header_rest:
+            more = _read_exact(ser, header_rest - len(head), deadline)
+            if more is None:
+                return None
+            head += more
+
+        _, length, expected_crc = FRAME_HEADER.unpack(FRAME_MAGIC + bytes(head[:header_rest]))
+        if length > self.max_frame_size:
+            raise FrameError(f"フレーム長が上限を超えています: {length:,} bytes", kind="length")
+
+        payload = bytearray(length)
+        received = min(length, len(head) - header_rest)
+        payload[:received] = head[header_rest:header_rest + received]
+        # 開始検出時にペイロードの後ろ（次のフレームのヘッダーなど）まで読み込んでいれば次回に回す
+        self._leftover = head[header_rest + length:]
+        with memoryview(payload) as mv:
+            while received < length:
+                if time.time() >= deadline:
+                    return None
+                n = ser.readinto(mv[received:received + _ready_size(ser, length - received)]) or 0
+                received += n
+                self.reads += 1
+                if on_progress:
+                    on_progress(received)
+
+        actual_crc = zlib.crc32(payload)
+        if actual_crc != expected_crc:
+            raise FrameError(f"CRC不一致: expected={expected_crc:08x} actual={actual_crc:08x}", kind="crc")
+        return payload
+
+
+def encode_framed(payload) -> bytes:
+    """
+    ペイロードをバイナリフレーム形式にエンコードする
+
+    デバイス側実装の検証やシミュレーター用。
+    """
+    return FRAME_HEADER.pack(FRAME_MAGIC, len(payload), zlib.crc32(payload)) + bytes(payload)
+
+# =============================================================================
+# ボーレートネゴシエーション
+# =============================================================================
+#
+# プロトコル（コマンドは改行終端のテキスト、capture_spresense_camera.ino と対応）:
+#   host   -> SET_BAUD <rate>
+#   device -> BAUD_ACK <rate>   （送信後に <rate> へ切り替え。非対応なら BAUD_NAK <rate>）
+#             旧ファームウェアは "Spresense: Unknown command." を返すので即座に打ち切る
+#   host   -> BAUD_TEST         （ここから新しいレート）
+#   device -> BAUD_TEST: + BAUD_TEST_PATTERN
+#   host   -> BAUD_CONFIRM      （パターン一致時のみ）
+#   device -> BAUD_OK
+# デバイスは BAUD_REVERT_WAIT 秒以内に BAUD_CONFIRM を受け取れなければ
+# BASE_BAUD_RATE に戻る。ホスト側も失敗時は元のレートに戻して待機する。
+#
+# BAUD_OK の後、デバイスは電源を入れ直すまで新しいレートのままになる。そのため
+# 成功したレートはポートキャッシュに記録し、次の接続（再接続・プロセスの再起動・
+# 別のスクリプト）では resync_baud_rate() が BAUD_PROBE_COMMAND の応答で
+# デバイスの現在のレートを探してから使う（記録したレート → HIGH_BAUD_RATES の順）。
+
+def _probe_device(ser, timeout: float) -> bool:
+    """現在のレートでデバイスがコマンドに応答するか"""
+    ser.reset_input_buffer()
+    send_command(ser, BAUD_PROBE_COMMAND)
+    token, _ = _wait_for_tokens(ser, [b'Unknown command'], timeout)
+    return token is not None
+
+
+def resync_baud_rate(ser, candidates: Optional[List[int]] = None,
+                     cache_file: Optional[str] = PORT_CACHE_FILE,
+                     timeout: float = BAUD_PROBE_TIMEOUT) -> Optional[int]:
+    """
+    デバイスが応答するボーレートにホストを合わせる
+
+    以前の接続でネゴシエーションしたデバイスは高速なレートのまま残っているため、
+    現在のレート（通常 BASE_BAUD_RATE）で応答が無ければ、ポートキャッシュに記録した
+    レート、続いて candidates を試す。
+
+    Args:
+        ser: シリアル接続
+        candidates: 記録が無い場合に試すボーレート（省略時は HIGH_BAUD_RATES）
+        cache_file: ボーレートを記録したポートキャッシュ（None で記録を使わない）
+        timeout: 各レートで応答を待つ秒数
+
+    Returns:
+        デバイスが応答したボーレート（ser はそのレートに設定済み）。
+        どのレートでも応答が無ければNone（ser は元のレートのまま。コマンド非対応の旧ファームウェアなど）
+    """
+    device = getattr(ser, "port", None)
+    base_rate = ser.baudrate
+    if _probe_device(ser, timeout):
+        return base_rate
+
+    cached = cached_baud_rate(device, cache_file)
+    rates = [cached] if cached else []
+    rates += [r for r in sorted(HIGH_BAUD_RATES if candidates is None else candidates, reverse=True)
+              if r not in rates]
+    for rate in rates:
+        if rate == base_rate:
+            continue
+        try:
+            ser.baudrate = rate
+        except (OSError, ValueError):
+            continue  # ホスト側が非対応のレート
+        time.sleep(0.05)
+        if _probe_device(ser, timeout):
+            print(f"🔁 デバイスは {rate} bps のままだったため、ホストを合わせます")
+            remember_baud_rate(device, rate, cache_file)
+            return rate
+
+    ser.baudrate = base_rate
+    ser.reset_input_buffer()
+    return None
+
+
+def _propose_baud_rate(ser, rate: int, timeout: float) -> Optional[bytes]:
+    """
+    SET_BAUD を送り、デバイスの応答トークンを返す
+
+    Returns:
+        b'BAUD_ACK' / b'BAUD_NAK' / b'Unknown command'、無応答ならNone
+    """
+    ser.reset_input_buffer()
+    ser.write(f'SET_BAUD {rate}\n'.encode())
+    ser.flush()
+    reply, _ = _wait_for_tokens(ser, [f'BAUD_ACK {rate}'.encode(), b'BAUD_NAK', b'Unknown command'], timeout)
+    return b'BAUD_ACK' if reply and reply.startswith(b'BAUD_ACK') else reply
+
+
+def _verify_baud_rate(ser, rate: int, timeout: float) -> Optional[float]:
+    """
+    BAUD_ACK 受信後にホストを rate へ切り替え、テストパターンで検証する
+
+    失敗した場合はデバイスが元のレートに戻るのを待ち、ホストも元に戻す。
+
+    Returns:
+        成功時はテストパターンの実測転送速度 (KB/s)、失敗時はNone
+    """
+    base_rate = ser.baudrate
+    try:
+        ser.baudrate = rate
+        time.sleep(0.05)
+        ser.reset_input_buffer()
+        ser.write(b'BAUD_TEST\n')
+        ser.flush()
+
+        start = time.time()
+        token, pattern = _wait_for_tokens(ser, [b'BAUD_TEST:'], timeout)
+        if token:
+            if len(pattern) < len(BAUD_TEST_PATTERN):
+                rest = _read_exact(ser, len(BAUD_TEST_PATTERN) - len(pattern), time.time() + timeout)
+                pattern += rest or b''
+            pattern = pattern[:len(BAUD_TEST_PATTERN)]
+            elapsed = max(time.time() - start, 1e-6)
+            if pattern == BAUD_TEST_PATTERN:
+                ser.write(b'BAUD_CONFIRM\n')
+                ser.flush()
+                if _wait_for_tokens(ser, [b'BAUD_OK'], timeout)[0]:
+                    return len(BAUD_TEST_PATTERN) / elapsed / 1024
+    except (OSError, ValueError):
+        pass  # ホスト側が非対応のレート、または通信エラー
+
+    ser.baudrate = base_rate
+    time.sleep(BAUD_REVERT_WAIT)
+    ser.reset_input_buffer()
+    return None
+
+
+def negotiate_baud_rate(ser, candidates: Optional[List[int]] = None,
+                        timeout: float = 1.0,
+                        cache_file: Optional[str] = PORT_CACHE_FILE) -> int:
+    """
+    高速なボーレートを速い順に試し、最初に成功したレートに切り替える
+
+    ネゴシエーション非対応のファームウェア（Unknown command 応答・無応答）の場合は
+    すぐに打ち切り、現在のレートのまま続行する。
+    デバイスが以前のネゴシエーションで切り替えたレートのままなら、そのレートを使う。
+
+    Args:
+        ser: シリアル接続（BASE_BAUD_RATE などの確実に通じるレートで接続済み）
+        candidates: 試すボーレートのリスト（省略時は HIGH_BAUD_RATES）
+        timeout: 各応答を待つ秒数
+        cache_file: 成功したレートを記録するポートキャッシュ（None で記録しない）
+
+    Returns:
+        ネゴシエーション後のボーレート
+    """
+    candidates = HIGH_BAUD_RATES if candidates is None else candidates
+    base_rate = ser.baudrate
+    current = resync_baud_rate(ser, candidates, cache_file)
+    if current is not None and current != base_rate:
+        print(f"⚡ デバイスはネゴシエーション済み（{current} bps）")
+        return current
+    print(f"⚡ ボーレートネゴシエーション開始（現在: {ser.baudrate} bps）")
+    for rate in sorted(candidates, reverse=True):
+        if rate <= ser.baudrate:
+            continue
+        reply = _propose_baud_rate(ser, rate, timeout)
+        if reply != b'BAUD_ACK' and reply != b'BAUD_NAK':
+            print("   💡 ファームウェアがネゴシエーションに未対応のため打ち切ります")
+            break
+        if reply == b'BAUD_ACK':
+            kbps = _verify_baud_rate(ser, rate, timeout)
+            if kbps is not None:
+                print(f"   ✅ {rate} bps に切り替え成功（テストパターン: {kbps:.1f} KB/s）")
+                remember_baud_rate(getattr(ser, "port", None), rate, cache_file)
+                return rate
+        print(f"   ❌ {rate} bps は利用できません")
+    print(f"   ➡️ {ser.baudrate} bps のまま続行します")
+    return ser.baudrate
+
+# =============================================================================
+# フレームストリームとシンク
+# =============================================================================
+#
+# 各スクリプトの受信ループはここを通す:
+#   capture_frame()  コマンド送信 + 1フレーム受信（撮影コマンド方式）
+#   receive_frame()  コマンド無しで1フレーム受信（デバイスが送り続ける方式）
+#   iter_frames()    上記を繰り返すストリーミングイテレーター
+#   pump_frames()    イテレーターのフレームを複数のシンクへ配る
+# シンクはディスク保存（DiskSink）・キュー（QueueSink）・コールバック（CallbackSink）。
+
+TAKE_PHOTO_COMMAND = "TAKE_PHOTO"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class Frame:
+    """受信した1フレームとその受信統計"""
+
+    def __init__(self, data: bytearray, mode: str, sequence: int = 0,
+                 wait_time: float = 0.0, receive_time: float = 0.0,
+                 reads: int = 0, baud_rate: Optional[int] = None,
+                 camera: str = "default"):
+        """
+        Args:
+            data: JPEGデータ（受信バッファをコピーせずに保持する）
+            mode: フレーミング方式（MODE_MARKER / MODE_FRAMED）
+            sequence: ストリーム内の通し番号（1始まり）
+            wait_time: コマンド送信（または待機開始）からフレーム開始までの秒数
+            receive_time: フレーム開始から受信完了までの秒数
+            reads: ペイロード受信での read 回数
+            baud_rate: 受信時のボーレート
+            camera: 受信したカメラ（ポート名）
+        """
+        self.data = data
+        self.mode = mode
+        self.sequence = sequence
+        self.wait_time = wait_time
+        self.receive_time = receive_time
+        self.reads = reads
+        self.baud_rate = baud_rate
+        self.camera = camera
+        self.received_at = time.time()
+        self.path: Optional[str] = None  # DiskSink / CaptureStore が保存先を設定する
+        self.content_hash: Optional[str] = None  # CaptureStore が設定する内容ハッシュ
+        self.duplicate = False  # 保存済みのフレームとバイト単位で同一なら True
+        self.scene_key: Optional[int] = None  # 分析キャッシュで一致した場面のキー（知覚ハッシュ）
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    @property
+    def kbps(self) -> float:
+        """ペイロードの転送速度 (KB/s)"""
+        return self.size / max(self.receive_time, 1e-6) / 1024
+
+    @property
+    def name(self) -> str:
+        """表示・アップロード用のファイル名（ファイルに保存しない場合は通し番号から作る）"""
+        if self.path:
+            return os.path.basename(self.path)
+        return f"capture_{self.sequence:08d}.jpg"
+
+
+def port_label(ser) -> str:
+    """シリアル接続のラベル（ポート名、テレメトリのカメラ識別に使う）"""
+    port = getattr(ser, "port", None)
+    return os.path.basename(port) if port else "default"
+
+
+def send_command(ser, command: str) -> None:
+    """改行終端のコマンドを送信する（SerialException は呼び出し元へ）"""
+    ser.write(command.encode("ascii") + b"\n")
+    ser.flush()
+
+
+def receive_frame(ser, start_timeout: float, payload_timeout: float,
+                  receiver: Optional[FrameReceiver] = None,
+                  on_progress: Optional[Callable[[int], None]] = None,
+                  telemetry=None, expect_reply: bool = False) -> Optional[Frame]:
+    """
+    フレームの開始を待って1フレームを受信する
+
+    Args:
+        ser: シリアル接続
+        start_timeout: フレーム開始を待つ最大秒数
+        payload_timeout: ペイロードを受信する最大秒数
+        receiver: 使い回す FrameReceiver（省略時は新規作成）
+        on_progress: 受信済みバイト数を受け取るコールバック
+        telemetry: 受信結果を記録する frame_telemetry.FrameTelemetry
+        expect_reply: 撮影コマンドの応答を待っている場合True
+            （フレーム開始が来なければタイムアウトとして記録する）
+
+    Returns:
+        受信したフレーム、開始を検出できなかった場合はNone
+
+    Raises:
+        FrameError: ペイロードの受信タイムアウト・長さ超過・CRC不一致
+    """
+    receiver = receiver or FrameReceiver()
+    wait_start = time.time()
+    if not receiver.wait_for_start(ser, timeout=start_timeout):
+        if telemetry and expect_reply:
+            telemetry.record_timeout(port_label(ser))
+        return None
+    receive_start = time.time()
+    try:
+        data = receiver.read_payload(ser, payload_timeout, on_progress=on_progress)
+        if data is None:
+            raise FrameError(f"受信タイムアウト（{payload_timeout}秒）", kind="timeout")
+    except FrameError as e:
+        if telemetry:
+            telemetry.record_error(port_label(ser), e)
+        raise
+    frame = Frame(
+        data, receiver.mode,
+        wait_time=receive_start - wait_start,
+        receive_time=time.time() - receive_start,
+        reads=receiver.reads,
+        baud_rate=getattr(ser, "baudrate", None),
+        camera=port_label(ser),
+    )
+    if telemetry:
+        telemetry.record_frame(port_label(ser), frame)
+    return frame
+
+
+def capture_frame(ser, start_timeout: float, payload_timeout: float,
+                  command: str = TAKE_PHOTO_COMMAND,
+                  receiver: Optional[FrameReceiver] = None,
+                  on_progress: Optional[Callable[[int], None]] = None,
+                  telemetry=None) -> Optional[Frame]:
+    """
+    撮影コマンドを送信して1フレームを受信する
+
+    Returns:
+        受信したフレーム、デバイスが応答しない場合はNone
+
+    Raises:
+        FrameError: ペイロードの受信タイムアウト・長さ超過・CRC不一致
+    """
+    ser.reset_input_buffer()  # 前回の応答の残りを捨てる
+    if receiver is not None:
+        receiver.discard()
+    send_command(ser, command)
+    return receive_frame(ser, start_timeout, payload_timeout, receiver, on_progress,
+                         telemetry=telemetry, expect_reply=True)
+
+
+def iter_frames(ser, start_timeout: float = 1.0, payload_timeout: float = 30.0,
+                command: Optional[str] = None, max_frames: Optional[int] = None,
+                stop_event=None,
+                on_idle: Optional[Callable[[], None]] = None,
+                on_error: Optional[Callable[[FrameError], None]] = None,
+                telemetry=None) -> Iterator[Frame]:
+    """
+    フレームを受信した順に返すストリーミングイテレーター
+
+    受信バッファ（FrameReceiver）はフレーム間で使い回す。
+
+    Args:
+        ser: シリアル接続
+        start_timeout: 1回のフレーム開始待ちの秒数（この間隔で on_idle が呼ばれる）
+        payload_timeout: ペイロードを受信する最大秒数
+        command: 指定時は毎フレームこのコマンドを送ってから受信する（例: TAKE_PHOTO_COMMAND）
+        max_frames: 受信するフレーム数の上限（省略時は無制限）
+        stop_event: set() されたら終了する threading.Event
+        on_idle: フレーム開始を検出できなかった時に呼ばれるコールバック
+        on_error: FrameError 発生時のコールバック（省略時は表示して続行）
+        telemetry: 受信結果を記録する frame_telemetry.FrameTelemetry
+
+    Yields:
+        受信したフレーム（sequence は1始まりの通し番号）
+    """
+    receiver = FrameReceiver()
+    count = 0
+    while max_frames is None or count < max_frames:
+        if stop_event is not None and stop_event.is_set():
+            return
+        try:
+            if command:
+                frame = capture_frame(ser, start_timeout, payload_timeout, command, receiver,
+                                      telemetry=telemetry)
+            else:
+                frame = receive_frame(ser, start_timeout, payload_timeout, receiver,
+                                      telemetry=telemetry)
+        except FrameError as e:
+            if on_error:
+                on_error(e)
+            else:
+                print(f"❌ フレーム受信エラー: {e}")
+            continue
+        if frame is None:
+            if on_idle:
+                on_idle()
+            continue
+        count += 1
+        frame.sequence = count
+        yield frame
+
+
+def pump_frames(frames: Iterable[Frame], sinks: List["FrameSink"]) -> int:
+    """
+    フレームを各シンクに順番に渡す
+
+    Returns:
+        処理したフレーム数
+    """
+    count = 0
+    try:
+        for frame in frames:
+            for sink in sinks:
+                sink.handle(frame)
+            count += 1
+    finally:
+        for sink in sinks:
+            sink.close()
+    return count
+
+
+class RetentionManager:
+    """
+    保存ディレクトリの古いファイルを削除して容量を保つ
+
+    ディレクトリのファイル一覧は最初の1回だけ走査し、以降は古い順に並んだ
+    メモリ上のインデックス（OrderedDict）に追加していく。保存の度に
+    glob・stat・ソートをやり直さず、古いファイルを先頭から O(1) で取り出して削除する。
+
+    保持ポリシー（いずれも None なら無制限）:
+        max_files: 最大ファイル数
+        max_bytes: 合計サイズの上限
+        max_age: 最終更新からの最大秒数
+    """
+
+    def __init__(self, directory: str, max_files: Optional[int] = None,
+                 max_bytes: Optional[int] = None, max_age: Optional[float] = None,
+                 extensions: Tuple[str, ...] = IMAGE_EXTENSIONS):
+        """
+        Args:
+            directory: 対象ディレクトリ
+            max_files: 保持する最大ファイル数
+            max_bytes: 保持する合計バイト数の上限
+            max_age: 保持する最大秒数
+            extensions: 対象にするファイルの拡張子（小文字）
+        """
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.extensions = extensions
+        self.total_bytes = 0
+        self.evicted = 0
+        self._index: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()  # path -> (mtime, size)、古い順
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._index)
+
+    def set_policy(self, max_files: Optional[int] = None, max_bytes: Optional[int] = None,
+                   max_age: Optional[float] = None) -> None:
+        """指定された項目だけ保持ポリシーを更新する"""
+        with self._lock:
+            if max_files is not None:
+                self.max_files = max_files
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_age is not None:
+                self.max_age = max_age
+
+    def load(self) -> None:
+        """ディレクトリを走査してインデックスを作り直し、ポリシーを適用する（起動時に1回）"""
+        with self._lock:
+            self._loaded = False
+            self._ensure_loaded()
+            evicted = self._enforce(time.time())
+        self._report(evicted)
+
+    def add(self, path: str, size: Optional[int] = None) -> List[str]:
+        """
+        新しく保存したファイルをインデックスの末尾（最新）に追加し、ポリシーを適用する
+
+        Args:
+            path: 保存したファイルのパス
+            size: ファイルサイズ（省略時は stat で取得）
+
+        Returns:
+            削除したファイルのパス
+        """
+        now = time.time()
+        if size is None:
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                return []
+        with self._lock:
+            self._ensure_loaded()
+            self._remove_entry(path)
+            self._index[path] = (now, size)
+            self.total_bytes += size
+            evicted = self._enforce(now)
+        self._report(evicted)
+        return evicted
+
+    def discard(self, path: str) -> None:
+        """外部で削除・移動したファイルをインデックスから外す"""
+        with self._lock:
+            self._remove_entry(path)
+
+    def enforce(self) -> List[str]:
+        """現在のポリシーを適用する（max_age だけを定期的に効かせたい場合など）"""
+        with self._lock:
+            self._ensure_loaded()
+            evicted = self._enforce(time.time())
+        self._report(evicted)
+        return evicted
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.lower().endswith(self.extensions):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.is_file():
+                        entries.append((stat.st_mtime, entry.path, stat.st_size))
+        except OSError:
+            pass  # ディレクトリがまだ無い
+        entries.sort()
+        self._index = OrderedDict((path, (mtime, size)) for mtime, path, size in entries)
+        self.total_bytes = sum(size for _, _, size in entries)
+        self._loaded = True
+
+    def _remove_entry(self, path: str) -> None:
+        entry = self._index.pop(path, None)
+        if entry:
+            self.total_bytes -= entry[1]
+
+    def _over_limit(self, now: float) -> bool:
+        if self.max_files is not None and len(self._index) > self.max_files:
+            return True
+        if len(self._index) <= 1:
+            return False  # 最新のファイルはサイズ・経過時間に関わらず残す
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            return True
+        oldest_mtime = next(iter(self._index.values()))[0]
+        return self.max_age is not None and now - oldest_mtime > self.max_age
+
+    def _enforce(self, now: float) -> List[str]:
+        evicted = []
+        while self._index and self._over_limit(now):
+            path, (_, size) = self._index.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # 既に外部で削除されている
+            except OSError as e:
+                print(f"⚠️ ファイル削除失敗: {path} - {e}")
+                continue
+            evicted.append(path)
+        self.evicted += len(evicted)
+        return evicted
+
+    def _report(self, evicted: List[str]) -> None:
+        for path in evicted:
+            print(f"🗑️ 古いファイルを削除: {os.path.basename(path)}")
+        if evicted:
+            print(f"📁 {self.directory} に {len(self._index)}個のファイルが残っています")
+
+
+_retention_managers: Dict[str, RetentionManager] = {}
+_retention_lock = threading.Lock()
+
+
+def get_retention_manager(directory: str, max_files: Optional[int] = None,
+                          max_bytes: Optional[int] = None,
+                          max_age: Optional[float] = None) -> RetentionManager:
+    """
+    ディレクトリ毎に共有する RetentionManager を返す
+
+    同じディレクトリへ保存する複数のカメラスレッドが1つのインデックスを共有する。
+    既に作成済みの場合は指定された項目だけポリシーを更新する。
+    """
+    key = os.path.abspath(directory)
+    with _retention_lock:
+        manager = _retention_managers.get(key)
+        if manager is None:
+            manager = RetentionManager(directory, max_files, max_bytes, max_age)
+            _retention_managers[key] = manager
+            return manager
+    manager.set_policy(max_files, max_bytes, max_age)
+    return manager
+
+
+class FrameSink:
+    """フレームの受け渡し先の基底クラス"""
+
+    def handle(self, frame: Frame) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """ストリーム終了時の後始末（必要なシンクだけ実装する）"""
+
+
+class DiskSink(FrameSink):
+    """
+    フレームを <prefix>_<UNIX時刻>.jpg として保存する
+
+    同じ秒に複数フレームが届いた場合は _1, _2 ... を付けて上書きを避ける。
+    """
+
+    def __init__(self, output_dir: str, prefix: str = "capture",
+                 keep_files: Optional[int] = None,
+                 retention: Optional[RetentionManager] = None):
+        """
+        Args:
+            output_dir: 保存ディレクトリ
+            prefix: ファイル名の接頭辞
+            keep_files: 指定時は保存後に最新 keep_files 件以外の画像を削除する
+            retention: 保存したファイルを登録する RetentionManager
+                （省略時は keep_files 指定があればディレクトリ共有のものを使う）
+        """
+        self.output_dir = output_dir
+        self.prefix = prefix
+        if retention is None and keep_files is not None:
+            retention = get_retention_manager(output_dir, max_files=keep_files)
+        self.retention = retention
+        self.saved = 0
+
+    def handle(self, frame: Frame) -> None:
+        self.save(frame)
+
+    def save(self, frame: Frame) -> str:
+        """フレームを保存してパスを返す（frame.path にも設定する）"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        frame.path = self._unique_path(int(frame.received_at))
+        with open(frame.path, "wb") as f:
+            f.write(frame.data)
+        self.saved += 1
+        if self.retention:
+            self.retention.add(frame.path, size=frame.size)
+        return frame.path
+
+    def _unique_path(self, timestamp: int) -> str:
+        path = os.path.join(self.output_dir, f"{self.prefix}_{timestamp}.jpg")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.output_dir, f"{self.prefix}_{timestamp}_{suffix}.jpg")
+            suffix += 1
+        return path
+
+
+class QueueSink(FrameSink):
+    """
+    フレームをキューに入れる（別スレッドの処理へ渡す用）
+
+    block=True ならキューが空くまで待つ（受信側に背圧をかける）。
+    block=False で満杯の場合は最も古いフレームを捨てて新しいフレームを入れる。
+    """
+
+    def __init__(self, frame_queue, block: bool = True):
+        """
+        Args:
+            frame_queue: queue.Queue など put / get_nowait を持つキュー
+            block: 満杯時に待つか（False なら古いフレームを捨てる）
+        """
+        self.queue = frame_queue
+        self.block = block
+        self.dropped = 0
+
+    def handle(self, frame: Frame) -> None:
+        if self.block:
+            self.queue.put(frame)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class CallbackSink(FrameSink):
+    """フレーム毎に関数を呼び出す"""
+
+    def __init__(self, callback: Callable[[Frame], None]):
+        self.callback = callback
+
+    def handle(self, frame: Frame) -> None:
+        self.callback(frame)
+
+
+class WriteBehindWriter:
+    """
+    ファイル書き込みを専用スレッドで行うライトビハインド書き込み器
+
+    受信したフレームは分析・変換・送信までメモリ上のまま渡し、ディスクへの保存は
+    このスレッドが後から行う（書き込みの遅延が撮影・分析を止めない）。
+    キューが満杯になった時だけ submit() が待つ（ディスクが追いつかない場合の背圧）。
+    書き込みは一時ファイルから os.replace で置き換えるので、途中のファイルは見えない。
+    """
+
+    def __init__(self, queue_size: int = 64, name: str = "write-behind"):
+        """
+        Args:
+            queue_size: 書き込み待ちの最大件数
+            name: スレッド名
+        """
+        self.name = name
+        self.written = 0
+        self.failed = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._pending: Dict[str, int] = {}  # 書き込み待ちのパス -> 件数
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, path: str, data, on_done: Optional[Callable[[str], None]] = None) -> None:
+        """
+        path への書き込みを予約する
+
+        Args:
+            path: 保存先パス
+            data: 書き込むデータ（bytes / bytearray / memoryview。書き込み完了まで変更しないこと）
+            on_done: 書き込み成功後にこのスレッドから呼ばれる関数（引数はパス）
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            self._pending[path] = self._pending.get(path, 0) + 1
+        self._queue.put((path, data, on_done))
+
+    def is_pending(self, path: str) -> bool:
+        """path がまだ書き込み待ちか"""
+        with self._lock:
+            return path in self._pending
+
+    @property
+    def backlog(self) -> int:
+        """書き込み待ちの件数"""
+        return self._queue.unfinished_tasks
+
+    def flush(self) -> None:
+        """予約済みの書き込みが全て終わるまで待つ"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            path, data, on_done = self._queue.get()
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self.written += 1
+                if on_done:
+                    on_done(path)
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ バックグラウンド保存失敗: {path} ({e})")
+            finally:
+                with self._lock:
+                    count = self._pending.get(path, 0) - 1
+                    if count > 0:
+                        self._pending[path] = count
+                    else:
+                        self._pending.pop(path, None)
+                self._queue.task_done()
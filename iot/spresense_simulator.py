@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+疑似端末（PTY）を使ったSpresenseシミュレーター
+
+実機が無くても受信処理を動かせるように、capture_spresense_camera.ino と同じ
+シリアルプロトコルを話す仮想デバイスを疑似端末上に作る。
+TAKE_PHOTO を受け取るとディレクトリ内のJPEGを順番に START_JPEG / END_JPEG で
+囲んで送り返す（--framed の場合はバイナリフレーム方式）。SET_BAUD による
+ボーレートネゴシエーションにも応答する。
+
+疑似端末はボーレートの影響を受けないため、送信側で 1バイト=10ビット として
+ボーレート相当に間引いて書き込む。さらに書き込み単位のばらつき（分割）、
+ジッター、フレーム外のノイズ（デバッグ出力・ゴミバイト）を注入できる。
+
+使用例:
+# シミュレーターを起動して待ち受け（表示されたポートを SPRESENSE_PORT に設定）
+python spresense_simulator.py --images captured_images
+SPRESENSE_PORT=/dev/pts/3 python integrated_photo_system.py --once
+
+# 撮影コマンド無しで一定間隔に送り続ける（jpeg_saver.py 用）
+python spresense_simulator.py --auto 2
+SPRESENSE_PORT=/dev/pts/3 python jpeg_saver.py
+
+# 同一プロセス内でエンドツーエンドのフレーム遅延を計測
+python spresense_simulator.py --bench 20 --baud 921600 --jitter 0.002 --noise 0.2
+"""
+
+import argparse
+import glob
+import io
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+from typing import List, Optional
+
+import serial
+
+from spresense_io import (
+    BASE_BAUD_RATE,
+    BAUD_REVERT_WAIT,
+    BAUD_TEST_PATTERN,
+    END_MARKER,
+    START_MARKER,
+    FrameError,
+    FrameReceiver,
+    capture_frame,
+    encode_framed,
+    negotiate_baud_rate,
+)
+
+# =============================================================================
+# 設定・定数
+# =============================================================================
+
+SUPPORTED_BAUD_RATES = [921600, 1000000, 2000000]  # capture_spresense_camera.ino と同じ
+BITS_PER_BYTE = 10  # スタートビット + 8データビット + ストップビット
+DEFAULT_CHUNK_RANGE = (64, 1024)  # 1回の write で送るバイト数の範囲
+NOISE_LINES = [
+    b"Spresense: GNSS not available.",
+    b"[CAM] AE converged",
+    b"Spresense: heap free 102400 bytes",
+]
+
+def parse_chunk_range(value: str) -> tuple:
+    """'最小:最大' 形式（または単一の数値）の書き込みサイズ範囲を解析する"""
+    parts = value.split(":")
+    try:
+        low = int(parts[0])
+        high = int(parts[1]) if len(parts) > 1 else low
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"書き込みサイズは '最小:最大' で指定してください: {value}")
+    if low < 1 or high < low:
+        raise argparse.ArgumentTypeError(f"書き込みサイズの範囲が不正です: {value}")
+    return low, high
+
+def load_images(image_dir: Optional[str]) -> List[bytes]:
+    """ディレクトリ内のJPEGを名前順に読み込む（無ければ合成画像を1枚作る）"""
+    images = []
+    if image_dir:
+        paths = sorted(glob.glob(os.path.join(image_dir, "*.jpg")) +
+                       glob.glob(os.path.join(image_dir, "*.jpeg")))
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            if END_MARKER in data:
+                print(f"⚠️ {os.path.basename(path)} は END_JPEG を含むためスキップします")
+                continue
+            images.append(data)
+    if not images:
+        images.append(make_test_jpeg())
+    return images
+
+def make_test_jpeg(width: int = 320, height: int = 240) -> bytes:
+    """QVGAのテスト用JPEGを生成する（実機の撮影サイズに合わせる）"""
+    try:
+        from PIL import Image
+    except ImportError:
+        # Pillow が無い環境では JPEG の SOI/EOI だけ整えたダミーデータを使う
+        body = bytes(random.Random(0).getrandbits(8) for _ in range(12 * 1024))
+        return b'\xff\xd8' + body.replace(END_MARKER, b'') + b'\xff\xd9'
+    # 実機のQVGA JPEG（20KB前後）に近いサイズになるよう弱いノイズにする
+    image = Image.effect_noise((width, height), 8).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+# =============================================================================
+# シミュレーター本体
+# =============================================================================
+
+class SimulatedSpresense:
+    """
+    疑似端末上で動く仮想Spresense
+
+    start() で疑似端末を作ってデバイス側スレッドを起動し、port のパスを
+    serial.Serial で開けば実機と同じように通信できる。
+    """
+
+    def __init__(self, images: List[bytes], baud_rate: int = BASE_BAUD_RATE,
+                 chunk_range: tuple = DEFAULT_CHUNK_RANGE, jitter: float = 0.0,
+                 noise: float = 0.0, framed: bool = False,
+                 auto_interval: Optional[float] = None, negotiation: bool = True,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            images: 送信するJPEGデータ（順番に繰り返す）
+            baud_rate: 起動時のボーレート（送信速度の上限）
+            chunk_range: 1回の write で送るバイト数の (最小, 最大)
+            jitter: write 毎に加える遅延の最大秒数
+            noise: フレームの前後にノイズを挟む確率（0〜1）
+            framed: True の場合はバイナリフレーム方式で送る
+            auto_interval: 指定時は撮影コマンド無しでこの間隔（秒）で送り続ける
+            negotiation: False の場合は旧ファームウェアとして SET_BAUD を拒否する
+            seed: 乱数シード（分割・ジッター・ノイズを再現したい場合）
+        """
+        if not images:
+            raise ValueError("送信する画像がありません")
+        self.images = images
+        self.base_baud_rate = baud_rate
+        self.baud_rate = baud_rate
+        self.chunk_range = chunk_range
+        self.jitter = jitter
+        self.noise = noise
+        self.framed = framed
+        self.auto_interval = auto_interval
+        self.negotiation = negotiation
+        self.random = random.Random(seed)
+
+        self.port: Optional[str] = None
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.last_payload: Optional[bytes] = None
+        self._master_fd: Optional[int] = None
+        self._slave_fd: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._baud_deadline: Optional[float] = None  # ネゴシエーション中の確認期限
+
+    def start(self) -> str:
+        """疑似端末を作成してデバイス側スレッドを起動し、ポートのパスを返す"""
+        self._master_fd, self._slave_fd = pty.openpty()
+        # 改行変換やエコーが入らないよう両端を raw にする
+        tty.setraw(self._master_fd)
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._serve, name="spresense-sim", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self) -> None:
+        """デバイス側スレッドを止めて疑似端末を閉じる"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master_fd = self._slave_fd = None
+
+    def __enter__(self) -> "SimulatedSpresense":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    # -------------------------------------------------------------------------
+    # デバイス側ループ
+    # -------------------------------------------------------------------------
+
+    def _serve(self) -> None:
+        """コマンドを受け付けて応答する（capture_spresense_camera.ino の loop() 相当）"""
+        self._println(b"Spresense: System initializing...")
+        self._println(b"Spresense: Camera ready. Starting capture loop...")
+        pending = bytearray()
+        next_auto = time.time() + (self.auto_interval or 0)
+        while not self._stop_event.is_set():
+            try:
+                readable, _, _ = select.select([self._master_fd], [], [], 0.05)
+                if readable:
+                    pending += os.read(self._master_fd, 1024)
+            except OSError:
+                return  # 疑似端末が閉じられた
+
+            while b'\n' in pending:
+                line, _, rest = bytes(pending).partition(b'\n')
+                pending = bytearray(rest)
+                self._handle_command(line.strip().decode(errors="replace"))
+
+            if self._baud_deadline and time.time() > self._baud_deadline:
+                # BAUD_CONFIRM が来なかったので元のレートに戻す
+                self._baud_deadline = None
+                self.baud_rate = self.base_baud_rate
+
+            if self.auto_interval is not None and time.time() >= next_auto:
+                self._send_picture()
+                next_auto = time.time() + self.auto_interval
+
+    def _handle_command(self, command: str) -> None:
+        """1行分のコマンドを処理する"""
+        if self._baud_deadline:
+            # ボーレート切り替え直後は BAUD_TEST / BAUD_CONFIRM だけを受け付ける
+            if command == "BAUD_TEST":
+                self._write(b"BAUD_TEST:" + BAUD_TEST_PATTERN + b"\r\n")
+            elif command == "BAUD_CONFIRM":
+                self._baud_deadline = None
+                self.base_baud_rate = self.baud_rate
+                self._println(b"BAUD_OK")
+            return
+
+        self._println(f"Spresense: Received command: '{command}'".encode())
+        if command == "TAKE_PHOTO":
+            self._println(b"Spresense: Command recognized! Taking picture...")
+            self._send_picture()
+        elif command.startswith("SET_BAUD ") and self.negotiation:
+            try:
+                rate = int(command[len("SET_BAUD "):])
+            except ValueError:
+                rate = 0
+            if rate in SUPPORTED_BAUD_RATES:
+                self._println(f"BAUD_ACK {rate}".encode())
+                self.baud_rate = rate
+                self._baud_deadline = time.time() + BAUD_REVERT_WAIT
+            else:
+                self._println(f"BAUD_NAK {rate}".encode())
+        else:
+            self._println(b"Spresense: Unknown command.")
+
+    def _send_picture(self) -> None:
+        """次のJPEGをフレームとして送信する"""
+        payload = self.images[self.frames_sent % len(self.images)]
+        self.last_payload = payload  # 受信側が送信完了より先に照合する場合があるため先に記録する
+        self._inject_noise()
+        self._println(f"Spresense: Picture taken. Size: {len(payload)} bytes.".encode())
+        if self.framed:
+            self._write(encode_framed(payload))
+        else:
+            self._write(START_MARKER + b"\r\n" + payload + b"\r\n" + END_MARKER + b"\r\n")
+        self._inject_noise()
+        self._println(b"Spresense: Data sent to Mac.")
+        self.frames_sent += 1
+
+    def _inject_noise(self) -> None:
+        """フレームの外側にデバッグ出力やゴミバイトを混ぜる"""
+        if self.noise <= 0 or self.random.random() >= self.noise:
+            return
+        if self.random.random() < 0.5:
+            self._println(self.random.choice(NOISE_LINES))
+        else:
+            garbage = bytes(self.random.getrandbits(8) for _ in range(self.random.randint(1, 64)))
+            self._write(garbage.replace(b"S", b"s"))  # マーカー・マジックの先頭にならないようにする
+
+    # -------------------------------------------------------------------------
+    # 送信（ボーレート相当の速度制限付き）
+    # -------------------------------------------------------------------------
+
+    def _println(self, line: bytes) -> None:
+        self._write(line + b"\r\n")
+
+    def _write(self, data: bytes) -> None:
+        """書き込みサイズをばらつかせながら、現在のボーレート相当の速度で送る"""
+        view = memoryview(data)
+        start = time.perf_counter()
+        sent = 0
+        low, high = self.chunk_range
+        while sent < len(view) and not self._stop_event.is_set():
+            size = self.random.randint(low, high)
+            try:
+                written = os.write(self._master_fd, view[sent:sent + size])
+            except OSError:
+                return
+            sent += written
+            self.bytes_sent += written
+            # 送信済みバイト数から計算した時刻まで待つ（ボーレートの上限を再現）
+            due = start + sent * BITS_PER_BYTE / self.baud_rate
+            if self.jitter:
+                due += self.random.uniform(0, self.jitter)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+# =============================================================================
+# ベンチマーク
+# =============================================================================
+
+def percentile(values: List[float], ratio: float) -> float:
+    """ソート済みでないリストのパーセンタイル（最近傍法）"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(ratio * (len(ordered) - 1)))))
+    return ordered[index]
+
+def run_benchmark(sim: SimulatedSpresense, frames: int, negotiate: bool = False,
+                  timeout: float = 30.0) -> bool:
+    """
+    シミュレーターに TAKE_PHOTO を送り、コマンド送信から受信完了までの遅延を計測する
+
+    受信は各スクリプトと同じ spresense_io.capture_frame() を通す。
+
+    Returns:
+        全フレームを正しく受信できた場合True
+    """
+    ser = serial.Serial(sim.port, BASE_BAUD_RATE, timeout=1.0)
+    try:
+        time.sleep(0.2)
+        ser.reset_input_buffer()
+        if negotiate:
+            negotiate_baud_rate(ser)
+
+        latencies = []
+        total_bytes = 0
+        errors = 0
+        receiver = FrameReceiver()
+        for i in range(frames):
+            started = time.perf_counter()
+            payload = None
+            try:
+                frame = capture_frame(ser, timeout, timeout, receiver=receiver)
+                payload = frame.data if frame else None
+            except FrameError as e:
+                print(f"❌ フレーム {i + 1}: 受信エラー {e}")
+            elapsed = time.perf_counter() - started
+
+            if payload is None or bytes(payload) != sim.last_payload:
+                errors += 1
+                print(f"❌ フレーム {i + 1}: 受信失敗またはデータ不一致")
+                continue
+            latencies.append(elapsed)
+            total_bytes += len(payload)
+            print(f"   📷 フレーム {i + 1}/{frames}: {len(payload)} bytes, {elapsed * 1000:.1f} ms")
+
+        if latencies:
+            busy = sum(latencies)
+            theoretical = sim.baud_rate / BITS_PER_BYTE / 1024
+            print("=" * 60)
+            print(f"📊 受信成功 {len(latencies)}/{frames} フレーム（{sim.baud_rate} bps, "
+                  f"{'framed' if sim.framed else 'marker'}）")
+            print(f"⏱️ 遅延 p50: {percentile(latencies, 0.5) * 1000:.1f} ms, "
+                  f"p95: {percentile(latencies, 0.95) * 1000:.1f} ms, "
+                  f"max: {max(latencies) * 1000:.1f} ms")
+            print(f"📈 実効スループット: {total_bytes / 1024 / busy:.1f} KB/s "
+                  f"（理論値 {theoretical:.1f} KB/s）")
+            print("=" * 60)
+        return errors == 0
+    finally:
+        ser.close()
+
+# =============================================================================
+# コマンドラインインターフェース
+# =============================================================================
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="疑似端末を使ったSpresenseシミュレーター")
+    parser.add_argument('--images', default="captured_images",
+                        help='送信するJPEGのディレクトリ（無い・空の場合は合成画像）')
+    parser.add_argument('--baud', type=int, default=BASE_BAUD_RATE,
+                        help='送信速度の上限とするボーレート（既定: 115200）')
+    parser.add_argument('--chunk', type=parse_chunk_range, default=DEFAULT_CHUNK_RANGE,
+                        help="1回の書き込みサイズの範囲 '最小:最大'（既定: 64:1024）")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='書き込み毎に加える遅延の最大秒数（既定: 0）')
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help='フレーム前後にノイズを挟む確率 0〜1（既定: 0）')
+    parser.add_argument('--framed', action='store_true',
+                        help='バイナリフレーム方式（SPJFヘッダー + CRC32）で送る')
+    parser.add_argument('--no-negotiation', action='store_true',
+                        help='旧ファームウェアとして SET_BAUD を拒否する')
+    parser.add_argument('--auto', type=float, default=None, metavar='SECONDS',
+                        help='撮影コマンド無しで指定間隔ごとに送り続ける（jpeg_saver.py 用）')
+    parser.add_argument('--link', default=None,
+                        help='疑似端末へのシンボリックリンクを作るパス（例: /tmp/spresense）')
+    parser.add_argument('--seed', type=int, default=None, help='乱数シード')
+    parser.add_argument('--bench', type=int, default=0, metavar='FRAMES',
+                        help='待ち受けせずに指定フレーム数の遅延ベンチマークを実行する')
+    parser.add_argument('--bench-negotiate', action='store_true',
+                        help='ベンチマーク前にボーレートネゴシエーションを行う')
+    return parser.parse_args(argv)
+
+def main():
+    """メイン実行関数"""
+    args = parse_args()
+    images = load_images(args.images)
+    sim = SimulatedSpresense(
+        images,
+        baud_rate=args.baud,
+        chunk_range=args.chunk,
+        jitter=args.jitter,
+        noise=args.noise,
+        framed=args.framed,
+        auto_interval=None if args.bench else args.auto,
+        negotiation=not args.no_negotiation,
+        seed=args.seed,
+    )
+    port = sim.start()
+    print("🧪 Spresenseシミュレーター起動")
+    print(f"🔌 ポート: {port}")
+    print(f"🖼️ 画像: {len(images)}枚, ⚡ {args.baud} bps, 📦 書き込み {args.chunk[0]}〜{args.chunk[1]} bytes")
+
+    try:
+        if args.bench:
+            ok = run_benchmark(sim, args.bench, negotiate=args.bench_negotiate)
+            raise SystemExit(0 if ok else 1)
+
+        if args.link:
+            if os.path.islink(args.link):
+                os.remove(args.link)
+            os.symlink(port, args.link)
+            print(f"🔗 {args.link} -> {port}")
+        print(f"💡 例: SPRESENSE_PORT={args.link or port} python integrated_photo_system.py --once")
+        print("🛑 終了するには Ctrl+C を押してください")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"\n👋 シミュレーターを終了します（送信: {sim.frames_sent}フレーム, {sim.bytes_sent} bytes）")
+    finally:
+        sim.stop()
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+
+if __name__ == "__main__":
+    main()